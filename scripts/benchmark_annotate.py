@@ -0,0 +1,91 @@
+'''Compare the time taken to annotate a structure by row-wise apply and by lookup tables.
+
+Usage: python scripts/benchmark_annotate.py PDB_PATH ALPHA BETA [ANTIGEN MHC1 MHC2] [--repeats N]
+
+The row-wise implementation is the one `annotate_tcr_pmhc_df` used before it switched to lookup tables, kept here as
+a reference. Both annotations are checked to be identical.
+
+'''
+import argparse
+import time
+
+import pandas as pd
+
+from tcr_pmhc_interface_analysis.imgt_numbering import IMGT_MHC_ABD, assign_cdr_number
+from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('pdb_path', help='path to a (preferably large) TCR-pMHC structure')
+parser.add_argument('chains', nargs='+', help='alpha, beta, antigen, MHC chain 1, and MHC chain 2 IDs (in order)')
+parser.add_argument('--repeats', type=int, default=5, help='number of times each annotation is timed')
+
+
+def annotate_tcr_pmhc_df_rowwise(structure_df: pd.DataFrame,
+                                 alpha_chain_id: str = None,
+                                 beta_chain_id: str = None,
+                                 antigen_chain_id: str = None,
+                                 mhc_chain1_id: str = None,
+                                 mhc_chain2_id: str = None) -> pd.DataFrame:
+    def assign_chain_type(chain_id: str) -> str | None:
+        if chain_id == alpha_chain_id:
+            return 'alpha_chain'
+
+        if chain_id == beta_chain_id:
+            return 'beta_chain'
+
+        if chain_id == antigen_chain_id:
+            return 'antigen_chain'
+
+        if chain_id == mhc_chain1_id:
+            return 'mhc_chain1'
+
+        if chain_id == mhc_chain2_id:
+            return 'mhc_chain2'
+
+        return None
+
+    structure_df = structure_df.copy()
+    structure_df['chain_type'] = structure_df['chain_id'].map(assign_chain_type)
+
+    structure_df['cdr'] = structure_df.apply(
+        lambda row: (assign_cdr_number(row.residue_seq_id)
+                     if row.chain_type == 'alpha_chain' or row.chain_type == 'beta_chain' else None),
+        axis=1,
+    )
+
+    structure_df['mhc_abd'] = structure_df.apply(
+        lambda row: row.residue_seq_id in IMGT_MHC_ABD and row.chain_type == 'mhc_chain1',
+        axis=1,
+    )
+
+    return structure_df
+
+
+def time_annotation(annotate, structure_df, chains, repeats):
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        annotated_df = annotate(structure_df, *chains)
+
+    return (time.perf_counter() - start) / repeats, annotated_df
+
+
+def main():
+    args = parser.parse_args()
+
+    structure_df = load_structure(args.pdb_path)
+
+    rowwise_time, expected = time_annotation(annotate_tcr_pmhc_df_rowwise, structure_df, args.chains, args.repeats)
+    lookup_time, annotated_df = time_annotation(annotate_tcr_pmhc_df, structure_df, args.chains, args.repeats)
+
+    pd.testing.assert_frame_equal(annotated_df, expected, check_exact=True)
+
+    print(f'Annotated {len(structure_df)} atoms')
+    print(f'row-wise: {rowwise_time * 1000:.1f} ms')
+    print(f'lookup tables: {lookup_time * 1000:.1f} ms')
+    print(f'speedup: {rowwise_time / lookup_time:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''Compare the time taken to parse PDB files by python_pdb and the vectorised reader.
+
+Usage: python scripts/benchmark_pdb_reader.py STCRDAB_PATH [--limit N]
+
+Every file under ``STCRDAB_PATH/imgt`` (or STCRDAB_PATH itself if it has no imgt directory) is parsed by both readers,
+checking the dataframes are identical.
+
+'''
+import argparse
+import glob
+import os
+import time
+
+import pandas as pd
+from python_pdb.parsers import parse_pdb_to_pandas as parse_pdb_to_pandas_by_line
+
+from tcr_pmhc_interface_analysis.pdb_reader import parse_pdb_to_pandas
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('stcrdab', help='path to the STCRDab (or any directory of pdb files)')
+parser.add_argument('--limit', type=int, help='only benchmark the first N files')
+
+
+def main():
+    args = parser.parse_args()
+
+    pdb_dir = os.path.join(args.stcrdab, 'imgt')
+    if not os.path.isdir(pdb_dir):
+        pdb_dir = args.stcrdab
+
+    pdb_paths = sorted(glob.glob(os.path.join(pdb_dir, '**', '*.pdb'), recursive=True))[:args.limit]
+
+    by_line_time = 0.0
+    vectorised_time = 0.0
+    num_atoms = 0
+
+    for pdb_path in pdb_paths:
+        with open(pdb_path, 'r') as fh:
+            contents = fh.read()
+
+        start = time.perf_counter()
+        expected = parse_pdb_to_pandas_by_line(contents)
+        by_line_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        structure_df = parse_pdb_to_pandas(contents)
+        vectorised_time += time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(structure_df, expected, check_exact=True)
+        num_atoms += len(structure_df)
+
+    print(f'Parsed {len(pdb_paths)} files ({num_atoms} atoms)')
+    print(f'python_pdb: {by_line_time:.2f} s')
+    print(f'vectorised: {vectorised_time:.2f} s')
+
+    if vectorised_time > 0:
+        print(f'speedup: {by_line_time / vectorised_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -46,3 +46,92 @@ def align_tcrs(tcr_mobile_df: pd.DataFrame, tcr_target_df: pd.DataFrame) -> pd.D
     target_coords = np.array(target_coords)
 
     return align_pandas_structure(mobile_coords, target_coords, tcr_mobile_df)
+
+
+def compute_superpositions(mobile_coords: np.ndarray, target_coords: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Compute the rotations and translations that superimpose stacks of mobile coordinates onto target coordinates.
+
+    All superpositions are computed at once using batched matrix operations. The transforms are applied as
+    ``coords @ rotation + translation``, following the convention of `python_pdb.aligners.align_pandas_structure`.
+
+    Args:
+        mobile_coords: array of shape (..., num_atoms, 3)
+        target_coords: array of shape (..., num_atoms, 3), broadcast against the mobile coordinates
+
+    Returns:
+        rotation matrices of shape (..., 3, 3) and translation vectors of shape (..., 3)
+
+    '''
+    mobile_average = mobile_coords.mean(axis=-2)
+    target_average = target_coords.mean(axis=-2)
+
+    correlation = np.einsum('...ai,...aj->...ij',
+                            mobile_coords - mobile_average[..., np.newaxis, :],
+                            target_coords - target_average[..., np.newaxis, :])
+    u, _, vt = np.linalg.svd(correlation)
+    rotation = u @ vt
+
+    # check if we have found any reflections
+    reflections = np.linalg.det(rotation) < 0
+    if np.any(reflections):
+        vt[reflections, 2] = -vt[reflections, 2]
+        rotation = u @ vt
+
+    translation = target_average - np.einsum('...i,...ij->...j', mobile_average, rotation)
+
+    return rotation, translation
+
+
+def compute_superposition(mobile_coords: np.ndarray, target_coords: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Compute the rotation and translation that superimpose the mobile coordinates onto the target coordinates.'''
+    rotation, translation = compute_superpositions(mobile_coords[np.newaxis], target_coords[np.newaxis])
+
+    return rotation[0], translation[0]
+
+
+def align_coords(mobile_coords: np.ndarray, target_coords: np.ndarray, coords_to_move: np.ndarray) -> np.ndarray:
+    '''Superimpose the mobile coordinates onto the target and apply the same transform to another set of coordinates.'''
+    rotation, translation = compute_superposition(mobile_coords, target_coords)
+
+    return coords_to_move @ rotation + translation
+
+
+def compute_pairwise_rmsds(coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+    '''Compute the RMSD between every pair of two stacks of coordinates after superimposing them.
+
+    Args:
+        coords_a: array of shape (num_a, num_atoms, 3)
+        coords_b: array of shape (num_b, num_atoms, 3)
+
+    Returns:
+        array of shape (num_a, num_b) with the RMSD of each pair after superimposing the first onto the second
+
+    '''
+    mobile_coords = coords_a[:, np.newaxis]
+    target_coords = coords_b[np.newaxis, :]
+
+    rotations, translations = compute_superpositions(mobile_coords, target_coords)
+    aligned_coords = np.einsum('...ai,...ij->...aj', mobile_coords, rotations) + translations[..., np.newaxis, :]
+
+    return np.sqrt(((aligned_coords - target_coords) ** 2).sum(axis=-1).mean(axis=-1))
+
+
+def transform_segments(coords: np.ndarray,
+                       offsets: np.ndarray,
+                       rotations: np.ndarray,
+                       translations: np.ndarray) -> np.ndarray:
+    '''Apply a different transform to each contiguous segment of a coordinate array.
+
+    Args:
+        coords: array of shape (num_atoms, 3)
+        offsets: start of each segment followed by the end of the last segment, relative to the start of `coords`
+        rotations: rotation matrix for each segment
+        translations: translation vector for each segment
+
+    Returns:
+        transformed coordinates
+
+    '''
+    segment_index = np.repeat(np.arange(len(rotations)), np.diff(offsets))
+
+    return np.einsum('ni,nij->nj', coords, rotations[segment_index]) + translations[segment_index]
@@ -0,0 +1,266 @@
+'''Write tables of results in batches of rows as they are produced.
+
+Apps that produce many rows hand them to a `TableWriter` instead of holding every row until the end. Rows are appended
+to the output file every ``batch_size`` rows, as CSV lines or as a Parquet row group, which bounds the memory used and
+keeps the rows written so far if a run stops early. CSV files can be read while they are still being written, whereas
+Parquet files are only readable once the writer is closed.
+
+Parquet files are written with explicit column types, which can differ from those of the CSV files, such as categoricals
+for columns with few distinct values and single precision measurements. Loading them needs no type inference and can be
+restricted to the columns needed, eg ``pd.read_parquet(path, columns=[...])``. A Parquet table can also be partitioned,
+written as a directory with a sub-directory for every value of the partition columns (eg ``complex_id=1ao7/``), which
+``pd.read_parquet`` reads back as one table.
+
+CSV files are compressed according to the extension of their path, as by `pandas.DataFrame.to_csv`: ``.gz``, ``.bz2``,
+``.xz`` or ``.zst``.
+
+Writing Parquet files needs pyarrow, which is optional, and writing ``.zst`` files needs zstandard.
+
+'''
+import bz2
+import glob
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import urllib.parse
+from argparse import ArgumentParser
+
+import pandas as pd
+
+OUTPUT_FORMATS = ['csv', 'parquet']
+
+
+def add_output_arguments(parser: ArgumentParser, infer_format: bool = True) -> None:
+    '''Add output format arguments to parser.
+
+    Args:
+        parser: parser of the command line application
+        infer_format: whether the format defaults to the one given by the extension of the output path, else to CSV
+
+    '''
+    default = "'parquet' if the output path ends in '.parquet', else 'csv'" if infer_format else "'csv'"
+
+    output_group = parser.add_argument_group('Output', 'Options for the format of output tables')
+    output_group.add_argument('--format', choices=OUTPUT_FORMATS,
+                              help=f'format of output tables, Parquet needs pyarrow (Default: {default})')
+
+
+def get_output_format(path: str | None, file_format: str | None = None) -> str:
+    '''Get the format of an output file, the one given or else from its extension, CSV unless it ends in '.parquet'.'''
+    if file_format is not None:
+        return file_format
+
+    return 'parquet' if path is not None and path.endswith('.parquet') else 'csv'
+
+
+def _open_zstandard(path: str, mode: str, **kwargs):
+    try:
+        import zstandard
+
+    except ImportError:
+        raise ImportError('zstandard is needed to write .zst files, install it with `pip install zstandard`')
+
+    return zstandard.open(path, mode, **kwargs)
+
+
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open, '.zst': _open_zstandard}
+'''Functions opening compressed CSV files, by the extension of their path.'''
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tar.bz2', '.tar.xz', '.tar.zst')
+
+
+def open_csv(path: str, mode: str = 'w'):
+    '''Open a CSV file in text mode, compressed if its path ends in one of the extensions of `COMPRESSED_OPENERS`.'''
+    path = os.fspath(path)
+
+    for extension, opener in COMPRESSED_OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, mode + 't', newline='')
+
+    return open(path, mode, newline='')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+    except ImportError:
+        raise ImportError('pyarrow is needed to write Parquet files, install it with `pip install pyarrow`')
+
+    return pa, pq
+
+
+class TableWriter:
+    '''Write the rows of a table to a CSV or Parquet file in batches.
+
+    Use as a context manager, rows still waiting when the context exits are written and the file is closed. A table
+    without any rows is written with its columns only.
+
+    Args:
+        path: path to the output file, CSV tables are written to the standard output if None and compressed
+            according to the extension of the path
+        columns: columns of the table, in order
+        dtypes: data types of (some of) the columns, applied to every batch so they all have the same types
+        file_format: either 'csv' or 'parquet'
+        batch_size: number of rows gathered before they are written
+        parquet_dtypes: data types of (some of) the columns in Parquet files, replacing those of `dtypes`, eg
+            'category' or 'float32'
+        partition_cols: columns to partition Parquet tables by, the table is then written as a directory
+
+    '''
+    def __init__(self,
+                 path: str | None,
+                 columns: list[str],
+                 dtypes: dict[str, str] | None = None,
+                 file_format: str = 'csv',
+                 batch_size: int = 10_000,
+                 parquet_dtypes: dict[str, str] | None = None,
+                 partition_cols: list[str] | None = None):
+        if file_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format '{file_format}', expected one of {OUTPUT_FORMATS}")
+
+        if file_format == 'parquet' and path is None:
+            raise ValueError('an output path is needed to write Parquet files')
+
+        if partition_cols and file_format != 'parquet':
+            raise ValueError('only Parquet tables can be partitioned')
+
+        # Archives hold whole files, so they can not be appended to in batches
+        if file_format == 'csv' and path is not None and os.fspath(path).endswith(ARCHIVE_EXTENSIONS):
+            raise ValueError(f'{path} can not be written in batches, compress it with one of '
+                             f'{list(COMPRESSED_OPENERS)}')
+
+        self.path = path
+        self.columns = list(columns)
+        self.dtypes = {column: dtype for column, dtype in (dtypes or {}).items() if column in self.columns}
+        self.file_format = file_format
+        self.batch_size = batch_size
+
+        if file_format == 'parquet':
+            self.dtypes |= {column: dtype for column, dtype in (parquet_dtypes or {}).items() if column in self.columns}
+
+        self.partition_cols = list(partition_cols or [])
+
+        self._pending = []
+        self._num_pending = 0
+        self._file = None
+        self._parquet_writer = None
+        self._schema = None
+        self._num_batches = 0
+
+    def __enter__(self) -> 'TableWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, rows: pd.DataFrame) -> None:
+        '''Add rows to the table, writing them out once at least `batch_size` rows are waiting.'''
+        if len(rows) == 0:
+            return
+
+        self._pending.append(rows.loc[:, self.columns])
+        self._num_pending += len(rows)
+
+        if self._num_pending >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        '''Write all waiting rows.'''
+        if self._num_pending == 0:
+            return
+
+        batch = pd.concat(self._pending, ignore_index=True) if len(self._pending) > 1 else self._pending[0]
+
+        self._pending = []
+        self._num_pending = 0
+
+        self._write_batch(batch)
+
+    def close(self) -> None:
+        '''Write all waiting rows (or the columns of an empty table) and close the file.'''
+        self.flush()
+
+        if self._num_batches == 0:
+            self._write_batch(pd.DataFrame({column: [] for column in self.columns}, dtype=object))
+
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+
+        self._file = None
+
+    def _write_batch(self, batch: pd.DataFrame) -> None:
+        batch = batch.astype(self.dtypes)
+        self._num_batches += 1
+
+        if self.file_format == 'csv':
+            self._write_csv(batch)
+
+        else:
+            self._write_parquet(batch)
+
+    def _write_csv(self, batch: pd.DataFrame) -> None:
+        header = self._file is None
+
+        if self._file is None:
+            self._file = sys.stdout if self.path is None else open_csv(self.path)
+
+        batch.to_csv(self._file, header=header, index=False)
+        self._file.flush()
+
+    def _write_parquet(self, batch: pd.DataFrame) -> None:
+        pa, pq = _import_pyarrow()
+
+        # Strings are typed explicitly so that columns of only missing values keep the same type in every row group
+        batch = batch.astype({column: 'string' for column in batch.columns if batch[column].dtype == object})
+
+        if self._schema is None:
+            self._schema = pa.Schema.from_pandas(batch, preserve_index=False)
+
+            # The categories of each batch differ, so categoricals are stored as dictionaries of any strings
+            for index, field in enumerate(self._schema):
+                if isinstance(batch[field.name].dtype, pd.CategoricalDtype):
+                    self._schema = self._schema.set(index, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+
+        if self.partition_cols:
+            self._write_partitions(batch)
+            return
+
+        table = pa.Table.from_pandas(batch, schema=self._schema, preserve_index=False)
+
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, self._schema)
+
+        self._parquet_writer.write_table(table)
+
+    def _write_partitions(self, batch: pd.DataFrame) -> None:
+        pa, pq = _import_pyarrow()
+
+        if self._num_batches == 1:
+            os.makedirs(self.path, exist_ok=True)
+
+            # Partitions of an earlier run are replaced, as the file of an unpartitioned table would be
+            for partition_path in glob.glob(os.path.join(self.path, f'{self.partition_cols[0]}=*')):
+                shutil.rmtree(partition_path)
+
+        # The values of the partition columns are given by the directories (hive partitioning)
+        schema = self._schema
+        for column in self.partition_cols:
+            schema = schema.remove(schema.get_field_index(column))
+
+        for values, partition_df in batch.groupby(self.partition_cols, sort=False, observed=True, dropna=False):
+            partition_path = os.path.join(self.path, *(f'{column}={urllib.parse.quote(str(value), safe="")}'
+                                                       for column, value in zip(self.partition_cols, values)))
+            os.makedirs(partition_path, exist_ok=True)
+
+            # Batches are written to their own files, numbered so that reading them back keeps the order of the rows
+            table = pa.Table.from_pandas(partition_df.drop(columns=self.partition_cols), schema=schema,
+                                         preserve_index=False)
+            pq.write_table(table, os.path.join(partition_path, f'part-{self._num_batches:06d}.parquet'))
@@ -0,0 +1,39 @@
+from argparse import ArgumentParser, ArgumentTypeError
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    '''Parse a shard given as 'i/N' into the shard number (starting from 1) and the total number of shards.'''
+    try:
+        shard_number, num_shards = (int(part) for part in value.split('/'))
+
+    except ValueError:
+        raise ArgumentTypeError(f"invalid shard '{value}', expected the form i/N")
+
+    if not 1 <= shard_number <= num_shards:
+        raise ArgumentTypeError(f"invalid shard '{value}', i must be between 1 and N")
+
+    return shard_number, num_shards
+
+
+def add_shard_arguments(parser: ArgumentParser, items: str) -> None:
+    '''Add sharding arguments to parser.
+
+    Args:
+        parser: parser of the command line application
+        items: description of what is split between the shards for the help message
+
+    '''
+    shard_group = parser.add_argument_group('Sharding', 'Options for splitting the work between independent runs')
+    shard_group.add_argument('--shard', type=parse_shard, metavar='i/N',
+                             help=(f'only process the i-th of N contiguous slices of the {items}. '
+                                   'The outputs of all N shards are combined with merge_shards'))
+
+
+def select_shard(items: list, shard: tuple[int, int]) -> list:
+    '''Select the contiguous slice of items belonging to a shard, the slices differ in size by at most one item.'''
+    shard_number, num_shards = shard
+
+    start = len(items) * (shard_number - 1) // num_shards
+    stop = len(items) * shard_number // num_shards
+
+    return items[start:stop]
@@ -8,6 +8,15 @@ Based on the definition from Comparative Analysis of the CDR Loops of Antigen Re
 sequences within the density clusters. The other clusters will be refered to as pseudo-clusters, as these may just be
 the effect of the same loop finding the same conformation.
 
+Distance matrices can be given either as full text matrices (optionally gzipped) or as condensed binary ``.npy`` files,
+which are memory mapped when loaded. Sparse nearest neighbour graphs (``.npz``) are clustered without building the full
+matrix, treating any pair missing from the graph as far apart. Their clusters can differ from those of the full matrix,
+see `cluster_distance_graph`. Infinite distances in full matrices, such as pairs abandoned early by
+``compute_pw_distances --max-dist``, are also treated as far apart.
+
+With ``--format parquet`` the clusters are written as Parquet, with the chain types, clusters and cluster types as
+categoricals and the CDR numbers as integers.
+
 '''
 import argparse
 import logging
@@ -17,14 +26,26 @@ import sys
 import hdbscan
 import numpy as np
 import pandas as pd
+import scipy.sparse
 from python_pdb.formats.residue import THREE_TO_ONE_CODE
-from python_pdb.parsers import parse_pdb_to_pandas
+from scipy.sparse import csgraph
 
 from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
+from tcr_pmhc_interface_analysis.apps._output import TableWriter, add_output_arguments, get_output_format
+from tcr_pmhc_interface_analysis.distance_matrices import load_distance_matrix
 from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
 
 logger = logging.getLogger()
 
+PARQUET_DTYPES = {
+    'cluster': 'category',
+    'chain_type': 'category',
+    'cdr': 'int64',
+    'cluster_type': 'category',
+}
+'''Data types of the columns of the clusters written as Parquet.'''
+
 parser = argparse.ArgumentParser(prog=f'python -m {sys.modules[__name__].__spec__.name}',
                                  description=__doc__,
                                  formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -32,11 +53,12 @@ parser = argparse.ArgumentParser(prog=f'python -m {sys.modules[__name__].__spec_
 
 parser.add_argument('structure_names', help='path to the structure names file')
 parser.add_argument('distance_matrices', nargs='+', help='paths to the distance matrices')
-parser.add_argument('--output', '-o', help='output path')
+parser.add_argument('--output', '-o', help='output path (Default: CSV to the standard output)')
 parser.add_argument('--assign-cluster-types', action='store_true',
                     help='assign cluster types (requires --stcrdab-path input)')
 parser.add_argument('--stcrdab-path', required=False, help='path to the STCRDab')
 
+add_output_arguments(parser)
 add_logging_arguments(parser)
 
 
@@ -48,8 +70,7 @@ def get_sequence(df):
 def get_cdr_sequences(names: list[str], stcrdab_path: str) -> pd.DataFrame:
     '''Get CDR Sequences for a list of structure names (format: <pdb_id>_<alpha_chain_id><beta_chain_id>).'''
     def load_cdrs(pdb_id, alpha_chain_id, beta_chain_id):
-        with open(os.path.join(stcrdab_path, 'imgt', pdb_id + '.pdb'), 'r') as fh:
-            structure_df = parse_pdb_to_pandas(fh.read())
+        structure_df = load_structure(os.path.join(stcrdab_path, 'imgt', pdb_id + '.pdb'))
 
         structure_df = annotate_tcr_pmhc_df(structure_df, alpha_chain_id, beta_chain_id)
         tcr_df = structure_df.query('chain_type.notnull()')
@@ -87,6 +108,50 @@ def get_cdr_sequences(names: list[str], stcrdab_path: str) -> pd.DataFrame:
     return structures
 
 
+def cluster_distance_graph(distance_graph: scipy.sparse.csr_matrix, min_cluster_size: int = 5) -> np.ndarray:
+    '''Cluster a sparse distance graph with HDBSCAN.
+
+    Pairs missing from the graph are treated as far apart. HDBSCAN requires sparse graphs to be connected, so separate
+    components are bridged with edges at this far distance, which is twice the largest distance in the graph. The same
+    distance is used as the core distance of points with fewer than `min_cluster_size` neighbours.
+
+    The labels are not guaranteed to match those of clustering the full distance matrix, even if the graph holds every
+    pair. HDBSCAN builds the minimum spanning tree of sparse graphs with another algorithm, which breaks ties between
+    equal mutual reachability distances differently, so points on the edge of clusters can end up in another cluster or
+    as noise, and clusters can be numbered differently. Keeping fewer neighbours also changes clusters that are only
+    linked through the pairs left out. Well separated clusters are found either way.
+
+    '''
+    far_distance = 2 * distance_graph.data.max() if distance_graph.nnz > 0 else 1.0
+
+    num_components, components = csgraph.connected_components(distance_graph, directed=False)
+
+    if num_components > 1:
+        logger.debug('Bridging %d disconnected components', num_components)
+        representatives = np.array([np.flatnonzero(components == component)[0]
+                                    for component in range(num_components)])
+        bridges = scipy.sparse.coo_matrix((np.full(num_components - 1, far_distance),
+                                           (np.full(num_components - 1, representatives[0]), representatives[1:])),
+                                          shape=distance_graph.shape)
+        distance_graph = (distance_graph + bridges + bridges.T).tocsr()
+
+    return hdbscan.HDBSCAN(min_cluster_size=min_cluster_size,
+                           metric='precomputed',
+                           max_dist=far_distance).fit_predict(distance_graph)
+
+
+def fill_far_distances(distance_matrix: np.ndarray) -> np.ndarray:
+    '''Replace infinite distances, e.g. from pairs abandoned early, with a far distance HDBSCAN can work with.
+
+    As for sparse graphs, the far distance is twice the largest finite distance in the matrix.
+
+    '''
+    finite = np.isfinite(distance_matrix)
+    far_distance = 2 * distance_matrix[finite].max() if np.any(finite) else 1.0
+
+    return np.where(finite, distance_matrix, far_distance)
+
+
 def assign_cluster_types(df: pd.DataFrame, min_uniq: int = 2) -> pd.Series:
     '''Assign clusters as canonical or pseudo'''
     cluster_types = df.query("cluster != 'noise'").groupby(
@@ -101,6 +166,9 @@ def main() -> None:
     args = parser.parse_args()
     setup_logger(logger, args.log_level)
 
+    if get_output_format(args.output, args.format) == 'parquet' and args.output is None:
+        parser.error('an --output path is needed to write Parquet files')
+
     logger.info('Loading structure names from %s', args.structure_names)
     with open(args.structure_names, 'r') as fh:
         structure_names = [line.strip() for line in fh.readlines()]
@@ -115,10 +183,18 @@ def main() -> None:
 
         logger.info('Loading CDR%s%s distance matrix', cdr, chain)
 
-        cdr_distance_matrix = np.loadtxt(path)
+        cdr_distance_matrix = load_distance_matrix(path)
 
         logger.info('Clustering loops')
-        cdr_clusters = hdbscan.HDBSCAN(min_cluster_size=5, metric='precomputed').fit_predict(cdr_distance_matrix)
+        if scipy.sparse.issparse(cdr_distance_matrix):
+            cdr_clusters = cluster_distance_graph(cdr_distance_matrix)
+
+        else:
+            if not np.all(np.isfinite(cdr_distance_matrix)):
+                logger.info('Treating infinite distances as far apart')
+                cdr_distance_matrix = fill_far_distances(cdr_distance_matrix)
+
+            cdr_clusters = hdbscan.HDBSCAN(min_cluster_size=5, metric='precomputed').fit_predict(cdr_distance_matrix)
 
         cdr_df = pd.DataFrame({
             'name': structure_names,
@@ -145,7 +221,9 @@ def main() -> None:
         df = df.merge(cluster_types.reset_index(), how='left', on=['chain_type', 'cdr', 'cluster'])
 
     logger.info('Outputting clusters to %s', args.output)
-    df.to_csv(args.output, index=False)
+    with TableWriter(args.output, df.columns.tolist(), file_format=get_output_format(args.output, args.format),
+                     parquet_dtypes=PARQUET_DTYPES) as writer:
+        writer.write(df)
 
 
 if __name__ == '__main__':
@@ -1,33 +1,83 @@
-'''Compute the differences between the apo and holo forms of TCR, pMHC, and TCR:pMHCs.'''
+'''Compute the differences between the apo and holo forms of TCR, pMHC, and TCR:pMHCs.
+
+With ``--shard i/N`` only the i-th of N contiguous slices of the (sorted) complexes is processed. The output files of
+all shards are combined with ``merge_shards apo_holo_differences`` into the same file a single run would write.
+
+With ``--workers N`` complexes are distributed over N processes. Their results are collected in the order of the
+complexes, so the output is identical to a serial run.
+
+Rows are written to the output file as complexes are finished rather than all at the end, see `apps._output`. With
+``--format parquet`` the table is written as Parquet with the complex IDs, chain types and residue names as categoricals
+and the measurements in single precision. Adding ``--partition-by-complex`` writes it as a directory partitioned by
+complex ID.
+
+Job files
+---------
+
+Several sets of measurements of the same input can be made in one run with ``--jobs``, which loads and annotates each
+structure once and shares it between the jobs. The job file is a JSON (or YAML, with the ``yaml`` extra installed)
+list of jobs, each giving its ``output`` and any of the options ``select-entities``, ``pmhc-tcr-contact-residues``,
+``align-entities``, ``per-residue``, ``crop-to-abd``, ``num-anchors``, ``per-residue-measurements``, ``format`` and
+``partition-by-complex``, as on the command line::
+
+    [
+        {"output": "rmsd_cdr_loop_align_results.csv", "select-entities": "tcr", "align-entities": true},
+        {"output": "pmhc_per_res_apo_holo.csv", "select-entities": "pmhc", "per-residue": true},
+        {"output": "tcr_per_res_apo_holo_d_score.csv", "select-entities": "tcr", "per-residue": true,
+         "per-residue-measurements": ["d_score"], "num-anchors": 6}
+    ]
+
+The output of each job is identical to that of a separate run with the same options. ``--workers`` and ``--shard``
+apply to all jobs.
+
+'''
 import argparse
+import contextlib
 import glob
+import json
 import logging
 import os
-import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 from python_pdb.aligners import align_pandas_structure
+from python_pdb.chemistry import MOLECULAR_WEIGHTS
 from python_pdb.comparisons import rmsd
-from python_pdb.parsers import parse_pdb_to_pandas
 
 from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
-from tcr_pmhc_interface_analysis.measurements import (calculate_phi_psi_angles, compute_residue_com, get_distance,
-                                                      measure_chi_angle)
-from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df, find_anchors
+from tcr_pmhc_interface_analysis.apps._output import TableWriter, add_output_arguments, get_output_format
+from tcr_pmhc_interface_analysis.apps._shard import add_shard_arguments, select_shard
+from tcr_pmhc_interface_analysis.measurements import (calculate_backbone_dihedrals, calculate_d_scores,
+                                                      compute_residue_differences, get_backbone_coords,
+                                                      measure_chi_angles)
+from tcr_pmhc_interface_analysis.processing import (annotate_tcr_pmhc_df, build_residue_index, encode_atom_keys,
+                                                    find_anchor_atoms, match_atoms)
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
 from tcr_pmhc_interface_analysis.utils import get_coords
 
 logger = logging.getLogger()
 
 MEASURMENT_CHOICES = ['rmsd', 'ca_distance', 'chi_angle_change', 'com_distance', 'd_score']
 
+RESIDUE_COLUMNS = ['residue_seq_id', 'residue_insert_code', 'residue_name']
+ATOM_COLUMNS = RESIDUE_COLUMNS + ['atom_name']
+
+BACKBONE_ATOMS = ['N', 'CA', 'C', 'O']
+
+JOB_OPTIONS = ['output', 'select-entities', 'pmhc-tcr-contact-residues', 'align-entities', 'per-residue', 'crop-to-abd',
+               'num-anchors', 'per-residue-measurements', 'format', 'partition-by-complex']
+'''Options that can be given to each job of a job file.'''
+
 parser = argparse.ArgumentParser(prog=f'python -m {sys.modules[__name__].__spec__.name}',
                                  description=__doc__,
                                  formatter_class=argparse.RawDescriptionHelpFormatter)
 
 parser.add_argument('input', help='path to data directory')
-parser.add_argument('--output', '-o', help='path to output file')
+parser.add_argument('--output', '-o',
+                    help=('path to output file, or directory with `--partition-by-complex` '
+                          '(Default: CSV to the standard output)'))
 parser.add_argument('--select-entities', choices=['tcr', 'pmhc'])
 parser.add_argument('--pmhc-tcr-contact-residues', nargs='+',
                     help=('if selecting pmhc, separate rmsds by tcr contact positions and not. '
@@ -46,34 +96,150 @@ parser.add_argument('--per-residue-measurements',
                     default='all',
                     help='Measurments to take between residues if `--per-residue` is selected.')
 
+parser.add_argument('--jobs',
+                    help='path to a JSON or YAML file listing jobs to run over one loading of the structures')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of processes computing the differences of complexes in parallel (Default: 1)')
+
+add_output_arguments(parser)
+parser.add_argument('--partition-by-complex', action='store_true',
+                    help='write the Parquet output as a directory partitioned by complex ID')
+
+add_shard_arguments(parser, 'complexes')
 add_logging_arguments(parser)
 
 
-def split_merge(merged_df: pd.DataFrame,
-                common_columns: list[str],
-                suffixes: tuple[str, str] = ('_x', '_y')) -> pd.DataFrame:
-    '''Split a dataframe back after a merge operation based on the columns used to merge and the suffixes.'''
-    dfs = []
-    for suffix in suffixes:
-        columns = merged_df.filter(regex=f'{suffix}$').columns.tolist()
-        df = merged_df[columns + common_columns]
+def get_residue_ids(entity_df: pd.DataFrame) -> tuple[np.ndarray, int]:
+    '''Number the residue of every atom of an entity in the order of its residue groups.'''
+    residue_ids = entity_df.groupby(RESIDUE_COLUMNS, dropna=False).ngroup().to_numpy()
 
-        dfs.append(df.rename(columns=lambda col_name: re.sub(f'{suffix}$', '', col_name)))
+    return residue_ids, len(np.unique(residue_ids))
 
-    return tuple(dfs)
 
+def compute_chi_angle_changes(entity_x: pd.DataFrame,
+                              entity_y: pd.DataFrame,
+                              residue_ids: np.ndarray,
+                              num_residues: int) -> np.ndarray:
+    '''Compute the change in the chi1 angle of every residue of an entity.
 
-def main():
-    args = parser.parse_args()
-    setup_logger(logger, args.log_level)
+    Args:
+        entity_x: atoms of the entity in the first structure
+        entity_y: the same atoms in the second structure, row for row
+        residue_ids: number of the residue of every atom, see `get_residue_ids`
+        num_residues: number of residues
 
-    summary_path, = glob.glob(os.path.join(args.input, '*summary.csv'))
-    summary_df = pd.read_csv(summary_path)
+    Returns:
+        changes in chi1 of every residue, NaN where angles are missing
 
-    complexes = sorted([complex_id for complex_id in os.listdir(args.input)
-                        if os.path.isdir(os.path.join(args.input, complex_id))])
-    num_complexes = len(complexes)
+    '''
+    chi_angles_x, chi_angles_y = (measure_chi_angles(entity_df, residue_ids, num_residues, numbers=[1])[:, 0]
+                                  for entity_df in (entity_x, entity_y))
+
+    return chi_angles_x - chi_angles_y
+
+
+def measure_backbone_dihedrals(structure_df: pd.DataFrame) -> np.ndarray:
+    '''Measure the phi and psi angles of the residue of every atom of a structure.
+
+    Angles are computed over whole chains in the order of the structure, so the angles of a residue are the same
+    whichever entity it is selected in, including entities that skip residues of the chain (such as the TCR contacts).
+
+    Args:
+        structure_df: atoms of the structure
+
+    Returns:
+        array of shape (num_atoms, 2) of the phi and psi angles, NaN for residues with missing backbone atoms,
+        neighbours or chain breaks
+
+    '''
+    angles = np.full((len(structure_df), 2), np.nan)
+
+    for chain_atoms in structure_df.groupby('chain_id', sort=False).indices.values():
+        chain_df = structure_df.iloc[chain_atoms]
+        residue_ids, num_residues = get_residue_ids(chain_df)
+
+        # Groups are sorted by residue number (placing inserted residues out of sequence), whereas the atoms are in
+        # chain order, so neighbouring residues are found from the order of their first atoms
+        _, first_atoms = np.unique(residue_ids, return_index=True)
+        chain_order = np.argsort(first_atoms)
+
+        backbone_coords = get_backbone_coords(chain_df, residue_ids, num_residues)
+        phi, psi, _ = calculate_backbone_dihedrals(*(coords[chain_order] for coords in backbone_coords))
+
+        residue_angles = np.empty((num_residues, 2))
+        residue_angles[chain_order] = np.stack([phi, psi], axis=1)
+        angles[chain_atoms] = residue_angles[residue_ids]
+
+    return angles
+
+
+def compute_d_scores(angles_x: np.ndarray, angles_y: np.ndarray, first_atoms: np.ndarray) -> np.ndarray:
+    '''Compute the D-score of every residue of an entity.
+
+    Args:
+        angles_x: phi and psi angles of the residues in the first structure, see `measure_backbone_dihedrals`
+        angles_y: phi and psi angles of the same residues in the second structure
+        first_atoms: position of the first atom of every residue in the entity, placing them in chain order
+
+    Returns:
+        D-score of every residue, NaN for the residues at either end of the entity and residues with missing
+        backbone atoms, neighbours or chain breaks
+
+    '''
+    d_scores = calculate_d_scores(angles_x[:, 0], angles_x[:, 1], angles_y[:, 0], angles_y[:, 1])
+
+    chain_order = np.argsort(first_atoms)
+    d_scores[chain_order[[0, -1]]] = np.nan
+
+    return d_scores
+
+
+def compute_residue_changes(entity_x: pd.DataFrame,
+                            entity_y: pd.DataFrame,
+                            residue_ids: np.ndarray,
+                            num_residues: int) -> dict[str, np.ndarray]:
+    '''Compute the RMSD, CA distance and centre of mass distance of every residue of an entity.
+
+    Args:
+        entity_x: atoms of the entity in the first structure
+        entity_y: the same atoms in the second structure, row for row
+        residue_ids: number of the residue of every atom, see `get_residue_ids`
+        num_residues: number of residues
+
+    Returns:
+        arrays of the 'rmsd', 'ca_distance' and 'com_distance' of every residue, NaN for residues without a CA atom or
+        with atoms of unknown elements
+
+    '''
+    # Atoms are gathered by residue, keeping their order within each residue as the groups do
+    atom_order = np.argsort(residue_ids, kind='stable')
+    offsets = np.append(0, np.cumsum(np.bincount(residue_ids, minlength=num_residues)))
+
+    entity_x = entity_x.iloc[atom_order]
+    entity_y = entity_y.iloc[atom_order]
+
+    rmsds, ca_distances, com_distances = compute_residue_differences(
+        get_coords(entity_x),
+        get_coords(entity_y),
+        entity_x['element'].map(MOLECULAR_WEIGHTS).to_numpy(dtype=float),
+        entity_y['element'].map(MOLECULAR_WEIGHTS).to_numpy(dtype=float),
+        (entity_x['atom_name'] == 'CA').to_numpy(),
+        offsets,
+    )
+
+    return {'rmsd': rmsds, 'ca_distance': ca_distances, 'com_distance': com_distances}
+
+
+def get_measurement_choices(args: argparse.Namespace) -> list[str]:
+    '''Get the names of the measurements made, per residue or of whole entities.'''
+    if not args.per_residue:
+        return ['rmsd']
 
+    return MEASURMENT_CHOICES if args.per_residue_measurements == 'all' else args.per_residue_measurements
+
+
+def create_columns(args: argparse.Namespace) -> tuple[dict[str, list], dict[str, list]]:
+    '''Create the empty columns of the information on the rows and of the measurements.'''
     info = {
         'complex_id': [],
         'structure_x_name': [],
@@ -86,239 +252,474 @@ def main():
         info['residue_seq_id'] = []
         info['residue_insert_code'] = []
 
-    measurements = {}
+    measurements = {measurement: [] for measurement in get_measurement_choices(args)}
+
+    return info, measurements
+
+
+def get_output_columns(args: argparse.Namespace) -> list[str]:
+    '''Get the columns of the output table.'''
+    output_columns = ['complex_id', 'structure_x_name', 'structure_y_name']
+
+    if args.select_entities == 'tcr':
+        output_columns += ['chain_type', 'cdr']
+
+    elif args.select_entities == 'pmhc':
+        output_columns += ['chain_type']
+
+        if args.pmhc_tcr_contact_residues:
+            output_columns.append('tcr_contact')
 
     if args.per_residue:
-        measurement_choices = (MEASURMENT_CHOICES
-                               if args.per_residue_measurements == 'all'
-                               else args.per_residue_measurements)
+        output_columns += ['residue_name', 'residue_seq_id', 'residue_insert_code']
 
-        for measurement in measurement_choices:
-            measurements[measurement] = []
+    output_columns += get_measurement_choices(args)
 
-    else:
-        measurements['rmsd'] = []
-
-    for num, complex_id in enumerate(complexes, 1):
-        logger.info('%s - %d of %d', complex_id, num, num_complexes)
-
-        complex_path = os.path.join(args.input, complex_id)
-        complex_pdb_files = [file_ for file_ in os.listdir(complex_path) if file_.endswith('.pdb')]
-        complex_summary = summary_df[summary_df['file_name'].isin(complex_pdb_files)]
-
-        comparison_structures = complex_summary.query("structure_type == @args.select_entities or state == 'holo'")
-        comparisons = pd.merge(comparison_structures, comparison_structures, how='cross')
-        comparisons['comparison'] = comparisons.apply(lambda row: '-'.join(sorted([row.file_name_x, row.file_name_y])),
-                                                      axis='columns')
-        comparisons = comparisons.drop_duplicates('comparison')
-        comparisons = comparisons.drop('comparison', axis='columns')
-        comparisons = comparisons.query('file_name_x != file_name_y')
-
-        for _, comparison in comparisons.iterrows():
-            logger.debug('Computing changes between %s and %s', comparison['file_name_x'], comparison['file_name_y'])
-
-            structures = []
-            for suffix in '_x', '_y':
-                with open(os.path.join(complex_path, comparison['file_name' + suffix]), 'r') as fh:
-                    structure_df = parse_pdb_to_pandas(fh.read())
-
-                chains = comparison.filter(like='chain').filter(regex=f'{suffix}$').replace({np.nan: None}).tolist()
-                structure_df = annotate_tcr_pmhc_df(structure_df, *chains)
-
-                structure_df['resi'] = (structure_df['residue_seq_id'].apply(str)
-                                        + structure_df['residue_insert_code'].fillna(''))
-
-                if args.num_anchors > 0 and args.select_entities == 'tcr':
-                    structure_df['anchor'] = False
-
-                    for chain_type in 'alpha_chain', 'beta_chain':
-                        for cdr in 1, 2, 3:
-                            cdr_df = structure_df[(structure_df['chain_type'] == chain_type)
-                                                  & (structure_df['cdr'] == cdr)]
-                            for anchor_df in find_anchors(cdr_df, structure_df, args.num_anchors):
-                                merged_df = structure_df.merge(anchor_df,
-                                                               how='left',
-                                                               on=structure_df.columns.tolist(),
-                                                               indicator=True)
-                                structure_df.loc[merged_df['_merge'] == 'both', 'anchor'] = True
-                                structure_df.loc[merged_df['_merge'] == 'both', 'cdr'] = cdr
-
-                if args.pmhc_tcr_contact_residues:
-                    structure_df['tcr_contact'] = structure_df.apply(
-                        lambda row: row.resi in args.pmhc_tcr_contact_residues and row.chain_type == 'mhc_chain1',
-                        axis='columns',
+    return output_columns
+
+
+def get_output_dtypes(args: argparse.Namespace) -> dict[str, str]:
+    '''Get the data types of the numerical columns of the output table.'''
+    dtypes = {measurement: 'float64' for measurement in get_measurement_choices(args)}
+    dtypes['cdr'] = 'int64'
+    dtypes['residue_seq_id'] = 'int64'
+
+    return dtypes
+
+
+def get_parquet_dtypes(args: argparse.Namespace) -> dict[str, str]:
+    '''Get the data types of the columns of the output table written as Parquet.'''
+    dtypes = {measurement: 'float32' for measurement in get_measurement_choices(args)}
+    dtypes['complex_id'] = 'category'
+    dtypes['chain_type'] = 'category'
+    dtypes['residue_name'] = 'category'
+
+    return dtypes
+
+
+def get_output_rows(info: dict[str, list], measurements: dict[str, list], args: argparse.Namespace) -> pd.DataFrame:
+    '''Gather the information on rows and their measurements into rows of the output table.'''
+    if args.select_entities == 'tcr':
+        info['chain_type'] = [chain_type for chain_type, _ in info['entity']]
+        info['cdr'] = [int(cdr) for _, cdr in info['entity']]
+        info.pop('entity')
+
+    elif args.select_entities == 'pmhc':
+        if args.pmhc_tcr_contact_residues:
+            info['chain_type'] = [chain_type for chain_type, _ in info['entity']]
+            info['tcr_contact'] = [tcr_contact for _, tcr_contact in info['entity']]
+
+        else:
+            info['chain_type'] = info['entity']
+
+        info.pop('entity')
+
+    return pd.DataFrame(info | measurements).loc[:, get_output_columns(args)]
+
+
+def load_annotated_structure(path: str, chains: list[str | None]) -> pd.DataFrame:
+    '''Load a structure and annotate the columns used by every comparison.
+
+    Args:
+        path: path to the structure
+        chains: alpha, beta, antigen, MHC chain 1, and MHC chain 2 IDs of the structure (None for missing chains)
+
+    Returns:
+        structure dataframe annotated with chain types, CDRs, MHC ABD, residue codes ('resi'), and backbone atoms
+
+    '''
+    structure_df = load_structure(path)
+    structure_df = annotate_tcr_pmhc_df(structure_df, *chains)
+
+    structure_df['resi'] = (structure_df['residue_seq_id'].astype(str)
+                            + structure_df['residue_insert_code'].fillna(''))
+    structure_df['backbone'] = structure_df['atom_name'].isin(BACKBONE_ATOMS)
+
+    return structure_df
+
+
+def prepare_structure(structure_df: pd.DataFrame, args: argparse.Namespace) -> pd.DataFrame:
+    '''Add the columns that depend on the command line arguments (anchors and TCR contacts) to an annotated structure.
+
+    The annotated structure is left unchanged, so it can be prepared again with other arguments.
+
+    '''
+    add_anchors = args.num_anchors > 0 and args.select_entities == 'tcr'
+
+    if not add_anchors and not args.pmhc_tcr_contact_residues:
+        return structure_df
+
+    structure_df = structure_df.copy()
+
+    if add_anchors:
+        structure_df['anchor'] = False
+
+        residue_index = build_residue_index(structure_df)
+        anchor_column = structure_df.columns.get_loc('anchor')
+        cdr_column = structure_df.columns.get_loc('cdr')
+
+        for chain_type in 'alpha_chain', 'beta_chain':
+            for cdr in 1, 2, 3:
+                cdr_df = structure_df[(structure_df['chain_type'] == chain_type) & (structure_df['cdr'] == cdr)]
+                for anchor_atoms in find_anchor_atoms(cdr_df, residue_index, args.num_anchors):
+                    structure_df.iloc[anchor_atoms, anchor_column] = True
+                    structure_df.iloc[anchor_atoms, cdr_column] = cdr
+
+    if args.pmhc_tcr_contact_residues:
+        structure_df['tcr_contact'] = (structure_df['resi'].isin(args.pmhc_tcr_contact_residues)
+                                       & (structure_df['chain_type'] == 'mhc_chain1'))
+
+    return structure_df
+
+
+def compute_complex_differences(complex_id: str,
+                                summary_df: pd.DataFrame,
+                                args: argparse.Namespace,
+                                annotated_structures: dict[tuple, pd.DataFrame] | None = None) -> pd.DataFrame:
+    '''Compute the differences between the structures of a complex.
+
+    Args:
+        complex_id: name of the directory of the complex in the input directory
+        summary_df: summary of all structures
+        args: command line arguments
+        annotated_structures: structures already loaded by `load_annotated_structure`, by file name and chain IDs.
+            Structures loaded here are added to it, so that they can be shared with other jobs.
+
+    Returns:
+        rows of the output table for the complex
+
+    '''
+    measurement_choices = get_measurement_choices(args)
+    info, measurements = create_columns(args)
+
+    if annotated_structures is None:
+        annotated_structures = {}
+
+    complex_path = os.path.join(args.input, complex_id)
+    complex_pdb_files = [file_ for file_ in os.listdir(complex_path) if file_.endswith('.pdb')]
+    complex_summary = summary_df[summary_df['file_name'].isin(complex_pdb_files)]
+
+    comparison_structures = complex_summary.query("structure_type == @args.select_entities or state == 'holo'")
+    comparisons = pd.merge(comparison_structures, comparison_structures, how='cross')
+    comparisons['comparison'] = comparisons.apply(lambda row: '-'.join(sorted([row.file_name_x, row.file_name_y])),
+                                                  axis='columns')
+    comparisons = comparisons.drop_duplicates('comparison')
+    comparisons = comparisons.drop('comparison', axis='columns')
+    comparisons = comparisons.query('file_name_x != file_name_y')
+
+    # Structures take part in several comparisons, so each is prepared once and kept for the whole complex
+    prepared_structures = {}
+    backbone_dihedrals = {}
+
+    for _, comparison in comparisons.iterrows():
+        logger.debug('Computing changes between %s and %s', comparison['file_name_x'], comparison['file_name_y'])
+
+        structures = []
+        structure_keys = []
+        for suffix in '_x', '_y':
+            file_name = comparison['file_name' + suffix]
+            chains = comparison.filter(like='chain').filter(regex=f'{suffix}$').replace({np.nan: None}).tolist()
+
+            if (file_name, *chains) not in prepared_structures:
+                if (file_name, *chains) not in annotated_structures:
+                    annotated_structures[(file_name, *chains)] = load_annotated_structure(
+                        os.path.join(complex_path, file_name),
+                        chains,
                     )
 
-                structure_df['backbone'] = structure_df['atom_name'].map(
-                    lambda atom_name: (atom_name == 'N' or atom_name == 'CA' or atom_name == 'C' or atom_name == 'O')
+                prepared_structures[(file_name, *chains)] = prepare_structure(
+                    annotated_structures[(file_name, *chains)],
+                    args,
                 )
 
-                structures.append(structure_df)
+            structures.append(prepared_structures[(file_name, *chains)])
 
-            structure_x, structure_y = structures
+            if 'd_score' in measurement_choices and (file_name, *chains) not in backbone_dihedrals:
+                backbone_dihedrals[(file_name, *chains)] = measure_backbone_dihedrals(structures[-1])
 
-            if args.select_entities == 'tcr':
-                entity_columns = ['chain_type', 'cdr']
+            structure_keys.append((file_name, *chains))
 
-            elif args.select_entities == 'pmhc':
-                entity_columns = ['chain_type']
+        structure_x, structure_y = structures
 
-                if args.pmhc_tcr_contact_residues:
-                    entity_columns.append('tcr_contact')
+        if args.select_entities == 'tcr':
+            entity_columns = ['chain_type', 'cdr']
 
-            structure_common_columns = entity_columns + ['residue_name',
-                                                         'residue_seq_id',
-                                                         'residue_insert_code',
-                                                         'atom_name']
+        elif args.select_entities == 'pmhc':
+            entity_columns = ['chain_type']
 
-            structure_comparison = pd.merge(structure_x, structure_y, how='inner', on=structure_common_columns)
+            if args.pmhc_tcr_contact_residues:
+                entity_columns.append('tcr_contact')
 
-            # Necessary to avoid pandas warning
-            if len(entity_columns) == 1:
-                entity_columns = entity_columns[0]
+        # Atoms of the two structures are paired once, as the rows of an inner merge on these columns would be
+        keys_x, keys_y = encode_atom_keys(structure_x, structure_y, entity_columns + ATOM_COLUMNS)
+        atoms_x, atoms_y = match_atoms(keys_x, keys_y)
 
-            for entity_name, selected_entity in structure_comparison.groupby(entity_columns):
-                logger.debug('Computing differences in %s', entity_name)
-                entity_x, entity_y = split_merge(selected_entity, structure_common_columns)
+        if args.per_residue:
+            atom_keys_x, atom_keys_y = encode_atom_keys(structure_x, structure_y, ATOM_COLUMNS)
 
-                if entity_name[0] == 'mhc_chain1' and args.crop_to_abd:
-                    entity_x = entity_x.query('mhc_abd')
-                    entity_y = entity_y.query('mhc_abd')
+        coords_x = get_coords(structure_x)
+        coords_y = get_coords(structure_y)
 
-                entity_backbone_x = entity_x.query('backbone')
-                entity_backbone_y = entity_y.query('backbone')
+        # The key columns have the same values in both structures, so masks are taken from the first one
+        backbone = structure_x['backbone'].to_numpy()
+        mhc_abd = structure_x['mhc_abd'].to_numpy()
 
-                entity_backbone_coords_x = get_coords(entity_backbone_x)
-                entity_backbone_coords_y = get_coords(entity_backbone_y)
+        entities = structure_x[entity_columns].iloc[atoms_x].reset_index(drop=True)
 
-                if args.align_entities:
-                    entity_x = align_pandas_structure(entity_backbone_coords_x,
-                                                      entity_backbone_coords_y,
-                                                      entity_x)
-                    entity_backbone_x = entity_x.query('backbone')
-                    entity_backbone_coords_x = get_coords(entity_backbone_x)
+        # Necessary to avoid pandas warning
+        if len(entity_columns) == 1:
+            entity_columns = entity_columns[0]
 
-                if args.per_residue:
-                    residue_common_columns = ['residue_name', 'residue_seq_id', 'residue_insert_code', 'atom_name']
-                    entity_comparison = pd.merge(entity_x, entity_y, how='inner', on=residue_common_columns)
-                    residues = list(entity_comparison.groupby(['residue_seq_id', 'residue_insert_code', 'residue_name'],
-                                                              dropna=False))
-                    num_residues = len(residues)
+        for entity_name, entity_pairs in entities.groupby(entity_columns):
+            logger.debug('Computing differences in %s', entity_name)
+            entity_atoms_x = atoms_x[entity_pairs.index]
+            entity_atoms_y = atoms_y[entity_pairs.index]
 
-                    for idx, ((seq_id, insert_code, res_name), residue) in enumerate(residues):
-                        res_x, res_y = split_merge(residue, residue_common_columns)
+            if entity_name[0] == 'mhc_chain1' and args.crop_to_abd:
+                entity_atoms_y = entity_atoms_y[mhc_abd[entity_atoms_x]]
+                entity_atoms_x = entity_atoms_x[mhc_abd[entity_atoms_x]]
 
-                        info['residue_name'].append(res_name)
-                        info['residue_seq_id'].append(seq_id)
-                        info['residue_insert_code'].append(insert_code)
+            entity_backbone = backbone[entity_atoms_x]
 
-                        info['complex_id'].append(complex_id)
-                        info['structure_x_name'].append(comparison['file_name_x'])
-                        info['structure_y_name'].append(comparison['file_name_y'])
+            entity_backbone_coords_x = coords_x[entity_atoms_x[entity_backbone]]
+            entity_backbone_coords_y = coords_y[entity_atoms_y[entity_backbone]]
 
-                        info['entity'].append(entity_name)
+            if args.align_entities or args.per_residue:
+                entity_x = structure_x.iloc[entity_atoms_x]
+                entity_y = structure_y.iloc[entity_atoms_y]
 
-                        for measurement in measurement_choices:
-                            value = None
+            if args.align_entities:
+                # The superposition is computed from the (column-major) coordinates of the dataframes, as the
+                # rounding of its matrix products depends on their memory layout
+                entity_x = align_pandas_structure(get_coords(entity_x[entity_backbone]),
+                                                  get_coords(entity_y[entity_backbone]),
+                                                  entity_x)
+                entity_backbone_coords_x = get_coords(entity_x)[entity_backbone]
+
+            if args.per_residue:
+                # Atoms are paired again within the entity, as merging the entities on residue and atom names would
+                residue_pairs_x, residue_pairs_y = match_atoms(atom_keys_x[entity_atoms_x],
+                                                               atom_keys_y[entity_atoms_y])
+                entity_x = entity_x.iloc[residue_pairs_x]
+                entity_y = entity_y.iloc[residue_pairs_y]
+
+                residue_ids, num_residues = get_residue_ids(entity_x)
+                _, first_atoms = np.unique(residue_ids, return_index=True)
+                residues = entity_x[RESIDUE_COLUMNS].iloc[first_atoms].itertuples(index=False)
+
+                if {'rmsd', 'ca_distance', 'com_distance'} & set(measurement_choices):
+                    residue_changes = compute_residue_changes(entity_x, entity_y, residue_ids, num_residues)
+
+                if 'chi_angle_change' in measurement_choices:
+                    chi_angle_changes = compute_chi_angle_changes(entity_x, entity_y, residue_ids, num_residues)
+
+                if 'd_score' in measurement_choices:
+                    angles_x, angles_y = (backbone_dihedrals[key] for key in structure_keys)
+                    d_scores = compute_d_scores(angles_x[entity_atoms_x[residue_pairs_x[first_atoms]]],
+                                                angles_y[entity_atoms_y[residue_pairs_y[first_atoms]]],
+                                                first_atoms)
+
+                for idx, (seq_id, insert_code, res_name) in enumerate(residues):
+                    info['residue_name'].append(res_name)
+                    info['residue_seq_id'].append(seq_id)
+                    info['residue_insert_code'].append(insert_code)
 
-                            match measurement:
-                                case 'rmsd':
-                                    logger.debug('Computing RMSD between residues')
-                                    try:
-                                        value = rmsd(get_coords(res_x), get_coords(res_y))
-                                    except ValueError:
-                                        logger.warning('Mismatched number of atoms in residue: %s %d%s',
-                                                       res_name,
-                                                       seq_id,
-                                                       insert_code if insert_code else '')
-
-                                case 'ca_distance':
-                                    logger.debug('Computing distance between CA atoms')
-                                    value = get_distance(get_coords(res_x.query("atom_name == 'CA'").iloc[0]),
-                                                         get_coords(res_y.query("atom_name == 'CA'").iloc[0]))
-
-                                case 'com_distance':
-                                    logger.debug('Computing centre of mass change between residues')
-                                    value = get_distance(compute_residue_com(res_x), compute_residue_com(res_y))
-
-                                case 'chi_angle_change':
-                                    if not (res_name == 'GLY' or res_name == 'ALA'):
-                                        logger.debug('Computing Chi-angle changes')
-                                        try:
-                                            value = measure_chi_angle(res_x) - measure_chi_angle(res_y)
-                                        except IndexError:
-                                            logger.warning('Missing atoms needed to calculate chi angle: %s %d%s',
-                                                           res_name,
-                                                           seq_id,
-                                                           insert_code if pd.notnull(insert_code) else '')
-
-                                case 'd_score':
-                                    logger.debug('Computing D-score between residues')
-                                    if not (idx == 0 or idx == num_residues - 1):
-                                        prev_res_x, prev_res_y = split_merge(residues[idx - 1][1],
-                                                                             residue_common_columns)
-                                        next_res_x, next_res_y = split_merge(residues[idx + 1][1],
-                                                                             residue_common_columns)
-                                        try:
-                                            phi_x, psi_x = calculate_phi_psi_angles(res_x, prev_res_x, next_res_x)
-                                            phi_y, psi_y = calculate_phi_psi_angles(res_y, prev_res_y, next_res_y)
-
-                                        except IndexError:
-                                            logger.warning('Missing atoms needed to calculate phi/psi angle: %s %d%s',
-                                                           res_name,
-                                                           seq_id,
-                                                           insert_code if pd.notnull(insert_code) else '')
-
-                                        else:
-                                            value = ((2 * (1 - np.cos(phi_x - phi_y)))
-                                                     + (2 * (1 - np.cos(psi_x - psi_y))))
-
-                            measurements[measurement].append(value)
-
-                else:
                     info['complex_id'].append(complex_id)
                     info['structure_x_name'].append(comparison['file_name_x'])
                     info['structure_y_name'].append(comparison['file_name_y'])
 
                     info['entity'].append(entity_name)
 
-                    measurements['rmsd'].append(rmsd(entity_backbone_coords_x, entity_backbone_coords_y))
+                    for measurement in measurement_choices:
+                        value = None
+
+                        match measurement:
+                            case 'rmsd' | 'ca_distance' | 'com_distance':
+                                if not np.isnan(residue_changes[measurement][idx]):
+                                    value = residue_changes[measurement][idx]
+
+                                else:
+                                    logger.warning('Missing atoms or elements needed to compute %s: %s %d%s',
+                                                   measurement,
+                                                   res_name,
+                                                   seq_id,
+                                                   insert_code if pd.notnull(insert_code) else '')
+
+                            case 'chi_angle_change':
+                                if not (res_name == 'GLY' or res_name == 'ALA'):
+                                    logger.debug('Computing Chi-angle changes')
+                                    if not np.isnan(chi_angle_changes[idx]):
+                                        value = chi_angle_changes[idx]
+
+                                    else:
+                                        logger.warning('Missing atoms needed to calculate chi angle: %s %d%s',
+                                                       res_name,
+                                                       seq_id,
+                                                       insert_code if pd.notnull(insert_code) else '')
 
-    if args.select_entities == 'tcr':
-        info['chain_type'] = [chain_type for chain_type, _ in info['entity']]
-        info['cdr'] = [int(cdr) for _, cdr in info['entity']]
-        info.pop('entity')
+                            case 'd_score':
+                                logger.debug('Computing D-score between residues')
+                                if not np.isnan(d_scores[idx]):
+                                    value = d_scores[idx]
 
-    elif args.select_entities == 'pmhc':
-        if args.pmhc_tcr_contact_residues:
-            info['chain_type'] = [chain_type for chain_type, _ in info['entity']]
-            info['tcr_contact'] = [tcr_contact for _, tcr_contact in info['entity']]
+                                else:
+                                    logger.debug('No D-score for %s %d%s, missing atoms or neighbours',
+                                                 res_name,
+                                                 seq_id,
+                                                 insert_code if pd.notnull(insert_code) else '')
+
+                        measurements[measurement].append(value)
+
+            else:
+                info['complex_id'].append(complex_id)
+                info['structure_x_name'].append(comparison['file_name_x'])
+                info['structure_y_name'].append(comparison['file_name_y'])
+
+                info['entity'].append(entity_name)
+
+                measurements['rmsd'].append(rmsd(entity_backbone_coords_x, entity_backbone_coords_y))
+
+    return get_output_rows(info, measurements, args)
+
+
+def compute_complex_jobs(complex_id: str,
+                         summary_df: pd.DataFrame,
+                         jobs: list[argparse.Namespace]) -> list[pd.DataFrame]:
+    '''Compute the differences between the structures of a complex for every job, loading each structure once.'''
+    annotated_structures = {}
+
+    return [compute_complex_differences(complex_id, summary_df, job, annotated_structures) for job in jobs]
+
+
+def load_jobs(path: str, args: argparse.Namespace) -> list[argparse.Namespace]:
+    '''Load the jobs of a job file, see the module documentation.
+
+    Args:
+        path: path to a JSON (or YAML, with the `yaml` extra installed) list of jobs
+        args: command line arguments, giving the input and the options shared by all jobs
+
+    Returns:
+        command line arguments of every job
+
+    '''
+    with open(path, 'r') as fh:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+
+            except ImportError:
+                parser.error("PyYAML is needed to read YAML job files, install it with `pip install '.[yaml]'`")
+
+            job_specs = yaml.safe_load(fh)
 
         else:
-            info['chain_type'] = info['entity']
+            job_specs = json.load(fh)
 
-        info.pop('entity')
+    if not isinstance(job_specs, list):
+        parser.error(f'{path} should contain a list of jobs')
 
-    logger.info('Outputing results...')
-    output_columns = ['complex_id', 'structure_x_name', 'structure_y_name']
+    jobs = []
+    for number, job_spec in enumerate(job_specs, 1):
+        options = {key.replace('_', '-'): value for key, value in job_spec.items()}
 
-    if args.select_entities == 'tcr':
-        output_columns += ['chain_type', 'cdr']
+        unknown_options = sorted(set(options) - set(JOB_OPTIONS))
+        if unknown_options:
+            parser.error(f"job {number} has unknown options: {', '.join(unknown_options)}")
 
-    elif args.select_entities == 'pmhc':
-        output_columns += ['chain_type']
+        if options.get('output') is None:
+            parser.error(f'job {number} has no output')
 
-        if args.pmhc_tcr_contact_residues:
-            output_columns.append('tcr_contact')
+        job_argv = [args.input]
+        for option, value in options.items():
+            if value is True:
+                job_argv.append(f'--{option}')
 
-    if args.per_residue:
-        output_columns += ['residue_name', 'residue_seq_id', 'residue_insert_code']
-        output_columns += measurement_choices
+            elif isinstance(value, list):
+                job_argv += [f'--{option}', *(str(item) for item in value)]
+
+            elif value is not None and value is not False:
+                job_argv += [f'--{option}', str(value)]
+
+        job = parser.parse_args(job_argv)
+        job.workers = args.workers
+        job.shard = args.shard
+
+        jobs.append(job)
+
+    return jobs
+
+
+_worker_state = {}
+
+
+def _init_worker(summary_df: pd.DataFrame, jobs: list[argparse.Namespace]):
+    _worker_state['summary_df'] = summary_df
+    _worker_state['jobs'] = jobs
+
+
+def _compute_complex_task(complex_id: str) -> list[pd.DataFrame]:
+    return compute_complex_jobs(complex_id, _worker_state['summary_df'], _worker_state['jobs'])
+
+
+def main():
+    args = parser.parse_args()
+    setup_logger(logger, args.log_level)
+
+    if args.jobs:
+        if args.output or args.format or args.partition_by_complex:
+            parser.error('the outputs of --jobs are given in the job file, not on the command line')
+
+        jobs = load_jobs(args.jobs, args)
+        logger.info('Running %d jobs', len(jobs))
 
     else:
-        output_columns.append('rmsd')
+        jobs = [args]
+
+    for job in jobs:
+        if get_output_format(job.output, job.format) == 'parquet' and job.output is None:
+            parser.error('an --output path is needed to write Parquet files')
+
+        if job.partition_by_complex and get_output_format(job.output, job.format) != 'parquet':
+            parser.error('--partition-by-complex needs Parquet output')
+
+    summary_path, = glob.glob(os.path.join(args.input, '*summary.csv'))
+    summary_df = pd.read_csv(summary_path)
 
-    pd.DataFrame(info | measurements).loc[:, output_columns].to_csv(args.output, index=False)
+    complexes = sorted([complex_id for complex_id in os.listdir(args.input)
+                        if os.path.isdir(os.path.join(args.input, complex_id))])
+
+    if args.shard:
+        complexes = select_shard(complexes, args.shard)
+        logger.info('Shard %d of %d has %d complexes', *args.shard, len(complexes))
+
+    num_complexes = len(complexes)
+
+    writers = [TableWriter(job.output, get_output_columns(job), get_output_dtypes(job),
+                           file_format=get_output_format(job.output, job.format),
+                           parquet_dtypes=get_parquet_dtypes(job),
+                           partition_cols=['complex_id'] if job.partition_by_complex else None)
+               for job in jobs]
+
+    def write_results(results):
+        for num, (complex_id, job_rows) in enumerate(zip(complexes, results), 1):
+            logger.info('%s - %d of %d', complex_id, num, num_complexes)
+
+            for writer, rows in zip(writers, job_rows):
+                writer.write(rows)
+
+    # Rows are written as each complex is finished, in the order of the complexes
+    with contextlib.ExitStack() as stack:
+        for writer in writers:
+            stack.enter_context(writer)
+
+        if args.workers > 1 and num_complexes > 1:
+            # Results are returned in the order of the complexes, so the output is the same as a serial run
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                     initargs=(summary_df, jobs)) as executor:
+                write_results(executor.map(_compute_complex_task, complexes))
+
+        else:
+            write_results(compute_complex_jobs(complex_id, summary_df, jobs) for complex_id in complexes)
 
 
 if __name__ == '__main__':
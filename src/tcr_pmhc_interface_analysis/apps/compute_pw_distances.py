@@ -1,18 +1,96 @@
-'''Compute the pairwise DTW distance between all loops in the STCRDab.'''
+'''Compute the pairwise DTW (or RMSD) distance between all loops in the STCRDab.
+
+Metrics
+-------
+
+By default (``--metric dtw``) loops are superimposed on their anchors and compared with dynamic time warping, which
+allows loops of different lengths to be compared. With ``--metric rmsd`` the backbone atoms of loops with the same
+number of atoms are superimposed onto each other and compared with the RMSD. Loops are grouped by their number of atoms
+and the RMSDs within each group are computed together with batched matrix operations, which is much faster than DTW.
+Pairs of loops with different lengths are given the ``--cross-length-distance`` (infinitely far apart by default).
+
+Parallel computation
+--------------------
+
+The upper triangle of each distance matrix is split into square tiles of ``--tile-size`` loops. Tiles from all six CDR
+matrices are pooled together and distributed over ``--workers`` processes, so the matrices are computed at the same time
+rather than one after another. Every pair is computed in exactly the same way regardless of the tiling, meaning the
+output is identical to a serial run.
+
+Incremental updates
+-------------------
+
+When ``--previous`` points to the output of an earlier run, only the distances involving structures that were not in
+that run are computed. Structures that are no longer selected are removed, previous structures keep their order, and new
+structures are appended to the end of ``structure_names.txt`` and the matrices. The earlier run should have used the
+same settings (e.g. ``--number-of-anchors``) as the distances are reused as they are.
+
+Output formats
+--------------
+
+By default the matrices are written as text (``--output-format txt``), optionally compressed with gzip. The binary
+format (``--output-format npy``) stores only the condensed upper triangle as a ``.npy`` file in either ``float64`` or
+``float32`` (``--dtype``), which is smaller, faster to write, and can be memory mapped by
+``cluster_cdr_loop_structures``.
+
+Nearest neighbour graphs
+------------------------
+
+For very large sets of loops, ``--nearest-neighbours k`` keeps only the k nearest neighbours of every loop while the
+tiles are computed, so the full matrices are never held in memory. The result is written as a symmetric sparse graph
+(``.npz``) that ``cluster_cdr_loop_structures`` clusters directly. ``k`` should be at least the ``min_samples`` used for
+clustering (5). The clusters found from the graphs can differ from those of the full matrices at their edges, see
+``cluster_cdr_loop_structures.cluster_distance_graph``.
+
+Constrained DTW
+---------------
+
+The DTW alignment between two loops can be restricted to a Sakoe-Chiba band with ``--window``, and pairs can be
+abandoned early once their distance exceeds ``--max-dist``. Abandoned pairs are stored with an infinite distance, which
+``cluster_cdr_loop_structures`` treats as far apart from everything else, and are left out of nearest neighbour graphs.
+When ``--max-dist`` is given, the number of pairs computed and abandoned for each CDR is written to
+``early_abandoning.csv``.
+
+Checkpoints
+-----------
+
+Every ``--checkpoint-interval`` seconds the completed tiles and the partial matrices (or nearest neighbours) are saved
+to a ``checkpoint`` directory in the output, along with the extracted loops. If the run is interrupted, running the same
+command again with ``--resume`` continues from the last checkpoint without extracting the loops again. The checkpoint is
+removed once the matrices have been written.
+
+Sharding
+--------
+
+With ``--shard i/N`` only the i-th of N contiguous slices of the tiles is computed, so independent runs (e.g. on
+different nodes of a cluster) can share the work. Each shard writes the blocks of distances of its own tiles (or the
+nearest neighbours found in them) to ``shard.npz`` in its output directory, and ``merge_shards pw_distances`` places the
+blocks of all shards into the same files a single run would write. All shards must be run with the same settings.
+
+'''
 import argparse
+import json
 import logging
 import os
+import shutil
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
 
 import numpy as np
 import pandas as pd
 from dtaidistance.dtw_ndim import distance_fast
-from python_pdb.aligners import align_pandas_structure
-from python_pdb.parsers import parse_pdb_to_pandas
 
+from tcr_pmhc_interface_analysis.align import compute_pairwise_rmsds, compute_superpositions, transform_segments
 from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
-from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df, find_anchors
-from tcr_pmhc_interface_analysis.utils import get_coords
+from tcr_pmhc_interface_analysis.apps._shard import add_shard_arguments, select_shard
+from tcr_pmhc_interface_analysis.distance_matrices import (build_nearest_neighbour_graph, find_distance_matrix,
+                                                           init_nearest_neighbours, load_distance_matrix,
+                                                           save_distance_matrix, update_nearest_neighbours)
+from tcr_pmhc_interface_analysis.loop_store import LoopStore, build_loop_store
+from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df, build_residue_index, find_anchors
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
 
 logger = logging.getLogger()
 
@@ -26,15 +104,308 @@ parser.add_argument('--resolution-cutoff', type=float, default=3.50,
                     help='Maximum resolution allowed from the structures (Default: 3.50)')
 parser.add_argument('--number-of-anchors', type=int, default=5,
                     help='number of anchors to include in alignment (Default: 5)')
-parser.add_argument('--compress-output', action='store_true', help='compress the output matrices using gzip')
-
+parser.add_argument('--compress-output', action='store_true',
+                    help='compress the output matrices using gzip (text format only)')
+parser.add_argument('--output-format', choices=['txt', 'npy'], default='txt',
+                    help="format of the output matrices, either full text or condensed binary (Default: 'txt')")
+parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                    help="data type of binary output matrices (Default: 'float64')")
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of processes used to compute the distance matrices (Default: 1)')
+parser.add_argument('--tile-size', type=int, default=64,
+                    help='number of loops along each side of the tiles distributed to workers (Default: 64)')
+parser.add_argument('--nearest-neighbours', type=int,
+                    help=('only keep the k nearest neighbours of each loop and output sparse distance graphs. '
+                          'Clustering the graphs can label loops at the edges of clusters differently from the full '
+                          'matrices'))
+parser.add_argument('--previous',
+                    help='path to the output of a previous run, only distances involving new structures are computed')
+parser.add_argument('--metric', choices=['dtw', 'rmsd'], default='dtw',
+                    help="distance between loops, DTW or the RMSD of loops with the same length (Default: 'dtw')")
+parser.add_argument('--cross-length-distance', type=float, default=np.inf,
+                    help='distance given to loops of different lengths with --metric rmsd (Default: inf)')
+parser.add_argument('--window', type=int,
+                    help='Sakoe-Chiba window limiting how far the DTW alignment can shift between loops')
+parser.add_argument('--max-dist', type=float,
+                    help='abandon pairs once their DTW distance exceeds this value and store them as infinitely far')
+parser.add_argument('--checkpoint-interval', type=float, default=600,
+                    help='seconds between checkpoints of the computed tiles, 0 disables checkpoints (Default: 600)')
+parser.add_argument('--resume', action='store_true',
+                    help='continue from the checkpoint left in the output directory by an interrupted run')
+
+add_shard_arguments(parser, 'tiles of the distance matrices')
 add_logging_arguments(parser)
 
+CDR_LOOPS = [(chain, cdr) for chain in ('alpha_chain', 'beta_chain') for cdr in (1, 2, 3)]
+'''Chain and CDR number for every distance matrix computed.'''
 
-def main():
-    args = parser.parse_args()
-    setup_logger(logger, args.log_level)
+BACKBONE_ATOMS = ['N', 'CA', 'C', 'O']
+
+_worker_loops = {}
+_worker_distance_options = {}
+
+
+def get_tiles(num_loops: int, tile_size: int, first_column: int = 0) -> list[tuple[int, int, int, int]]:
+    '''Split the upper triangle of a square matrix into tiles.
+
+    Args:
+        num_loops: number of rows (and columns) of the matrix
+        tile_size: maximum number of rows and columns in each tile
+        first_column: only include columns from this index onwards (Default: 0)
+
+    Returns:
+        list of tiles as (row_start, row_stop, col_start, col_stop) tuples
+
+    '''
+    tiles = []
+    for row_start in range(0, num_loops, tile_size):
+        for col_start in range(row_start, num_loops, tile_size):
+            col_stop = min(col_start + tile_size, num_loops)
+
+            if col_stop > first_column:
+                tiles.append((row_start, min(row_start + tile_size, num_loops), max(col_start, first_column), col_stop))
+
+    return tiles
+
+
+def get_matrix_name(chain: str, cdr: int) -> str:
+    '''Get the name of the distance matrix file for a CDR loop.'''
+    return f"cdr{cdr}_{chain.split('_')[0]}_distance_matrix"
+
+
+def find_previous_distances(path: str) -> dict[tuple[str, int], str]:
+    '''Find the distance matrix of every CDR in the output of a previous run.
+
+    Raises:
+        ValueError: if the previous run kept only nearest neighbour graphs, which can not be extended
+
+    '''
+    matrix_paths = {(chain, cdr): find_distance_matrix(path, get_matrix_name(chain, cdr)) for chain, cdr in CDR_LOOPS}
+
+    if any(matrix_path.endswith('.npz') for matrix_path in matrix_paths.values()):
+        raise ValueError(f'the previous run in {path} kept only nearest neighbour graphs, '
+                         '--previous needs full distance matrices')
+
+    return matrix_paths
+
+
+def load_previous_distances(path: str, structure_names: list[str]) -> tuple[list[str], dict]:
+    '''Load the structure names and distance matrices of a previous run.
+
+    Args:
+        path: output directory of the previous run
+        structure_names: names of the structures selected in this run
+
+    Returns:
+        names of the previous structures that are still selected, and the distance matrices between them for each CDR
+
+    Raises:
+        ValueError: if the previous run kept only nearest neighbour graphs
+
+    '''
+    matrix_paths = find_previous_distances(path)
+
+    with open(os.path.join(path, 'structure_names.txt'), 'r') as fh:
+        previous_names = [line.strip() for line in fh.readlines() if line.strip()]
+
+    selected_names = set(structure_names)
+    kept_index = [index for index, name in enumerate(previous_names) if name in selected_names]
+    kept_names = [previous_names[index] for index in kept_index]
+
+    distance_matrices = {}
+    for cdr_loop, matrix_path in matrix_paths.items():
+        distance_matrix = load_distance_matrix(matrix_path)
+        distance_matrices[cdr_loop] = distance_matrix[np.ix_(kept_index, kept_index)]
+
+    return kept_names, distance_matrices
+
+
+def get_checkpoint_settings(args: argparse.Namespace) -> dict:
+    '''Get the settings that a checkpoint must have been created with to be resumed.'''
+    return {
+        'stcrdab': os.path.abspath(args.stcrdab),
+        'resolution_cutoff': args.resolution_cutoff,
+        'number_of_anchors': args.number_of_anchors,
+        'tile_size': args.tile_size,
+        'nearest_neighbours': args.nearest_neighbours,
+        'previous': os.path.abspath(args.previous) if args.previous else None,
+        'shard': list(args.shard) if args.shard else None,
+        'window': args.window,
+        'max_dist': args.max_dist,
+        'metric': args.metric,
+        'cross_length_distance': args.cross_length_distance,
+    }
+
+
+def _save_npz(path: str, arrays: dict[str, np.ndarray]) -> None:
+    # Write to a temporary file first so an interruption never leaves a truncated checkpoint behind
+    with open(path + '.tmp', 'wb') as fh:
+        np.savez(fh, **arrays)
+
+    os.replace(path + '.tmp', path)
+
+
+def _get_key(cdr_loop: tuple[str, int]) -> str:
+    chain, cdr = cdr_loop
+    return f'{chain}_{cdr}'
+
+
+def save_loop_checkpoint(directory: str,
+                         settings: dict,
+                         structure_names: list[str],
+                         num_previous: int,
+                         loops: dict[tuple[str, int], LoopStore]) -> None:
+    '''Save the extracted loops and the settings of the run to a checkpoint directory.'''
+    arrays = {
+        'settings': np.array(json.dumps(settings)),
+        'structure_names': np.array(structure_names, dtype=str),
+        'num_previous': np.array(num_previous),
+    }
+
+    for cdr_loop, loop_store in loops.items():
+        for field in fields(LoopStore):
+            arrays[f'{_get_key(cdr_loop)}_{field.name}'] = getattr(loop_store, field.name)
+
+    _save_npz(os.path.join(directory, 'loops.npz'), arrays)
+
+
+def load_loop_checkpoint(directory: str) -> tuple[dict, list[str], int, dict[tuple[str, int], LoopStore]]:
+    '''Load the extracted loops and the settings of the run from a checkpoint directory.
+
+    Returns:
+        settings, structure names, number of structures reused from a previous run, and the loops of each CDR
+
+    '''
+    with np.load(os.path.join(directory, 'loops.npz')) as checkpoint:
+        settings = json.loads(checkpoint['settings'].item())
+        structure_names = checkpoint['structure_names'].tolist()
+        num_previous = int(checkpoint['num_previous'])
+
+        loops = {cdr_loop: LoopStore(**{field.name: checkpoint[f'{_get_key(cdr_loop)}_{field.name}']
+                                        for field in fields(LoopStore)})
+                 for cdr_loop in CDR_LOOPS}
+
+    return settings, structure_names, num_previous, loops
+
+
+def save_progress(path: str,
+                  completed: np.ndarray,
+                  pair_counts: np.ndarray | None,
+                  distance_matrices: dict[tuple[str, int], np.ndarray],
+                  nearest_neighbours: dict[tuple[str, int], tuple[np.ndarray, np.ndarray]]) -> None:
+    '''Save the completed tiles and the partial distance matrices or nearest neighbours of a run.'''
+    arrays = {'completed': completed}
+
+    if pair_counts is not None:
+        arrays['pair_counts'] = pair_counts
+
+    for cdr_loop, distance_matrix in distance_matrices.items():
+        arrays[f'{_get_key(cdr_loop)}_distance_matrix'] = distance_matrix
+
+    for cdr_loop, (distances, indices) in nearest_neighbours.items():
+        arrays[f'{_get_key(cdr_loop)}_neighbour_distances'] = distances
+        arrays[f'{_get_key(cdr_loop)}_neighbour_indices'] = indices
+
+    _save_npz(path, arrays)
+
+
+def load_progress(path: str) -> tuple[np.ndarray, np.ndarray | None, dict, dict]:
+    '''Load the completed tiles and the partial distance matrices or nearest neighbours saved by save_progress.
+
+    Returns:
+        mask of the completed tiles, the number of computed and abandoned pairs of each CDR (None without early
+        abandoning), the partial distance matrices, and the partial nearest neighbours of each CDR
+
+    '''
+    distance_matrices = {}
+    nearest_neighbours = {}
+
+    with np.load(path) as progress:
+        completed = progress['completed']
+        pair_counts = progress['pair_counts'] if 'pair_counts' in progress else None
+
+        for cdr_loop in CDR_LOOPS:
+            key = _get_key(cdr_loop)
+
+            if f'{key}_distance_matrix' in progress:
+                distance_matrices[cdr_loop] = progress[f'{key}_distance_matrix']
+
+            if f'{key}_neighbour_distances' in progress:
+                nearest_neighbours[cdr_loop] = (progress[f'{key}_neighbour_distances'],
+                                                progress[f'{key}_neighbour_indices'])
+
+    return completed, pair_counts, distance_matrices, nearest_neighbours
+
+
+def save_shard(path: str,
+               completed: np.ndarray,
+               pair_counts: np.ndarray | None,
+               tile_blocks: dict[tuple[str, int], list[tuple[tuple[int, int, int, int], np.ndarray]]],
+               nearest_neighbours: dict[tuple[str, int], tuple[np.ndarray, np.ndarray]]) -> None:
+    '''Save the completed tiles of a shard and their distances (or the nearest neighbours found in them).
+
+    Only the blocks of distances computed by the shard are stored, as the bounds of every tile and the values of its
+    block flattened one after another, so the shards of a run take the space of one run between them.
+
+    '''
+    arrays = {'completed': completed}
+
+    if pair_counts is not None:
+        arrays['pair_counts'] = pair_counts
+
+    for cdr_loop, blocks in tile_blocks.items():
+        arrays[f'{_get_key(cdr_loop)}_tiles'] = np.array([tile for tile, _ in blocks], dtype=np.int64).reshape(-1, 4)
+        arrays[f'{_get_key(cdr_loop)}_blocks'] = np.concatenate([block.ravel() for _, block in blocks] + [[]])
+
+    for cdr_loop, (distances, indices) in nearest_neighbours.items():
+        arrays[f'{_get_key(cdr_loop)}_neighbour_distances'] = distances
+        arrays[f'{_get_key(cdr_loop)}_neighbour_indices'] = indices
+
+    _save_npz(path, arrays)
+
+
+def load_shard(path: str) -> tuple[np.ndarray, np.ndarray | None, dict, dict]:
+    '''Load the completed tiles and their distances or nearest neighbours saved by save_shard.
+
+    Returns:
+        mask of the completed tiles, the number of computed and abandoned pairs of each CDR (None without early
+        abandoning), the tiles and blocks of distances of each CDR, and the partial nearest neighbours of each CDR
+
+    '''
+    tile_blocks = {}
+    nearest_neighbours = {}
+
+    with np.load(path) as shard:
+        completed = shard['completed']
+        pair_counts = shard['pair_counts'] if 'pair_counts' in shard else None
+
+        for cdr_loop in CDR_LOOPS:
+            key = _get_key(cdr_loop)
+
+            if f'{key}_tiles' in shard:
+                tiles = [tuple(tile) for tile in shard[f'{key}_tiles'].tolist()]
+                sizes = [(row_stop - row_start) * (col_stop - col_start)
+                         for row_start, row_stop, col_start, col_stop in tiles]
+                blocks = np.split(shard[f'{key}_blocks'], np.cumsum(sizes)[:-1]) if tiles else []
+
+                tile_blocks[cdr_loop] = [(tile, block.reshape(tile[1] - tile[0], tile[3] - tile[2]))
+                                         for tile, block in zip(tiles, blocks)]
 
+            if f'{key}_neighbour_distances' in shard:
+                nearest_neighbours[cdr_loop] = (shard[f'{key}_neighbour_distances'],
+                                                shard[f'{key}_neighbour_indices'])
+
+    return completed, pair_counts, tile_blocks, nearest_neighbours
+
+
+def collect_loops(args: argparse.Namespace) -> tuple[list[str], int, dict[tuple[str, int], LoopStore], dict]:
+    '''Extract the CDR loops and their anchors from the selected structures.
+
+    Returns:
+        structure names, number of structures reused from a previous run, the loops of each CDR, and the distance
+        matrices of the reused structures
+
+    '''
     stcrdab_summary = pd.read_csv(os.path.join(args.stcrdab, 'db_summary.dat'), delimiter='\t')
 
     stcrdab_summary['resolution'] = pd.to_numeric(stcrdab_summary['resolution'], errors='coerce')
@@ -46,13 +417,7 @@ def main():
     stcrdab_summary = stcrdab_summary.reset_index(drop=True)
 
     structure_names = []
-    cdrs_with_anchors = {
-        'alpha_chain': {1: [], 2: [], 3: []},
-        'beta_chain': {1: [], 2: [], 3: []},
-    }
-
-    if not os.path.exists(args.output):
-        os.mkdir(args.output)
+    cdrs_with_anchors = {cdr_loop: {} for cdr_loop in CDR_LOOPS}
 
     for _, row in stcrdab_summary.iterrows():
         structure_name = f'{row.pdb}_{row.Achain}{row.Bchain}'
@@ -60,59 +425,359 @@ def main():
 
         logger.info('Collecting loops and anchors from %s', structure_name)
 
-        with open(os.path.join(args.stcrdab, 'imgt', row.pdb + '.pdb'), 'r') as fh:
-            structure_df = parse_pdb_to_pandas(fh.read())
+        structure_df = load_structure(os.path.join(args.stcrdab, 'imgt', row.pdb + '.pdb'),
+                                      chains=[row.Achain, row.Bchain], atom_names=BACKBONE_ATOMS)
 
         structure_df = annotate_tcr_pmhc_df(structure_df, alpha_chain_id=row.Achain, beta_chain_id=row.Bchain)
 
         tcr_df = structure_df.query("chain_type == 'alpha_chain' or chain_type == 'beta_chain'").copy()
         tcr_backbone_df = tcr_df.query("atom_name == 'N' or atom_name == 'CA' or atom_name == 'C' or atom_name == 'O'")
 
+        residue_index = build_residue_index(tcr_backbone_df)
+
         for chain in ('alpha_chain', 'beta_chain'):
             for cdr in 1, 2, 3:
                 cdr_backbone_df = tcr_backbone_df.query('chain_type == @chain and cdr == @cdr').copy()
-                start_anchor, end_anchor = find_anchors(cdr_backbone_df, tcr_backbone_df, args.number_of_anchors)
+                start_anchor, end_anchor = find_anchors(cdr_backbone_df, tcr_backbone_df, args.number_of_anchors,
+                                                        residue_index)
+
+                loop_with_anchors = pd.concat([start_anchor, cdr_backbone_df, end_anchor])
+                cdrs_with_anchors[(chain, cdr)][structure_name] = loop_with_anchors
+
+    num_previous = 0
+    previous_distance_matrices = {}
+    if args.previous:
+        logger.info('Loading previous distances from %s', args.previous)
+        previous_names, previous_distance_matrices = load_previous_distances(args.previous, structure_names)
+        num_previous = len(previous_names)
+
+        reused_names = set(previous_names)
+        new_names = [name for name in structure_names if name not in reused_names]
+        logger.info('Reusing %d structures and adding %d new structures', num_previous, len(new_names))
+
+        structure_names = previous_names + new_names
+
+    logger.info('Building loop stores')
+    loops = {cdr_loop: build_loop_store([cdrs_with_anchors[cdr_loop][name] for name in structure_names])
+             for cdr_loop in CDR_LOOPS}
+
+    return structure_names, num_previous, loops, previous_distance_matrices
+
+
+def compute_row_distances(loops: LoopStore,
+                          i: int,
+                          col_start: int,
+                          col_stop: int,
+                          window: int | None = None,
+                          max_dist: float | None = None) -> np.ndarray:
+    '''Compute the DTW distances between loop i and a range of loops.
+
+    Every loop in the range is superimposed onto loop i on their anchors in a single batched alignment before the DTW
+    distances are computed.
+
+    Args:
+        loops: loops and anchors of the CDR
+        i: index of the loop
+        col_start: index of the first loop in the range
+        col_stop: index after the last loop in the range
+        window: Sakoe-Chiba window restricting how far the DTW path can shift between loops (Default: None)
+        max_dist: abandon pairs once their DTW distance exceeds this value and return infinity (Default: None)
+
+    '''
+    rotations, translations = compute_superpositions(loops.get_anchor_stack(col_start, col_stop), loops.get_anchors(i))
+
+    loop_coords, offsets = loops.get_loop_range(col_start, col_stop)
+    aligned_coords = transform_segments(loop_coords, offsets, rotations, translations)
+
+    loop_coords_1 = loops.get_loop(i)
+
+    return np.array([distance_fast(loop_coords_1, aligned_coords[offsets[k]:offsets[k + 1]],
+                                   window=window, max_dist=max_dist)
+                     for k in range(col_stop - col_start)])
+
+
+def compute_rmsd_tile(loops: LoopStore,
+                      tile: tuple[int, int, int, int],
+                      cross_length_distance: float = np.inf) -> np.ndarray:
+    '''Compute the superposed RMSDs for the pairs of a tile that lie above the diagonal of the distance matrix.
+
+    Loops in the tile are grouped by their number of atoms, and the RMSDs between all rows and columns of a group are
+    computed at once. Pairs of loops with different numbers of atoms are given the `cross_length_distance`.
+
+    '''
+    row_start, row_stop, col_start, col_stop = tile
+    rows = np.arange(row_start, row_stop)
+    cols = np.arange(col_start, col_stop)
+
+    block = np.full((len(rows), len(cols)), cross_length_distance, dtype=np.float64)
+    lengths = loops.get_loop_lengths()
+
+    for length in np.intersect1d(lengths[rows], lengths[cols]):
+        bucket_rows = rows[lengths[rows] == length]
+        bucket_cols = cols[lengths[cols] == length]
+
+        block[np.ix_(bucket_rows - row_start, bucket_cols - col_start)] = compute_pairwise_rmsds(
+            loops.get_loop_stack(bucket_rows),
+            loops.get_loop_stack(bucket_cols),
+        )
+
+    return np.where(cols[np.newaxis, :] > rows[:, np.newaxis], block, 0.0)
+
+
+def compute_tile(loops: LoopStore, tile: tuple[int, int, int, int], metric: str = 'dtw', **options) -> np.ndarray:
+    '''Compute the distances for the pairs of a tile that lie above the diagonal of the distance matrix.
+
+    Args:
+        loops: loops and anchors of the CDR
+        tile: the pairs to compute as (row_start, row_stop, col_start, col_stop)
+        metric: either 'dtw' or 'rmsd' (Default: 'dtw')
+        options: passed on to compute_row_distances for DTW (``window`` and ``max_dist``), or compute_rmsd_tile for
+            RMSD (``cross_length_distance``)
+
+    '''
+    if metric == 'rmsd':
+        return compute_rmsd_tile(loops, tile, **options)
+
+    row_start, row_stop, col_start, col_stop = tile
+    block = np.zeros((row_stop - row_start, col_stop - col_start))
+
+    for i in range(row_start, row_stop):
+        row_col_start = max(i + 1, col_start)
+
+        if row_col_start < col_stop:
+            distances = compute_row_distances(loops, i, row_col_start, col_stop, **options)
+            block[i - row_start, row_col_start - col_start:] = distances
+
+    return block
+
+
+def write_distances(output: str,
+                    distance_matrices: dict[tuple[str, int], np.ndarray],
+                    nearest_neighbours: dict[tuple[str, int], tuple[np.ndarray, np.ndarray]],
+                    output_format: str = 'txt',
+                    dtype: str = 'float64',
+                    compress_output: bool = False) -> None:
+    '''Write the distance matrices computed for the upper triangle, or the nearest neighbour graphs, of every CDR.
+
+    Args:
+        output: directory to write the matrices to
+        distance_matrices: upper triangles of the distance matrices of each CDR, empty if nearest neighbours were kept
+        nearest_neighbours: distances and indices of the nearest neighbours of each CDR
+        output_format: format of full distance matrices, either 'txt' or 'npy' (Default: 'txt')
+        dtype: data type of binary distance matrices (Default: 'float64')
+        compress_output: compress text distance matrices using gzip (Default: False)
+
+    '''
+    for chain, cdr in CDR_LOOPS:
+        logger.info('Writing %s %d distances', chain, cdr)
+
+        if nearest_neighbours:
+            graph = build_nearest_neighbour_graph(*nearest_neighbours[(chain, cdr)])
+            save_distance_matrix(os.path.join(output, get_matrix_name(chain, cdr) + '.npz'), graph)
+            continue
+
+        distance_matrix = distance_matrices[(chain, cdr)]
+        distance_matrix = np.maximum(distance_matrix, distance_matrix.transpose())
+
+        name = get_matrix_name(chain, cdr) + '.' + output_format
+
+        if output_format == 'txt' and compress_output:
+            name += '.gz'
 
-                cdrs_with_anchors[chain][cdr].append(pd.concat([start_anchor, cdr_backbone_df, end_anchor]))
+        save_distance_matrix(os.path.join(output, name), distance_matrix, dtype)
+
+
+def count_abandoned_pairs(block: np.ndarray, tile: tuple[int, int, int, int]) -> tuple[int, int]:
+    '''Count the pairs of a tile above the diagonal and how many of them were abandoned early (infinite distance).'''
+    row_start, row_stop, col_start, col_stop = tile
+    upper = np.arange(col_start, col_stop)[np.newaxis, :] > np.arange(row_start, row_stop)[:, np.newaxis]
+
+    return np.count_nonzero(upper), np.count_nonzero(upper & np.isinf(block))
+
+
+def write_early_abandoning_report(path: str, pair_counts: np.ndarray) -> None:
+    '''Write the number of pairs computed and abandoned early for every CDR as a CSV file.'''
+    report = pd.DataFrame({
+        'chain_type': [chain for chain, _ in CDR_LOOPS],
+        'cdr': [cdr for _, cdr in CDR_LOOPS],
+        'num_pairs': pair_counts[:, 0],
+        'num_abandoned': pair_counts[:, 1],
+    })
+    report.to_csv(path, index=False)
+
+
+def _init_worker(loops, distance_options):
+    _worker_loops.update(loops)
+    _worker_distance_options.update(distance_options)
+
+
+def _compute_tile_task(index, cdr_loop, tile):
+    return index, compute_tile(_worker_loops[cdr_loop], tile, **_worker_distance_options)
+
+
+def main():
+    args = parser.parse_args()
+    setup_logger(logger, args.log_level)
+
+    if args.nearest_neighbours and args.previous:
+        parser.error('--nearest-neighbours can not be used with --previous')
+
+    if args.previous:
+        try:
+            find_previous_distances(args.previous)
+
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.metric == 'rmsd' and (args.window is not None or args.max_dist is not None):
+        parser.error('--window and --max-dist can only be used with --metric dtw')
+
+    checkpoint_dir = os.path.join(args.output, 'checkpoint')
+    checkpoint_path = os.path.join(checkpoint_dir, 'progress.npz')
+    checkpoint_settings = get_checkpoint_settings(args)
+    resuming = args.resume and os.path.exists(os.path.join(checkpoint_dir, 'loops.npz'))
+
+    if args.resume and not resuming:
+        logger.warning('No checkpoint found in %s, starting from the beginning', checkpoint_dir)
+
+    if not os.path.exists(args.output):
+        os.mkdir(args.output)
+
+    if resuming:
+        logger.info('Loading loops from checkpoint %s', checkpoint_dir)
+        settings, structure_names, num_previous, loops = load_loop_checkpoint(checkpoint_dir)
+
+        if settings != checkpoint_settings:
+            parser.error(f'the checkpoint in {checkpoint_dir} was created with different settings')
+
+    else:
+        structure_names, num_previous, loops, previous_distance_matrices = collect_loops(args)
 
     with open(os.path.join(args.output, 'structure_names.txt'), 'w') as fh:
         fh.write('\n'.join(structure_names))
         fh.write('\n')
 
-    for chain in ('alpha_chain', 'beta_chain'):
-        for cdr in 1, 2, 3:
-            logger.info('Working on %s %d', chain, cdr)
+    tasks = [(cdr_loop, tile)
+             for cdr_loop in CDR_LOOPS
+             for tile in get_tiles(len(loops[cdr_loop]), args.tile_size, first_column=num_previous)]
+
+    if resuming:
+        completed, pair_counts, distance_matrices, nearest_neighbours = load_progress(checkpoint_path)
+        logger.info('Resuming with %d of %d tiles completed', np.count_nonzero(completed), len(tasks))
+
+    else:
+        distance_matrices = {}
+        nearest_neighbours = {}
+        for cdr_loop in CDR_LOOPS:
+            num_loops = len(loops[cdr_loop])
+
+            if args.nearest_neighbours:
+                nearest_neighbours[cdr_loop] = init_nearest_neighbours(num_loops, args.nearest_neighbours)
+
+            else:
+                distance_matrices[cdr_loop] = np.zeros((num_loops, num_loops))
+
+                if num_previous > 0:
+                    distance_matrices[cdr_loop][:num_previous, :num_previous] = previous_distance_matrices[cdr_loop]
+
+        completed = np.zeros(len(tasks), dtype=bool)
+        pair_counts = np.zeros((len(CDR_LOOPS), 2), dtype=np.int64) if args.max_dist is not None else None
+
+        if args.checkpoint_interval > 0:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            save_loop_checkpoint(checkpoint_dir, checkpoint_settings, structure_names, num_previous, loops)
+            save_progress(checkpoint_path, completed, pair_counts, distance_matrices, nearest_neighbours)
+
+    last_checkpoint = time.monotonic()
+
+    def save_checkpoint():
+        nonlocal last_checkpoint
+
+        logger.info('Saving checkpoint with %d of %d tiles completed', np.count_nonzero(completed), len(tasks))
+        save_progress(checkpoint_path, completed, pair_counts, distance_matrices, nearest_neighbours)
+        last_checkpoint = time.monotonic()
+
+    def store_block(index, block):
+        cdr_loop, tile = tasks[index]
+
+        if args.nearest_neighbours:
+            update_nearest_neighbours(*nearest_neighbours[cdr_loop], block, tile)
+
+        else:
+            row_start, row_stop, col_start, col_stop = tile
+            distance_matrices[cdr_loop][row_start:row_stop, col_start:col_stop] = block
+
+        completed[index] = True
+
+        if pair_counts is not None:
+            pair_counts[CDR_LOOPS.index(cdr_loop)] += count_abandoned_pairs(block, tile)
+
+        if args.checkpoint_interval > 0 and time.monotonic() - last_checkpoint >= args.checkpoint_interval:
+            save_checkpoint()
+
+    selected = list(range(len(tasks)))
+    if args.shard:
+        selected = select_shard(selected, args.shard)
+        logger.info('Shard %d of %d has %d of %d tiles', *args.shard, len(selected), len(tasks))
+
+    pending = [(index, *tasks[index]) for index in selected if not completed[index]]
+
+    if args.metric == 'rmsd':
+        distance_options = {'metric': 'rmsd', 'cross_length_distance': args.cross_length_distance}
+
+    else:
+        distance_options = {'metric': 'dtw', 'window': args.window, 'max_dist': args.max_dist}
+
+    logger.info('Computing %d tiles using %d worker(s)', len(pending), args.workers)
+    try:
+        if args.workers > 1 and len(pending) > 0:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                     initargs=(loops, distance_options)) as executor:
+                for index, block in executor.map(_compute_tile_task, *zip(*pending)):
+                    store_block(index, block)
+
+        else:
+            for index, cdr_loop, tile in pending:
+                store_block(index, compute_tile(loops[cdr_loop], tile, **distance_options))
 
-            cdr_loops = cdrs_with_anchors[chain][cdr]
-            num_loops = len(cdr_loops)
-            distance_matrix = np.zeros((num_loops, num_loops))
+    except BaseException:
+        if args.checkpoint_interval > 0:
+            save_checkpoint()
 
-            for i in range(num_loops):
-                for j in range(i + 1, num_loops):
-                    loop_with_anchor_1 = cdr_loops[i]
-                    loop_with_anchor_2 = cdr_loops[j]
+        raise
 
-                    anchor_coords_1 = get_coords(loop_with_anchor_1.query('cdr.isnull()'))
-                    anchor_coords_2 = get_coords(loop_with_anchor_2.query('cdr.isnull()'))
+    if args.shard:
+        logger.info('Writing shard results')
 
-                    loop_with_anchor_2 = align_pandas_structure(anchor_coords_2, anchor_coords_1, loop_with_anchor_2)
+        # The distances reused from a previous run are not part of any tile, so they are stored by the first shard
+        tile_blocks = {}
+        for cdr_loop, distance_matrix in distance_matrices.items():
+            tile_blocks[cdr_loop] = []
 
-                    loop_coords_1 = get_coords(loop_with_anchor_1.query('cdr.notnull()'))
-                    loop_coords_2 = get_coords(loop_with_anchor_2.query('cdr.notnull()'))
+            if num_previous > 0 and args.shard[0] == 1:
+                tile_blocks[cdr_loop].append(((0, num_previous, 0, num_previous),
+                                              distance_matrix[:num_previous, :num_previous]))
 
-                    distance = distance_fast(loop_coords_1.astype(np.double), loop_coords_2.astype(np.double))
+        for index in selected:
+            cdr_loop, tile = tasks[index]
+            row_start, row_stop, col_start, col_stop = tile
 
-                    distance_matrix[i, j] = distance
+            if cdr_loop in tile_blocks:
+                block = distance_matrices[cdr_loop][row_start:row_stop, col_start:col_stop]
+                tile_blocks[cdr_loop].append((tile, block))
 
-            distance_matrix = np.maximum(distance_matrix, distance_matrix.transpose())
+        save_shard(os.path.join(args.output, 'shard.npz'), completed, pair_counts, tile_blocks, nearest_neighbours)
 
-            logger.info('Writing distance matrix')
-            name = f"cdr{cdr}_{chain.split('_')[0]}_distance_matrix.txt"
+    else:
+        write_distances(args.output, distance_matrices, nearest_neighbours,
+                        args.output_format, args.dtype, args.compress_output)
 
-            if args.compress_output:
-                name += '.gz'
+        if pair_counts is not None:
+            logger.info('Abandoned %d of %d pairs early', *pair_counts[:, ::-1].sum(axis=0))
+            write_early_abandoning_report(os.path.join(args.output, 'early_abandoning.csv'), pair_counts)
 
-            np.savetxt(os.path.join(args.output, name), distance_matrix)
+    if os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
 
 
 if __name__ == '__main__':
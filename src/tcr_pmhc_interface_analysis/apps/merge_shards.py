@@ -0,0 +1,264 @@
+'''Merge the outputs of sharded runs into the outputs of a single run.
+
+Runs of ``compute_pw_distances`` and ``compute_apo_holo_differences`` given ``--shard i/N`` each only process a slice of
+the work. Once all N shards have finished, their outputs are combined into exactly the files that a single run without
+``--shard`` would have written:
+
+- ``pw_distances``: the shard output directories of ``compute_pw_distances`` are merged into a directory of distance
+  matrices (or nearest neighbour graphs), written in the format given by ``--output-format``, ``--dtype``, and
+  ``--compress-output``.
+- ``apo_holo_differences``: the shard tables of ``compute_apo_holo_differences`` are concatenated in shard order. CSV
+  and Parquet files give a file of the same format, and the directories of ``--partition-by-complex`` are merged into
+  one directory, as every complex is in a single shard.
+
+'''
+import argparse
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
+from tcr_pmhc_interface_analysis.apps._output import _import_pyarrow, open_csv
+from tcr_pmhc_interface_analysis.apps.compute_pw_distances import (load_shard, write_distances,
+                                                                   write_early_abandoning_report)
+from tcr_pmhc_interface_analysis.distance_matrices import merge_nearest_neighbours
+
+logger = logging.getLogger()
+
+parser = argparse.ArgumentParser(prog=f'python -m {sys.modules[__name__].__spec__.name}',
+                                 description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+
+parser.add_argument('kind', choices=['pw_distances', 'apo_holo_differences'], help='type of outputs being merged')
+parser.add_argument('shards', nargs='+', help='outputs of every shard, given in shard order (1/N to N/N)')
+parser.add_argument('--output', '-o', help='path to output location')
+parser.add_argument('--compress-output', action='store_true',
+                    help='compress the output matrices using gzip (pw_distances text format only)')
+parser.add_argument('--output-format', choices=['txt', 'npy'], default='txt',
+                    help="format of the output matrices for pw_distances (Default: 'txt')")
+parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                    help="data type of binary output matrices for pw_distances (Default: 'float64')")
+
+add_logging_arguments(parser)
+
+
+def merge_pw_distances(shard_dirs: list[str]) -> tuple[list[str], np.ndarray | None, dict, dict]:
+    '''Merge the partial results of compute_pw_distances shards.
+
+    Args:
+        shard_dirs: output directories of every shard
+
+    Returns:
+        structure names, the number of computed and abandoned pairs of each CDR (None without early abandoning), upper
+        triangles of the distance matrices, and nearest neighbours of each CDR
+
+    Raises:
+        ValueError: if the shards were run with different settings or do not cover every tile exactly once
+
+    '''
+    structure_names = None
+    completed = None
+    pair_counts = None
+    tile_blocks = {}
+    nearest_neighbours = {}
+    distance_matrices = {}
+
+    for shard_dir in shard_dirs:
+        logger.info('Merging shard %s', shard_dir)
+
+        with open(os.path.join(shard_dir, 'structure_names.txt'), 'r') as fh:
+            shard_structure_names = [line.strip() for line in fh.readlines() if line.strip()]
+
+        shard_completed, shard_pair_counts, shard_tile_blocks, shard_nearest_neighbours = load_shard(
+            os.path.join(shard_dir, 'shard.npz')
+        )
+
+        if completed is None:
+            structure_names = shard_structure_names
+            completed = shard_completed
+            pair_counts = shard_pair_counts
+            tile_blocks = shard_tile_blocks
+            nearest_neighbours = shard_nearest_neighbours
+
+            distance_matrices = {cdr_loop: np.zeros((len(structure_names), len(structure_names)))
+                                 for cdr_loop in tile_blocks}
+
+        else:
+            if (shard_structure_names != structure_names
+                    or len(shard_completed) != len(completed)
+                    or (shard_pair_counts is None) != (pair_counts is None)
+                    or shard_tile_blocks.keys() != tile_blocks.keys()
+                    or shard_nearest_neighbours.keys() != nearest_neighbours.keys()):
+                raise ValueError(f'shard {shard_dir} was run with different settings to {shard_dirs[0]}')
+
+            if np.any(completed & shard_completed):
+                raise ValueError(f'shard {shard_dir} overlaps with another shard')
+
+            for cdr_loop, (distances, indices) in shard_nearest_neighbours.items():
+                merge_nearest_neighbours(*nearest_neighbours[cdr_loop], distances, indices)
+
+            completed = completed | shard_completed
+
+            if pair_counts is not None:
+                pair_counts = pair_counts + shard_pair_counts
+
+        # Every tile is computed by one shard only, so the blocks are placed without overlapping
+        for cdr_loop, blocks in shard_tile_blocks.items():
+            for (row_start, row_stop, col_start, col_stop), block in blocks:
+                distance_matrices[cdr_loop][row_start:row_stop, col_start:col_stop] = block
+
+    if not np.all(completed):
+        raise ValueError(f'{np.count_nonzero(~completed)} of {len(completed)} tiles are missing from the shards')
+
+    return structure_names, pair_counts, distance_matrices, nearest_neighbours
+
+
+def _is_parquet_file(path: str) -> bool:
+    with open(path, 'rb') as fh:
+        return fh.read(4) == b'PAR1'
+
+
+def merge_apo_holo_differences(shard_paths: list[str], output: str) -> None:
+    '''Merge the tables of compute_apo_holo_differences shards, in the format they were written in.
+
+    Raises:
+        ValueError: if the shards do not have the same format and columns, or a complex is in several partitioned shards
+
+    '''
+    if all(os.path.isdir(shard_path) for shard_path in shard_paths):
+        merge_partitioned_tables(shard_paths, output)
+
+    elif not any(os.path.isdir(shard_path) for shard_path in shard_paths):
+        is_parquet = [_is_parquet_file(shard_path) for shard_path in shard_paths]
+
+        if all(is_parquet):
+            merge_parquet_tables(shard_paths, output)
+
+        elif not any(is_parquet):
+            merge_csv_tables(shard_paths, output)
+
+        else:
+            raise ValueError('shards mix CSV and Parquet files')
+
+    else:
+        raise ValueError('shards mix partitioned directories and files')
+
+
+def merge_csv_tables(shard_files: list[str], output: str) -> None:
+    '''Concatenate the CSV files of shards, keeping a single header.
+
+    Files are (de)compressed according to the extension of their path, see `_output.open_csv`.
+
+    Raises:
+        ValueError: if the shards do not have the same columns
+
+    '''
+    header = None
+
+    with open_csv(output, 'w') as output_fh:
+        for shard_file in shard_files:
+            logger.info('Merging shard %s', shard_file)
+
+            with open_csv(shard_file, 'r') as fh:
+                shard_header = fh.readline()
+
+                if header is None:
+                    header = shard_header
+                    output_fh.write(header)
+
+                elif shard_header != header:
+                    raise ValueError(f'shard {shard_file} has different columns to {shard_files[0]}')
+
+                for line in fh:
+                    output_fh.write(line)
+
+
+def merge_parquet_tables(shard_files: list[str], output: str) -> None:
+    '''Concatenate the Parquet files of shards, copying their row groups.
+
+    Raises:
+        ValueError: if the shards do not have the same schema
+
+    '''
+    _, pq = _import_pyarrow()
+
+    schema = pq.read_schema(shard_files[0])
+
+    with pq.ParquetWriter(output, schema) as writer:
+        for shard_file in shard_files:
+            logger.info('Merging shard %s', shard_file)
+
+            shard = pq.ParquetFile(shard_file)
+
+            if not shard.schema_arrow.equals(schema):
+                raise ValueError(f'shard {shard_file} has different columns to {shard_files[0]}')
+
+            for row_group in range(shard.num_row_groups):
+                writer.write_table(shard.read_row_group(row_group))
+
+
+def merge_partitioned_tables(shard_dirs: list[str], output: str) -> None:
+    '''Merge the directories of partitioned Parquet tables of shards, moving no partition between the shards.
+
+    Partitions of an earlier output are replaced, as a compute_apo_holo_differences run would replace them.
+
+    Raises:
+        ValueError: if a partition is in several shards
+
+    '''
+    partition_shards = {}
+
+    for shard_dir in shard_dirs:
+        for partition in sorted(os.listdir(shard_dir)):
+            if '=' not in partition:
+                continue
+
+            if partition in partition_shards:
+                raise ValueError(f'shards {partition_shards[partition]} and {shard_dir} both have {partition}')
+
+            partition_shards[partition] = shard_dir
+
+    os.makedirs(output, exist_ok=True)
+
+    for partition in os.listdir(output):
+        if '=' in partition:
+            shutil.rmtree(os.path.join(output, partition))
+
+    for partition, shard_dir in partition_shards.items():
+        logger.info('Merging %s from shard %s', partition, shard_dir)
+        shutil.copytree(os.path.join(shard_dir, partition), os.path.join(output, partition))
+
+
+def main():
+    args = parser.parse_args()
+    setup_logger(logger, args.log_level)
+
+    try:
+        if args.kind == 'pw_distances':
+            structure_names, pair_counts, distance_matrices, nearest_neighbours = merge_pw_distances(args.shards)
+
+            if not os.path.exists(args.output):
+                os.mkdir(args.output)
+
+            with open(os.path.join(args.output, 'structure_names.txt'), 'w') as fh:
+                fh.write('\n'.join(structure_names))
+                fh.write('\n')
+
+            write_distances(args.output, distance_matrices, nearest_neighbours,
+                            args.output_format, args.dtype, args.compress_output)
+
+            if pair_counts is not None:
+                write_early_abandoning_report(os.path.join(args.output, 'early_abandoning.csv'), pair_counts)
+
+        elif args.kind == 'apo_holo_differences':
+            merge_apo_holo_differences(args.shards, args.output)
+
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == '__main__':
+    main()
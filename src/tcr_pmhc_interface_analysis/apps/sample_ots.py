@@ -1,4 +1,8 @@
-'''Sample OTS sequences and select columns.'''
+'''Sample OTS sequences and select columns.
+
+With ``--format parquet`` the sample is written as Parquet, with the V and J gene calls as categoricals.
+
+'''
 import argparse
 import glob
 import gzip
@@ -11,6 +15,7 @@ import numpy as np
 import pandas as pd
 
 from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
+from tcr_pmhc_interface_analysis.apps._output import TableWriter, add_output_arguments, get_output_format
 
 logger = logging.getLogger()
 
@@ -23,6 +28,14 @@ DEFAULT_COLUMNS = ['cdr1_aa_alpha', 'cdr2_aa_alpha', 'cdr3_aa_alpha',
                    'v_call_alpha', 'v_call_beta',
                    'j_call_alpha', 'j_call_beta']
 
+PARQUET_DTYPES = {
+    'v_call_alpha': 'category',
+    'v_call_beta': 'category',
+    'j_call_alpha': 'category',
+    'j_call_beta': 'category',
+}
+'''Data types of the columns of the sample written as Parquet.'''
+
 parser.add_argument('path', help='path to OTS files')
 parser.add_argument('--sample-size', type=int, default=1000, help='size of samples (Default: 1000)')
 parser.add_argument('--num', '-n', type=int, default=1, help='number of samples to take (Default: 1)')
@@ -32,8 +45,9 @@ parser.add_argument('--columns',
                     nargs='+',
                     default=DEFAULT_COLUMNS,
                     help=f"relevant columns to include (Default: {', '.join(DEFAULT_COLUMNS)})")
-parser.add_argument('--output', '-o', required=True, help='path to output csv')
+parser.add_argument('--output', '-o', required=True, help='path to output file')
 
+add_output_arguments(parser)
 add_logging_arguments(parser)
 
 
@@ -79,7 +93,10 @@ def main() -> None:
     ots_sample = pd.concat(samples)
 
     logger.info('Writing output to %s', args.output)
-    ots_sample[args.columns + ['sample_num'] if args.num > 1 else args.columns].to_csv(args.output, index=False)
+    with TableWriter(args.output, args.columns + ['sample_num'] if args.num > 1 else args.columns,
+                     file_format=get_output_format(args.output, args.format),
+                     parquet_dtypes=PARQUET_DTYPES) as writer:
+        writer.write(ots_sample)
 
 
 if __name__ == '__main__':
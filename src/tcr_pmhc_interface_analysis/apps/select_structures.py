@@ -1,4 +1,10 @@
-'''Select apo and holo structures from the STCRDab and Histo.fyi.'''
+'''Select apo and holo structures from the STCRDab and Histo.fyi.
+
+The summary of the selected structures is written to ``apo_holo_summary.csv``, which is read by the other apps. With
+``--format parquet`` it is also written to ``apo_holo_summary.parquet``, with the structure types, states and MHC slugs
+as categoricals.
+
+'''
 import argparse
 import glob
 import logging
@@ -8,9 +14,9 @@ import sys
 import numpy as np
 import pandas as pd
 from python_pdb.entities import Structure
-from python_pdb.parsers import parse_pdb_to_pandas
 
 from tcr_pmhc_interface_analysis.apps._log import add_logging_arguments, setup_logger
+from tcr_pmhc_interface_analysis.apps._output import TableWriter, add_output_arguments
 from tcr_pmhc_interface_analysis.histo_fyi_utils import (PMHC_CLASS_I_URL, TCR_PMHC_CLASS_I_URL, fetch_structure,
                                                          retrieve_data_from_api)
 from tcr_pmhc_interface_analysis.missing_residues import (get_raw_structures_with_missing_residues,
@@ -18,9 +24,20 @@ from tcr_pmhc_interface_analysis.missing_residues import (get_raw_structures_wit
                                                           screen_tcrs_for_missing_residues)
 from tcr_pmhc_interface_analysis.stcrdab_utils import (get_ab_tcr_mhc_class_Is_from_stcrdab, get_ab_tcrs_from_stcrdab,
                                                        get_stcrdab_sequences)
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
 
 logger = logging.getLogger()
 
+SUMMARY_COLUMNS = ['file_name', 'pdb_id', 'structure_type', 'state', 'alpha_chain', 'beta_chain', 'antigen_chain',
+                   'mhc_chain1', 'mhc_chain2', 'cdr_sequences_collated', 'peptide_sequence', 'mhc_slug']
+
+SUMMARY_PARQUET_DTYPES = {
+    'structure_type': 'category',
+    'state': 'category',
+    'mhc_slug': 'category',
+}
+'''Data types of the columns of the summary written as Parquet.'''
+
 parser = argparse.ArgumentParser(prog=f'python -m {sys.modules[__name__].__spec__.name}',
                                  description=__doc__,
                                  formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -33,6 +50,7 @@ parser.add_argument('--drop-duplicate-ids', action='store_true',
                     help='Only keep one copy of the structure from a pdb id')
 parser.add_argument('--output', '-o', help='Path to output location')
 
+add_output_arguments(parser, infer_format=False)
 add_logging_arguments(parser)
 
 
@@ -194,18 +212,12 @@ def main():
         os.mkdir(args.output)
 
     logger.info('Writing summary file')
-    apo_holo[['file_name',
-              'pdb_id',
-              'structure_type',
-              'state',
-              'alpha_chain',
-              'beta_chain',
-              'antigen_chain',
-              'mhc_chain1',
-              'mhc_chain2',
-              'cdr_sequences_collated',
-              'peptide_sequence',
-              'mhc_slug']].to_csv(os.path.join(args.output, 'apo_holo_summary.csv'), index=False)
+    apo_holo[SUMMARY_COLUMNS].to_csv(os.path.join(args.output, 'apo_holo_summary.csv'), index=False)
+
+    if args.format == 'parquet':
+        with TableWriter(os.path.join(args.output, 'apo_holo_summary.parquet'), SUMMARY_COLUMNS,
+                         file_format='parquet', parquet_dtypes=SUMMARY_PARQUET_DTYPES) as writer:
+            writer.write(apo_holo)
 
     logger.info('Collecting structures')
 
@@ -218,10 +230,9 @@ def main():
 
         match row.structure_type:
             case 'tcr':
-                with open(os.path.join(args.stcrdab, 'imgt', f'{row.pdb_id}.pdb'), 'r') as fh:
-                    structure_df = parse_pdb_to_pandas(fh.read())
+                tcr_df = load_structure(os.path.join(args.stcrdab, 'imgt', f'{row.pdb_id}.pdb'),
+                                        chains=[row.alpha_chain, row.beta_chain])
 
-                tcr_df = structure_df.query('chain_id == @row.alpha_chain or chain_id == @row.beta_chain')
                 output_text = str(Structure.from_pandas(tcr_df))
 
             case 'pmhc':
@@ -232,14 +243,9 @@ def main():
                     output_text = fetch_structure(row.pdb_id, row.assembly_number)
 
                 else:
-                    with open(os.path.join(args.stcrdab, 'imgt', f'{row.pdb_id}.pdb'), 'r') as fh:
-                        structure_df = parse_pdb_to_pandas(fh.read())
-
-                    tcr_pmhc_df = structure_df.query(('chain_id == @row.alpha_chain '
-                                                      'or chain_id == @row.beta_chain '
-                                                      'or chain_id == @row.antigen_chain '
-                                                      'or chain_id == @row.mhc_chain1 '
-                                                      'or chain_id == @row.mhc_chain2'))
+                    chains = [row.alpha_chain, row.beta_chain, row.antigen_chain, row.mhc_chain1, row.mhc_chain2]
+                    tcr_pmhc_df = load_structure(os.path.join(args.stcrdab, 'imgt', f'{row.pdb_id}.pdb'),
+                                                 chains=[chain for chain in chains if pd.notnull(chain)])
 
                     output_text = str(Structure.from_pandas(tcr_pmhc_df))
 
@@ -1,48 +1,71 @@
+'''Atoms defining the side chain dihedral (chi) angles of each amino acid.'''
+MAX_CHI_ANGLES = 4
+'''Largest number of chi angles of an amino acid.'''
+
 CHI_ATOMS = {
     'ALA': {
         1: None,
     },
     'ARG': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD'],
+        3: ['CB', 'CG', 'CD', 'NE'],
+        4: ['CG', 'CD', 'NE', 'CZ'],
     },
     'ASN': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'OD1'],
     },
     'ASP': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'OD1'],
     },
     'CYS': {
         1: ['N', 'CA', 'CB', 'SG'],
     },
     'GLN': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD'],
+        3: ['CB', 'CG', 'CD', 'OE1'],
     },
     'GLU': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD'],
+        3: ['CB', 'CG', 'CD', 'OE1'],
     },
     'GLY': {
         1: None,
     },
     'HIS': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'ND1'],
     },
     'ILE': {
         1: ['N', 'CA', 'CB', 'CG1'],
+        2: ['CA', 'CB', 'CG1', 'CD1'],
     },
     'LEU': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD1'],
     },
     'LYS': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD'],
+        3: ['CB', 'CG', 'CD', 'CE'],
+        4: ['CG', 'CD', 'CE', 'NZ'],
     },
     'MET': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'SD'],
+        3: ['CB', 'CG', 'SD', 'CE'],
     },
     'PHE': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD1'],
     },
     'PRO': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD'],
     },
     'SER': {
         1: ['N', 'CA', 'CB', 'OG'],
@@ -52,11 +75,14 @@ CHI_ATOMS = {
     },
     'TRP': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD1'],
     },
     'TYR': {
         1: ['N', 'CA', 'CB', 'CG'],
+        2: ['CA', 'CB', 'CG', 'CD1'],
     },
     'VAL': {
         1: ['N', 'CA', 'CB', 'CG1'],
     },
 }
+'''Names of the four atoms of every chi angle (numbered from 1) of each amino acid.'''
@@ -0,0 +1,187 @@
+'''Functions for reading and writing pairwise distance matrices.
+
+Distance matrices can be stored in three formats:
+
+- text (``.txt`` or ``.txt.gz``): the full square matrix written with `numpy.savetxt`
+- binary (``.npy``): the condensed upper triangle (excluding the diagonal) in row-major order, as produced by
+  `scipy.spatial.distance.squareform`, stored with a ``.npy`` header. This halves the storage needed and can be memory
+  mapped when loading.
+- sparse (``.npz``): a symmetric k-nearest-neighbour graph saved with `scipy.sparse.save_npz`, where pairs that are not
+  stored are treated as infinitely distant.
+
+'''
+import os
+
+import numpy as np
+import scipy.sparse
+from scipy.spatial.distance import squareform
+
+MATRIX_EXTENSIONS = ('.txt', '.txt.gz', '.npy', '.npz')
+'''File extensions of the supported distance matrix formats.'''
+
+
+def condense_distance_matrix(distance_matrix: np.ndarray, dtype: np.dtype | str | None = None) -> np.ndarray:
+    '''Get the upper triangle of a symmetric distance matrix as a condensed vector.'''
+    condensed = squareform(np.asarray(distance_matrix), force='tovector', checks=False)
+
+    return condensed.astype(dtype or condensed.dtype, copy=False)
+
+
+def expand_distance_matrix(condensed: np.ndarray, dtype: np.dtype | str | None = None) -> np.ndarray:
+    '''Expand a condensed vector into a full symmetric distance matrix.
+
+    The full matrix needs about twice the memory of the condensed vector in the same data type.
+
+    Args:
+        condensed: upper triangle of the matrix in row-major order
+        dtype: data type of the full matrix (Default: the data type of the condensed vector)
+
+    '''
+    num_rows = int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+
+    if num_rows * (num_rows - 1) // 2 != len(condensed):
+        raise ValueError(f'Condensed distance matrix has an invalid length: {len(condensed)}')
+
+    return squareform(np.asarray(condensed, dtype=dtype), force='tomatrix', checks=False)
+
+
+def save_distance_matrix(path: str,
+                         distance_matrix: np.ndarray | scipy.sparse.csr_matrix,
+                         dtype: np.dtype | str | None = None) -> None:
+    '''Save a distance matrix, the format is chosen from the file extension.
+
+    Args:
+        path: output path ending in one of `MATRIX_EXTENSIONS`
+        distance_matrix: full symmetric distance matrix, or a sparse distance graph for ``.npz`` output
+        dtype: data type used for binary output (Default: the data type of the matrix)
+
+    '''
+    if path.endswith('.npy'):
+        np.save(path, condense_distance_matrix(distance_matrix, dtype))
+
+    elif path.endswith('.npz'):
+        scipy.sparse.save_npz(path, distance_matrix)
+
+    else:
+        np.savetxt(path, distance_matrix)
+
+
+def load_distance_matrix(path: str) -> np.ndarray | scipy.sparse.csr_matrix:
+    '''Load a distance matrix in any of the supported formats.
+
+    Binary matrices are memory mapped and expanded into a full matrix of the data type they were saved in, avoiding any
+    parsing buffers. The expansion still needs memory for the full matrix (and a copy of the condensed vector while it
+    is filled), as clustering the matrix with HDBSCAN needs it in full. Sparse graphs are returned as sparse CSR
+    matrices.
+
+    '''
+    if path.endswith('.npy'):
+        return expand_distance_matrix(np.load(path, mmap_mode='r'))
+
+    if path.endswith('.npz'):
+        return scipy.sparse.load_npz(path).tocsr()
+
+    return np.loadtxt(path, ndmin=2)
+
+
+def find_distance_matrix(directory: str, name: str) -> str:
+    '''Find the path to a distance matrix in a directory regardless of the format it was saved in.'''
+    for extension in MATRIX_EXTENSIONS:
+        path = os.path.join(directory, name + extension)
+
+        if os.path.exists(path):
+            return path
+
+    raise FileNotFoundError(f'No distance matrix named {name} found in {directory}')
+
+
+def init_nearest_neighbours(num_rows: int, num_neighbours: int) -> tuple[np.ndarray, np.ndarray]:
+    '''Create empty arrays for the distances and indices of the nearest neighbours of each row.'''
+    num_neighbours = min(num_neighbours, max(num_rows - 1, 0))
+
+    return np.full((num_rows, num_neighbours), np.inf), np.full((num_rows, num_neighbours), -1, dtype=np.int64)
+
+
+def _merge_nearest_neighbours(neighbour_distances: np.ndarray,
+                              neighbour_indices: np.ndarray,
+                              rows: np.ndarray,
+                              candidate_distances: np.ndarray,
+                              candidate_indices: np.ndarray) -> None:
+    num_neighbours = neighbour_distances.shape[1]
+
+    distances = np.hstack([neighbour_distances[rows], candidate_distances])
+    indices = np.hstack([neighbour_indices[rows], np.broadcast_to(candidate_indices, candidate_distances.shape)])
+
+    order = np.argsort(distances, axis=1, kind='stable')[:, :num_neighbours]
+
+    neighbour_distances[rows] = np.take_along_axis(distances, order, axis=1)
+    neighbour_indices[rows] = np.take_along_axis(indices, order, axis=1)
+
+
+def update_nearest_neighbours(neighbour_distances: np.ndarray,
+                              neighbour_indices: np.ndarray,
+                              block: np.ndarray,
+                              tile: tuple[int, int, int, int]) -> None:
+    '''Update the nearest neighbours of every row in place with a tile of the upper triangle of a distance matrix.
+
+    Only entries of the block above the diagonal are considered, and they update the neighbours of both the row and the
+    column they are in.
+
+    Args:
+        neighbour_distances: distances to the nearest neighbours of each row, sorted in ascending order
+        neighbour_indices: indices of the nearest neighbours of each row (-1 if there is no neighbour)
+        block: distances of the tile
+        tile: the location of the block as (row_start, row_stop, col_start, col_stop)
+
+    '''
+    if neighbour_distances.shape[1] == 0:
+        return
+
+    row_start, row_stop, col_start, col_stop = tile
+    rows = np.arange(row_start, row_stop)
+    cols = np.arange(col_start, col_stop)
+
+    block = np.where(cols[np.newaxis, :] > rows[:, np.newaxis], block, np.inf)
+
+    _merge_nearest_neighbours(neighbour_distances, neighbour_indices, rows, block, cols)
+    _merge_nearest_neighbours(neighbour_distances, neighbour_indices, cols, block.T, rows)
+
+
+def merge_nearest_neighbours(neighbour_distances: np.ndarray,
+                             neighbour_indices: np.ndarray,
+                             other_distances: np.ndarray,
+                             other_indices: np.ndarray) -> None:
+    '''Merge in place the nearest neighbours found in a disjoint set of pairs, e.g. from another shard of tiles.'''
+    if neighbour_distances.shape[1] == 0:
+        return
+
+    _merge_nearest_neighbours(neighbour_distances, neighbour_indices, np.arange(len(neighbour_distances)),
+                              other_distances, other_indices)
+
+
+def build_nearest_neighbour_graph(neighbour_distances: np.ndarray,
+                                  neighbour_indices: np.ndarray) -> scipy.sparse.csr_matrix:
+    '''Build a symmetric sparse distance graph from the nearest neighbours of each row.
+
+    Pairs with a distance of zero are stored with the smallest positive float so they are not dropped from the graph.
+
+    '''
+    num_rows, num_neighbours = neighbour_distances.shape
+    valid = (neighbour_indices >= 0) & np.isfinite(neighbour_distances)
+
+    rows = np.repeat(np.arange(num_rows), num_neighbours)[valid.ravel()]
+    cols = neighbour_indices[valid]
+    distances = np.maximum(neighbour_distances[valid], np.finfo(np.float64).tiny)
+
+    graph = scipy.sparse.coo_matrix((distances, (rows, cols)), shape=(num_rows, num_rows)).tocsr()
+
+    return graph.maximum(graph.T).tocsr()
+
+
+def sparsify_distance_matrix(distance_matrix: np.ndarray, num_neighbours: int) -> scipy.sparse.csr_matrix:
+    '''Keep only the k nearest neighbours of each row of a full distance matrix as a symmetric sparse graph.'''
+    neighbour_distances, neighbour_indices = init_nearest_neighbours(len(distance_matrix), num_neighbours)
+    update_nearest_neighbours(neighbour_distances, neighbour_indices, distance_matrix,
+                              (0, len(distance_matrix), 0, len(distance_matrix)))
+
+    return build_nearest_neighbour_graph(neighbour_distances, neighbour_indices)
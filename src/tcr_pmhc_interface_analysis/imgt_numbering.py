@@ -1,4 +1,6 @@
 '''Constants and functions for annotating sequences as CDR domains in T cell receptors.'''
+import numpy as np
+
 IMGT_CDR1 = set(range(27, 38 + 1))
 '''IMGT residue numbers corresponding to CDR 1 domains.'''
 IMGT_CDR2 = set(range(56, 65 + 1))
@@ -14,6 +16,32 @@ IMGT_VARIABLE_DOMAIN = set(range(1, 128 + 1))
 IMGT_MHC_ABD = set(range(1, 92)) | set(range(1001, 1092))
 '''IMGT ranges of the antigen binding domain of MHC molecules.'''
 
+IMGT_CDR_NUMBERS = np.full(max(IMGT_CDR) + 1, np.nan)
+'''Lookup table of the CDR number (NaN outside of CDRs) indexed by IMGT residue number.'''
+for _number, _domain in enumerate((IMGT_CDR1, IMGT_CDR2, IMGT_CDR3), 1):
+    IMGT_CDR_NUMBERS[sorted(_domain)] = _number
+
+IMGT_MHC_ABD_MASK = np.zeros(max(IMGT_MHC_ABD) + 1, dtype=bool)
+'''Lookup table of membership of the MHC antigen binding domain indexed by IMGT residue number.'''
+IMGT_MHC_ABD_MASK[sorted(IMGT_MHC_ABD)] = True
+
+
+def _lookup(table: np.ndarray, seq_ids: np.ndarray, default):
+    seq_ids = np.asarray(seq_ids, dtype=np.int64)
+    in_table = (seq_ids >= 0) & (seq_ids < len(table))
+
+    return np.where(in_table, table[np.where(in_table, seq_ids, 0)], default)
+
+
+def assign_cdr_numbers(seq_ids: np.ndarray) -> np.ndarray:
+    '''Map an array of IMGT residue numbers to CDR numbers, with NaN for residues outside of CDR domains.'''
+    return _lookup(IMGT_CDR_NUMBERS, seq_ids, np.nan)
+
+
+def in_mhc_abd(seq_ids: np.ndarray) -> np.ndarray:
+    '''Check whether each of an array of IMGT residue numbers is in the MHC antigen binding domain.'''
+    return _lookup(IMGT_MHC_ABD_MASK, seq_ids, False)
+
 
 def assign_cdr_number(imgt_id: str | int | None) -> int | None:
     '''
@@ -0,0 +1,90 @@
+'''Compact storage of CDR loop coordinates for pairwise comparisons.'''
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from tcr_pmhc_interface_analysis.utils import get_coords
+
+
+@dataclass
+class LoopStore:
+    '''Anchor and loop coordinates of a collection of CDR loops held in contiguous arrays.
+
+    The coordinates of the i-th loop are ``loop_coords[loop_offsets[i]:loop_offsets[i + 1]]`` and the coordinates of its
+    anchors are ``anchor_coords[anchor_offsets[i]:anchor_offsets[i + 1]]``.
+
+    '''
+    anchor_coords: np.ndarray
+    anchor_offsets: np.ndarray
+    loop_coords: np.ndarray
+    loop_offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.loop_offsets) - 1
+
+    def get_anchors(self, index: int) -> np.ndarray:
+        '''Get the anchor coordinates of a loop.'''
+        return self.anchor_coords[self.anchor_offsets[index]:self.anchor_offsets[index + 1]]
+
+    def get_loop(self, index: int) -> np.ndarray:
+        '''Get the coordinates of a loop.'''
+        return self.loop_coords[self.loop_offsets[index]:self.loop_offsets[index + 1]]
+
+    def get_anchor_stack(self, start: int, stop: int) -> np.ndarray:
+        '''Get the anchors of a range of loops as an array of shape (num_loops, num_anchor_atoms, 3).'''
+        sizes = np.diff(self.anchor_offsets[start:stop + 1])
+
+        if np.any(sizes != sizes[0]):
+            raise ValueError('Loops must have the same number of anchor atoms to be stacked')
+
+        return self.anchor_coords[self.anchor_offsets[start]:self.anchor_offsets[stop]].reshape(stop - start, -1, 3)
+
+    def get_loop_lengths(self) -> np.ndarray:
+        '''Get the number of atoms in every loop.'''
+        return np.diff(self.loop_offsets)
+
+    def get_loop_stack(self, indices: np.ndarray) -> np.ndarray:
+        '''Get a selection of loops as an array of shape (num_loops, num_loop_atoms, 3).'''
+        sizes = np.diff(self.loop_offsets)[indices]
+
+        if np.any(sizes != sizes[0]):
+            raise ValueError('Loops must have the same number of atoms to be stacked')
+
+        atom_index = self.loop_offsets[indices][:, np.newaxis] + np.arange(sizes[0])
+
+        return self.loop_coords[atom_index]
+
+    def get_loop_range(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        '''Get the coordinates of a range of loops with their offsets relative to the first loop.'''
+        offsets = self.loop_offsets[start:stop + 1] - self.loop_offsets[start]
+
+        return self.loop_coords[self.loop_offsets[start]:self.loop_offsets[stop]], offsets
+
+
+def build_loop_store(loops_with_anchors: list[pd.DataFrame]) -> LoopStore:
+    '''Build a loop store from annotated dataframes of CDR loops with their anchor residues.
+
+    Args:
+        loops_with_anchors: dataframes where anchor atoms are those without a `cdr` annotation
+
+    Returns:
+        loop store with the coordinates of every loop in the order given
+
+    '''
+    anchors = [get_coords(loop[loop['cdr'].isnull()]) for loop in loops_with_anchors]
+    loops = [get_coords(loop[loop['cdr'].notnull()]) for loop in loops_with_anchors]
+
+    def concatenate(coords: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        offsets = np.zeros(len(coords) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(entry) for entry in coords])
+
+        if len(coords) == 0:
+            return np.empty((0, 3), dtype=np.float64), offsets
+
+        return np.ascontiguousarray(np.concatenate(coords), dtype=np.float64), offsets
+
+    anchor_coords, anchor_offsets = concatenate(anchors)
+    loop_coords, loop_offsets = concatenate(loops)
+
+    return LoopStore(anchor_coords, anchor_offsets, loop_coords, loop_offsets)
@@ -2,9 +2,13 @@ import numpy as np
 import pandas as pd
 from python_pdb.chemistry import MOLECULAR_WEIGHTS
 
-from tcr_pmhc_interface_analysis.chi_atoms import CHI_ATOMS
+from tcr_pmhc_interface_analysis.chi_atoms import CHI_ATOMS, MAX_CHI_ANGLES
+from tcr_pmhc_interface_analysis.structure_array import StructureArray
 from tcr_pmhc_interface_analysis.utils import get_coords
 
+MAX_PEPTIDE_BOND_LENGTH = 2.0
+'''Longest distance (in angstroms) between the C and N atoms of consecutive residues for them to be bonded.'''
+
 
 def get_distances(vec1, vec2):
     xx = np.square(vec1[:, 0] - vec2[:, 0])
@@ -22,40 +26,216 @@ def get_distance(vec1, vec2):
     return np.sqrt(xx + yy + zz)
 
 
-def compute_residue_com(residue: pd.DataFrame) -> np.array:
+def get_atom_position(residue: pd.DataFrame | StructureArray, atom_name: str) -> np.ndarray:
+    '''Get the position of the first atom of a residue with a given name.
+
+    Raises:
+        IndexError: if the residue has no atom with that name
+
+    '''
+    if isinstance(residue, StructureArray):
+        return residue.coords[residue.codes['atom_name'] == residue.get_code('atom_name', atom_name)][0]
+
+    return residue.query("atom_name == @atom_name")[['pos_x', 'pos_y', 'pos_z']].iloc[0].to_numpy()
+
+
+def compute_residue_com(residue: pd.DataFrame | StructureArray) -> np.array:
     '''Compute the centre of mass for a residue.'''
-    weights = residue['element'].map(MOLECULAR_WEIGHTS)
+    if isinstance(residue, StructureArray):
+        element_weights = [MOLECULAR_WEIGHTS.get(element, np.nan) for element in residue.categories['element']]
+        weights = np.array(element_weights + [np.nan])[residue.codes['element']]
+
+    else:
+        weights = residue['element'].map(MOLECULAR_WEIGHTS)
+
     coords = get_coords(residue)
 
     return np.average(coords, weights=weights, axis=0)
 
 
-def measure_chi_angle(residue_df: pd.DataFrame, number: int = 1) -> float:
-    res_name = residue_df.iloc[0]['residue_name']
-    residue_chi_atoms = CHI_ATOMS[res_name][number]
+def sum_segments(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    '''Sum consecutive segments of an array, ``values[offsets[i]:offsets[i + 1]]`` for every i.
+
+    Segments of the same length are summed together as the rows of one array, which gives exactly the same sums as
+    `np.sum` on each segment on its own (`np.add.reduceat` adds in a different order, so results differ in the last
+    bits). NumPy adds contiguous values pairwise and strided ones in sequence, so the columns of column-major arrays
+    (such as the coordinates of dataframes) are summed pairwise here too.
+
+    Args:
+        values: array with the values to sum along its first axis
+        offsets: start of every segment followed by the end of the last one
+
+    Returns:
+        array of shape (num_segments, *values.shape[1:]) with the sums, zero for empty segments
+
+    '''
+    lengths = np.diff(offsets)
+    sums = np.zeros((len(lengths),) + values.shape[1:], dtype=values.dtype)
+
+    column_major = values.ndim == 2 and values.flags.f_contiguous and not values.flags.c_contiguous
+
+    for length in np.unique(lengths[lengths > 0]):
+        segments = np.flatnonzero(lengths == length)
+        atoms = offsets[segments][:, np.newaxis] + np.arange(length)
+
+        if column_major:
+            # Indexing leaves the atoms strided, copying makes each segment contiguous again
+            sums[segments] = np.sum(values.T[:, atoms].copy(), axis=2).T
+
+        else:
+            sums[segments] = np.sum(values[atoms], axis=1)
+
+    return sums
+
+
+def compute_residue_differences(coords_x: np.ndarray,
+                                coords_y: np.ndarray,
+                                weights_x: np.ndarray,
+                                weights_y: np.ndarray,
+                                ca_atoms: np.ndarray,
+                                offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Compute the RMSD, CA distance and centre of mass distance of every residue between two conformations.
+
+    Atoms are matched between the conformations (row i of `coords_x` is the same atom as row i of `coords_y`) and
+    grouped by residue, with the atoms of the i-th residue at ``offsets[i]:offsets[i + 1]``. Values are the same as
+    those of `python_pdb.comparisons.rmsd`, `get_distance` and `compute_residue_com` for each residue on its own.
+
+    Args:
+        coords_x: positions of the atoms in the first conformation, as an array of shape (num_atoms, 3)
+        coords_y: positions of the atoms in the second conformation
+        weights_x: molecular weight of the atoms in the first conformation, NaN for unknown elements
+        weights_y: molecular weight of the atoms in the second conformation
+        ca_atoms: boolean mask of the CA atoms
+        offsets: start of every residue followed by the end of the last one
+
+    Returns:
+        RMSDs, CA distances (between the first CA atoms), and centre of mass distances of every residue, with NaN for
+        residues without a CA atom or with atoms of unknown weight
+
+    '''
+    num_residues = len(offsets) - 1
+    residue_ids = np.repeat(np.arange(num_residues), np.diff(offsets))
 
-    atom_positions = [residue_df.query("atom_name == @atom")[['pos_x', 'pos_y', 'pos_z']].iloc[0].to_numpy()
-                      for atom in residue_chi_atoms]
+    diff = coords_y - coords_x
+    distances = np.sqrt(np.sum(diff * diff, axis=1))
+    rmsds = np.sqrt(sum_segments(distances * distances, offsets) / np.diff(offsets))
 
-    b1 = atom_positions[1] - atom_positions[0]
-    b2 = atom_positions[2] - atom_positions[1]
-    b3 = atom_positions[3] - atom_positions[1]
+    ca_residues, first_cas = np.unique(residue_ids[ca_atoms], return_index=True)
+    ca_indices = np.flatnonzero(ca_atoms)[first_cas]
 
-    b1_norm = b1 / np.linalg.norm(b1)
-    b2_norm = b2 / np.linalg.norm(b2)
-    b3_norm = b3 / np.linalg.norm(b3)
+    ca_distances = np.full(num_residues, np.nan)
+    ca_distances[ca_residues] = get_distances(coords_x[ca_indices], coords_y[ca_indices])
+
+    coms = []
+    for coords, weights in (coords_x, weights_x), (coords_y, weights_y):
+        weighted_sums = sum_segments(coords * weights[:, np.newaxis], offsets)
+        coms.append(weighted_sums / sum_segments(weights, offsets)[:, np.newaxis])
+
+    com_distances = get_distances(*coms)
+
+    return rmsds, ca_distances, com_distances
+
+
+def calculate_chi_angles(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    '''Calculate chi angles from rows of four arrays of atom positions, as `measure_chi_angle` does for a residue.'''
+    b1 = b - a
+    b2 = c - b
+    b3 = d - b
+
+    b1_norm = b1 / np.linalg.norm(b1, axis=-1, keepdims=True)
+    b2_norm = b2 / np.linalg.norm(b2, axis=-1, keepdims=True)
+    b3_norm = b3 / np.linalg.norm(b3, axis=-1, keepdims=True)
 
     n1 = np.cross(b1_norm, b2_norm)
     n2 = np.cross(b2_norm, b3_norm)
 
     m1 = np.cross(n1, b2_norm)
 
-    x = np.dot(n1, n2)
-    y = np.dot(m1, n2)
+    x = np.sum(n1 * n2, axis=-1)
+    y = np.sum(m1 * n2, axis=-1)
 
     return np.arctan2(x, y)
 
 
+def measure_chi_angle(residue_df: pd.DataFrame | StructureArray, number: int = 1) -> float:
+    if isinstance(residue_df, StructureArray):
+        res_name = residue_df.get_column('residue_name')[0]
+
+    else:
+        res_name = residue_df.iloc[0]['residue_name']
+
+    residue_chi_atoms = CHI_ATOMS[res_name][number]
+
+    atom_positions = [get_atom_position(residue_df, atom)[np.newaxis] for atom in residue_chi_atoms]
+
+    return float(calculate_chi_angles(*atom_positions)[0])
+
+
+def measure_chi_angles(residues_df: pd.DataFrame,
+                       residue_ids: np.ndarray,
+                       num_residues: int,
+                       numbers: list[int] | None = None) -> np.ndarray:
+    '''Measure the chi angles of every residue at once.
+
+    Args:
+        residues_df: atoms of the residues
+        residue_ids: number of the residue (from 0 to num_residues - 1) of every atom
+        num_residues: number of residues
+        numbers: numbers of the chi angles to measure (Default: all of them, from 1 to MAX_CHI_ANGLES)
+
+    Returns:
+        array of shape (num_residues, len(numbers)) with the chi angles of every residue, NaN for angles the residue
+        does not have or that are missing atoms. If a residue has several atoms with the same name, the first one is
+        used.
+
+    '''
+    if numbers is None:
+        numbers = list(range(1, MAX_CHI_ANGLES + 1))
+
+    chi_angles = np.full((num_residues, len(numbers)), np.nan)
+
+    if num_residues == 0:
+        return chi_angles
+
+    coords = get_coords(residues_df)
+
+    # Index of the first atom of every (residue, atom name) pair, -1 if the residue has no such atom
+    atom_name_codes, atom_names = pd.factorize(residues_df['atom_name'])
+    atom_keys = residue_ids * len(atom_names) + atom_name_codes
+    keys, first_atoms = np.unique(atom_keys[atom_name_codes >= 0], return_index=True)
+
+    atom_index = np.full(num_residues * len(atom_names), -1)
+    atom_index[keys] = np.flatnonzero(atom_name_codes >= 0)[first_atoms]
+    atom_index = atom_index.reshape(num_residues, len(atom_names))
+
+    residues, first_residue_atoms = np.unique(residue_ids, return_index=True)
+    residue_names = np.empty(num_residues, dtype=object)
+    residue_names[residues] = residues_df['residue_name'].to_numpy()[first_residue_atoms]
+
+    positions = np.vstack([coords, np.full((1, 3), np.nan)])
+    atom_name_lookup = {atom_name: code for code, atom_name in enumerate(atom_names)}
+
+    for residue_name, residue_chi_atoms in CHI_ATOMS.items():
+        residues = np.flatnonzero(residue_names == residue_name)
+
+        if len(residues) == 0:
+            continue
+
+        for column, number in enumerate(numbers):
+            chi_atoms = residue_chi_atoms.get(number)
+
+            if chi_atoms is None:
+                continue
+
+            # Residues missing any of the atoms point at the row of NaN positions
+            quadruplets = [atom_index[residues, atom_name_lookup[atom_name]] if atom_name in atom_name_lookup
+                           else np.full(len(residues), -1) for atom_name in chi_atoms]
+
+            chi_angles[residues, column] = calculate_chi_angles(*(positions[atoms] for atoms in quadruplets))
+
+    return chi_angles
+
+
 def calculate_angle(v1, v2):
     n1 = np.linalg.norm(v1)
     n2 = np.linalg.norm(v2)
@@ -86,17 +266,119 @@ def calculate_dihedral_angle(a, b, c, d):
     return angle
 
 
-def calculate_phi_psi_angles(residue: pd.DataFrame,
-                             prev_residue: pd.DataFrame,
-                             next_residue: pd.DataFrame) -> tuple[float, float]:
+def calculate_angles(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
+    '''Calculate the angles between the rows of two arrays of vectors, as `calculate_angle` does for a pair.'''
+    cos_theta = np.sum(v1 * v2, axis=-1) / (np.linalg.norm(v1, axis=-1) * np.linalg.norm(v2, axis=-1))
+
+    return np.arccos(np.clip(cos_theta, -1, 1))
+
+
+def calculate_dihedral_angles(a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+    '''Calculate the dihedral angles of rows of four arrays of positions, as `calculate_dihedral_angle` does.'''
+    ba = a - b
+    bc = c - b
+    cd = d - c
+
+    u = np.cross(ba, bc)
+    v = np.cross(cd, bc)
+
+    w = np.cross(u, v)
+
+    angles = calculate_angles(u, v)
+
+    return np.where(calculate_angles(bc, w) > 0.001, -angles, angles)
+
+
+def get_backbone_coords(residues_df: pd.DataFrame,
+                        residue_ids: np.ndarray,
+                        num_residues: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Get the positions of the N, CA, and C atoms of every residue.
+
+    Args:
+        residues_df: atoms of the residues
+        residue_ids: number of the residue (from 0 to num_residues - 1) of every atom
+        num_residues: number of residues
+
+    Returns:
+        arrays of shape (num_residues, 3) of the N, CA and C positions, with NaN for missing atoms. If a residue has
+        several atoms with the same name, the first one is used.
+
+    '''
+    atom_names = residues_df['atom_name'].to_numpy()
+    coords = get_coords(residues_df)
+
+    backbone_coords = []
+
+    for atom_name in 'N', 'CA', 'C':
+        atoms = np.flatnonzero(atom_names == atom_name)
+        residues, first_atoms = np.unique(residue_ids[atoms], return_index=True)
+
+        atom_coords = np.full((num_residues, 3), np.nan)
+        atom_coords[residues] = coords[atoms[first_atoms]]
+
+        backbone_coords.append(atom_coords)
+
+    return tuple(backbone_coords)
+
+
+def calculate_backbone_dihedrals(n_coords: np.ndarray,
+                                 ca_coords: np.ndarray,
+                                 c_coords: np.ndarray,
+                                 max_peptide_bond_length: float = MAX_PEPTIDE_BOND_LENGTH,
+                                 ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Calculate the phi, psi, and omega angles of every residue of a chain.
+
+    Omega is the angle of the peptide bond preceding the residue (CA-C of the previous residue and N-CA of the
+    residue). Angles are NaN where atoms are missing, at the ends of the chain, and across chain breaks, where the C of
+    a residue is further than `max_peptide_bond_length` from the N of the next residue.
+
+    Args:
+        n_coords: positions of the N atoms of the residues in chain order, as an array of shape (num_residues, 3)
+        ca_coords: positions of the CA atoms
+        c_coords: positions of the C atoms
+
+    Returns:
+        phi, psi, and omega angles (in radians) of every residue
+
+    '''
+    num_residues = len(n_coords)
+
+    phi = np.full(num_residues, np.nan)
+    psi = np.full(num_residues, np.nan)
+    omega = np.full(num_residues, np.nan)
+
+    if num_residues < 2:
+        return phi, psi, omega
+
+    # Bonded to the next residue, comparisons with NaN positions are false
+    bonded = get_distances(c_coords[:-1], n_coords[1:]) <= max_peptide_bond_length
+
+    phi[1:] = np.where(bonded, calculate_dihedral_angles(c_coords[:-1], n_coords[1:], ca_coords[1:], c_coords[1:]),
+                       np.nan)
+    psi[:-1] = np.where(bonded, calculate_dihedral_angles(n_coords[:-1], ca_coords[:-1], c_coords[:-1], n_coords[1:]),
+                        np.nan)
+    omega[1:] = np.where(bonded, calculate_dihedral_angles(ca_coords[:-1], c_coords[:-1], n_coords[1:], ca_coords[1:]),
+                         np.nan)
+
+    return phi, psi, omega
+
+
+def calculate_d_scores(phi_x: np.ndarray, psi_x: np.ndarray, phi_y: np.ndarray, psi_y: np.ndarray) -> np.ndarray:
+    '''Calculate the D-scores of residues from their phi and psi angles in two conformations.'''
+    return (2 * (1 - np.cos(phi_x - phi_y))) + (2 * (1 - np.cos(psi_x - psi_y)))
+
+
+def calculate_phi_psi_angles(residue: pd.DataFrame | StructureArray,
+                             prev_residue: pd.DataFrame | StructureArray,
+                             next_residue: pd.DataFrame | StructureArray) -> tuple[float, float]:
     '''Calculate the dihedral (phi and psi) angles for a given residue.'''
-    c_prev_pos = prev_residue.query("atom_name == 'C'")[['pos_x', 'pos_y', 'pos_z']].iloc[0]
+    c_prev_pos = get_atom_position(prev_residue, 'C')
 
-    n_pos = residue.query("atom_name == 'N'")[['pos_x', 'pos_y', 'pos_z']].iloc[0]
-    ca_pos = residue.query("atom_name == 'CA'")[['pos_x', 'pos_y', 'pos_z']].iloc[0]
-    c_pos = residue.query("atom_name == 'C'")[['pos_x', 'pos_y', 'pos_z']].iloc[0]
+    n_pos = get_atom_position(residue, 'N')
+    ca_pos = get_atom_position(residue, 'CA')
+    c_pos = get_atom_position(residue, 'C')
 
-    n_next_pos = next_residue.query("atom_name == 'N'")[['pos_x', 'pos_y', 'pos_z']].iloc[0]
+    n_next_pos = get_atom_position(next_residue, 'N')
 
     phi_angle = calculate_dihedral_angle(c_prev_pos, n_pos, ca_pos, c_pos)
     psi_angle = calculate_dihedral_angle(n_pos, ca_pos, c_pos, n_next_pos)
@@ -7,9 +7,9 @@ import numpy as np
 import pandas as pd
 import requests
 from python_pdb.aligners import align_sequences
-from python_pdb.parsers import parse_pdb_to_pandas
 
 from tcr_pmhc_interface_analysis.imgt_numbering import IMGT_CDR
+from tcr_pmhc_interface_analysis.structure_loader import load_structure, parse_structure
 from tcr_pmhc_interface_analysis.utils import get_header, get_sequence
 
 logger = logging.getLogger(__name__)
@@ -116,8 +116,7 @@ def screen_tcrs_for_missing_residues(df: pd.DataFrame, raw_structure_dfs: dict[p
             valid_structures.append(True)
             continue
 
-        with open(entry['file_path_imgt'], 'r') as fh:
-            structure = parse_pdb_to_pandas(fh.read())
+        structure = load_structure(entry['file_path_imgt'])
 
         # 2. look if they are in TCR variable domains
         # 2a. alpha chain
@@ -190,7 +189,7 @@ def get_raw_structures_with_missing_residues(pdb_ids: list[str], stcrdab_path: s
             req = requests.get(f'https://files.rcsb.org/download/{pdb_id}.pdb')
             pdb_contents = req.text
 
-        structure = parse_pdb_to_pandas(pdb_contents)
+        structure = parse_structure(pdb_contents)
         header = get_header(pdb_contents)
 
         missing_entities = get_missing_residues_and_atoms(header)
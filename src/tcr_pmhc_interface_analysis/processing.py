@@ -1,15 +1,44 @@
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
 
-from tcr_pmhc_interface_analysis.imgt_numbering import IMGT_MHC_ABD, assign_cdr_number
+from tcr_pmhc_interface_analysis.imgt_numbering import assign_cdr_numbers, in_mhc_abd
+from tcr_pmhc_interface_analysis.structure_array import StructureArray
+
+
+def _annotate_arrays(chain_codes: np.ndarray,
+                     chain_ids: np.ndarray,
+                     seq_ids: np.ndarray,
+                     assign_chain_type) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Chain types are assigned once per distinct chain (code -1 being a missing chain ID) and residue numbers are
+    # annotated through lookup tables rather than atom by atom
+    chain_types = np.array([assign_chain_type(chain_id) for chain_id in chain_ids] + [assign_chain_type(None)],
+                           dtype=object)
+    chain_type = chain_types[chain_codes]
+
+    tcr_atoms = (chain_type == 'alpha_chain') | (chain_type == 'beta_chain')
+    cdr = np.where(tcr_atoms, assign_cdr_numbers(seq_ids), np.nan)
+
+    # Keep the column types of annotating atom by atom: None when no atom is in a CDR and integers when all of them are
+    if np.all(np.isnan(cdr)):
+        cdr = np.full(len(cdr), None, dtype=object)
+
+    elif not np.any(np.isnan(cdr)):
+        cdr = cdr.astype(np.int64)
+
+    mhc_abd = in_mhc_abd(seq_ids) & (chain_type == 'mhc_chain1')
+
+    return chain_type, cdr, mhc_abd
 
 
-def annotate_tcr_pmhc_df(structure_df: pd.DataFrame,
+def annotate_tcr_pmhc_df(structure_df: pd.DataFrame | StructureArray,
                          alpha_chain_id: str = None,
                          beta_chain_id: str = None,
                          antigen_chain_id: str = None,
                          mhc_chain1_id: str = None,
-                         mhc_chain2_id: str = None) -> pd.DataFrame:
-    '''Add chain_type and cdr columns to a structure dataframe.'''
+                         mhc_chain2_id: str = None) -> pd.DataFrame | StructureArray:
+    '''Add chain_type, cdr, and mhc_abd columns to a structure dataframe (or structure array).'''
     def assign_chain_type(chain_id: str) -> str | None:
         if chain_id == alpha_chain_id:
             return 'alpha_chain'
@@ -28,41 +57,205 @@ def annotate_tcr_pmhc_df(structure_df: pd.DataFrame,
 
         return None
 
-    structure_df = structure_df.copy()
-    structure_df['chain_type'] = structure_df['chain_id'].map(assign_chain_type)
+    if isinstance(structure_df, StructureArray):
+        chain_type, cdr, mhc_abd = _annotate_arrays(structure_df.codes['chain_id'],
+                                                    structure_df.categories['chain_id'],
+                                                    structure_df.values['residue_seq_id'],
+                                                    assign_chain_type)
 
-    structure_df['cdr'] = structure_df.apply(
-        lambda row: (assign_cdr_number(row.residue_seq_id)
-                     if row.chain_type == 'alpha_chain' or row.chain_type == 'beta_chain' else None),
-        axis=1,
-    )
+        return structure_df.assign(chain_type=chain_type, cdr=cdr, mhc_abd=mhc_abd)
 
-    structure_df['mhc_abd'] = structure_df.apply(
-        lambda row: row.residue_seq_id in IMGT_MHC_ABD and row.chain_type == 'mhc_chain1',
-        axis=1,
+    chain_codes, chain_ids = pd.factorize(structure_df['chain_id'])
+
+    structure_df = structure_df.copy()
+    structure_df['chain_type'], structure_df['cdr'], structure_df['mhc_abd'] = _annotate_arrays(
+        chain_codes,
+        chain_ids,
+        structure_df['residue_seq_id'].to_numpy(),
+        assign_chain_type,
     )
 
     return structure_df
 
 
-def find_anchors(cdr_df: pd.DataFrame,
-                 structure_df: pd.DataFrame,
-                 num_anchors: int = 1) -> tuple[pd.DataFrame, pd.DataFrame]:
-    '''Get the anchors of a cdr loop. DOES NOT SUPPORT MULTIPLE MODELS.'''
-    cdr_start_info = tuple(cdr_df.iloc[0][['chain_id', 'residue_seq_id', 'residue_insert_code']].tolist())
-    cdr_end_info = tuple(cdr_df.iloc[-1][['chain_id', 'residue_seq_id', 'residue_insert_code']].tolist())
+RESIDUE_KEY_COLUMNS = ['chain_id', 'residue_seq_id', 'residue_insert_code']
+
+
+@dataclass
+class ResidueIndex:
+    '''Residues of a structure dataframe (or structure array) in sorted order, with the positions of their atoms.
+
+    Residues are ordered by chain, residue number and insert code (missing insert codes last), as when grouping the
+    dataframe by those columns. The atoms of the i-th residue are at positions ``atom_order[offsets[i]:offsets[i + 1]]``
+    of the dataframe, and ``positions`` maps the key of every residue (chain_id, residue_seq_id, residue_insert_code)
+    to its place in the order.
+
+    '''
+    keys: list[tuple]
+    atom_order: np.ndarray
+    offsets: np.ndarray
+    positions: dict[tuple, int]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_atoms(self, start: int, stop: int) -> np.ndarray:
+        '''Get the positions of the atoms of a range of residues in the dataframe.'''
+        return self.atom_order[self.offsets[start]:self.offsets[stop]]
+
+
+def _get_column(structure_df: pd.DataFrame | StructureArray, column: str) -> np.ndarray:
+    if isinstance(structure_df, StructureArray):
+        return structure_df.get_column(column)
+
+    return structure_df[column].to_numpy()
+
+
+def _get_residue_key(structure_df: pd.DataFrame | StructureArray, atom: int) -> tuple:
+    chain_id, seq_id, insert_code = (_get_column(structure_df, column)[atom] for column in RESIDUE_KEY_COLUMNS)
+
+    return (chain_id, seq_id, None if pd.isna(insert_code) else insert_code)
+
+
+def _get_sort_codes(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    codes, uniques = pd.factorize(values, sort=True)
+
+    # Missing values are sorted last, as by groupby
+    return np.where(codes == -1, len(uniques), codes), uniques
+
+
+def build_residue_index(structure_df: pd.DataFrame | StructureArray) -> ResidueIndex:
+    '''Build the index of the residues of a structure dataframe (or structure array), see `ResidueIndex`.'''
+    chain_codes, chain_ids = _get_sort_codes(_get_column(structure_df, 'chain_id'))
+    seq_ids = _get_column(structure_df, 'residue_seq_id')
+    insert_codes, insert_code_values = _get_sort_codes(_get_column(structure_df, 'residue_insert_code'))
+
+    atom_order = np.lexsort((insert_codes, seq_ids, chain_codes))
+
+    keys = np.stack([chain_codes[atom_order], seq_ids[atom_order], insert_codes[atom_order]], axis=1)
+    starts = np.flatnonzero(np.append(True, np.any(keys[1:] != keys[:-1], axis=1)))
+    offsets = np.append(starts, len(atom_order))
+
+    chain_ids = np.append(np.asarray(chain_ids, dtype=object), None)
+    insert_code_values = np.append(np.asarray(insert_code_values, dtype=object), None)
+
+    residue_keys = [(chain_ids[chain_code], seq_id, insert_code_values[insert_code])
+                    for chain_code, seq_id, insert_code in keys[starts].tolist()]
+
+    return ResidueIndex(residue_keys,
+                        atom_order,
+                        offsets,
+                        {key: position for position, key in enumerate(residue_keys)})
+
+
+def find_anchor_atoms(cdr_df: pd.DataFrame | StructureArray,
+                      residue_index: ResidueIndex,
+                      num_anchors: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    '''Get the positions of the anchor atoms of a cdr loop in the dataframe a residue index was built from.
+
+    Args:
+        cdr_df: atoms of the cdr loop (as a dataframe or a structure array)
+        residue_index: index of the structure the loop belongs to
+        num_anchors: number of anchor residues on either side of the loop
+
+    Returns:
+        positions of the atoms of the residues before the loop and of the residues after it
+
+    '''
+    start = residue_index.positions[_get_residue_key(cdr_df, 0)]
+    end = residue_index.positions[_get_residue_key(cdr_df, -1)]
+
+    # Slicing a range keeps the behaviour of slicing the list of residues, including for negative starts
+    residues = range(len(residue_index))
+    start_residues = residues[start - num_anchors:start]
+    end_residues = residues[end + 1:end + 1 + num_anchors]
+
+    return (residue_index.get_atoms(start_residues.start, start_residues.stop),
+            residue_index.get_atoms(end_residues.start, end_residues.stop))
+
+
+def find_anchors(cdr_df: pd.DataFrame | StructureArray,
+                 structure_df: pd.DataFrame | StructureArray,
+                 num_anchors: int = 1,
+                 residue_index: ResidueIndex | None = None,
+                 ) -> tuple[pd.DataFrame, pd.DataFrame] | tuple[StructureArray, StructureArray]:
+    '''Get the anchors of a cdr loop. DOES NOT SUPPORT MULTIPLE MODELS.
+
+    Args:
+        cdr_df: atoms of the cdr loop
+        structure_df: structure containing the loop
+        num_anchors: number of anchor residues on either side of the loop
+        residue_index: index of structure_df, passing it avoids rebuilding it when finding the anchors of several loops
+
+    Returns:
+        atoms of the residues before the loop and of the residues after it
+
+    '''
+    if residue_index is None:
+        residue_index = build_residue_index(structure_df)
+
+    start_anchor, end_anchor = find_anchor_atoms(cdr_df, residue_index, num_anchors)
+
+    if isinstance(structure_df, StructureArray):
+        return structure_df.select(start_anchor), structure_df.select(end_anchor)
+
+    return structure_df.iloc[start_anchor], structure_df.iloc[end_anchor]
+
+
+def encode_atom_keys(structure_x: pd.DataFrame,
+                     structure_y: pd.DataFrame,
+                     columns: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    '''Encode the values of some columns of the atoms of two structures as one integer key per atom.
+
+    Keys are shared between the structures: two atoms have the same key when all of their values are equal, with
+    missing values equal to each other as they are in merges.
+
+    Args:
+        structure_x: atoms of the first structure
+        structure_y: atoms of the second structure
+        columns: columns making up the keys
+
+    Returns:
+        keys of the atoms of each structure
+
+    '''
+    keys = np.zeros(len(structure_x) + len(structure_y), dtype=np.int64)
+
+    for column in columns:
+        values = np.concatenate([structure_x[column].to_numpy(dtype=object),
+                                 structure_y[column].to_numpy(dtype=object)])
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+
+        # Keys are renumbered after every column so that they never overflow
+        keys, _ = pd.factorize(keys * len(uniques) + codes)
+
+    return keys[:len(structure_x)], keys[len(structure_x):]
+
+
+def match_atoms(keys_x: np.ndarray, keys_y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Find the pairs of atoms with the same key in two structures.
+
+    Pairs are in the order of the rows of an inner merge on the key columns: in the order of the atoms of the first
+    structure, and for each of them in the order of the matching atoms of the second.
+
+    Args:
+        keys_x: keys of the atoms of the first structure, see `encode_atom_keys`
+        keys_y: keys of the atoms of the second structure
+
+    Returns:
+        indices of the atoms of each pair in the first and second structures
 
-    residues = list(structure_df.groupby(['chain_id', 'residue_seq_id', 'residue_insert_code'], dropna=False))
+    '''
+    order_y = np.argsort(keys_y, kind='stable')
+    sorted_keys_y = keys_y[order_y]
 
-    for i, (residue_info, residue) in enumerate(residues):
-        if pd.isna(residue_info[-1]):
-            residue_info = (residue_info[0], residue_info[1], None)
+    starts = np.searchsorted(sorted_keys_y, keys_x, side='left')
+    counts = np.searchsorted(sorted_keys_y, keys_x, side='right') - starts
 
-        if cdr_start_info == residue_info:
-            start_anchor = pd.concat([res for _, res in residues[i - num_anchors: i]])
+    atoms_x = np.repeat(np.arange(len(keys_x)), counts)
 
-        if cdr_end_info == residue_info:
-            end_anchor = pd.concat([res for _, res in residues[(i + 1): (i + 1) + num_anchors]])
-            break
+    # Position of every pair among the matches of its atom in the first structure
+    match_numbers = np.arange(len(atoms_x)) - np.repeat(np.cumsum(counts) - counts, counts)
+    atoms_y = order_y[np.repeat(starts, counts) + match_numbers]
 
-    return start_anchor, end_anchor
+    return atoms_x, atoms_y
@@ -1,7 +1,7 @@
 import pandas as pd
-from python_pdb.parsers import parse_pdb_to_pandas
 
 from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
 from tcr_pmhc_interface_analysis.utils import get_sequence
 
 
@@ -64,8 +64,7 @@ def get_stcrdab_sequences(stcrdab_summary: pd.DataFrame, structure_type: str) ->
         sequences['mhc_chain_2'] = []
 
     for _, stcrdab_entry in stcrdab_summary.iterrows():
-        with open(stcrdab_entry['file_path_imgt'], 'r') as fh:
-            structure_df = parse_pdb_to_pandas(fh.read())
+        structure_df = load_structure(stcrdab_entry['file_path_imgt'])
 
         structure_df = structure_df.query("record_type == 'ATOM'")
         structure_df = annotate_tcr_pmhc_df(structure_df, stcrdab_entry['alpha_chain'], stcrdab_entry['beta_chain'])
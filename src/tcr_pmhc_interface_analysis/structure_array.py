@@ -0,0 +1,190 @@
+'''Compact array-backed representation of structures.
+
+Structure dataframes hold the strings of every atom (chain, residue and atom names, elements...) as Python objects,
+which costs a lot of memory per atom and makes every filter a slow comparison of objects. A `StructureArray` holds the
+same table as parallel NumPy arrays instead:
+
+- string columns are integer codes into a small table of categories, with -1 for missing values.
+- coordinates are a single ``(num_atoms, 3)`` array of float64 or float32 values.
+- integer columns that fit are held as int32, other columns are kept as arrays of their own type.
+- residue and chain offset tables give the atoms of the i-th residue (or chain) as
+  ``residue_offsets[i]:residue_offsets[i + 1]``.
+
+Structure arrays convert to and from dataframes without loss (other than float32 coordinates), and are accepted by
+`processing`, `measurements` and `utils.get_coords` in place of dataframes.
+
+'''
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+COORD_COLUMNS = ['pos_x', 'pos_y', 'pos_z']
+
+CODE_DTYPE = np.int32
+
+
+def _encode(values) -> tuple[np.ndarray, np.ndarray]:
+    codes, categories = pd.factorize(np.asarray(values, dtype=object), sort=True)
+
+    return codes.astype(CODE_DTYPE), np.asarray(categories, dtype=object)
+
+
+def _fits_int32(values: np.ndarray) -> bool:
+    limits = np.iinfo(np.int32)
+
+    return len(values) == 0 or (values.min() >= limits.min and values.max() <= limits.max)
+
+
+def _get_offsets(keys: list[np.ndarray], num_atoms: int) -> np.ndarray:
+    # Boundaries are placed wherever any of the keys changes between consecutive atoms
+    boundaries = np.zeros(num_atoms, dtype=bool)
+    boundaries[:1] = True
+
+    for key in keys:
+        boundaries[1:] |= key[1:] != key[:-1]
+
+    return np.append(np.flatnonzero(boundaries), num_atoms)
+
+
+@dataclass
+class StructureArray:
+    '''Columns of a structure held as parallel arrays.
+
+    Residues are runs of consecutive atoms sharing a model, chain, residue number and insert code, and chains are runs
+    of consecutive atoms sharing a model and chain, so atoms are expected in file order.
+
+    '''
+    coords: np.ndarray
+    codes: dict[str, np.ndarray]
+    categories: dict[str, np.ndarray]
+    values: dict[str, np.ndarray]
+    dtypes: dict[str, np.dtype]
+    residue_offsets: np.ndarray = field(init=False)
+    chain_offsets: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        chain_keys = []
+        if 'model_index' in self.values:
+            chain_keys.append(pd.factorize(self.values['model_index'])[0])
+
+        if 'chain_id' in self.codes:
+            chain_keys.append(self.codes['chain_id'])
+
+        residue_keys = list(chain_keys)
+        if 'residue_seq_id' in self.values:
+            residue_keys.append(self.values['residue_seq_id'])
+
+        if 'residue_insert_code' in self.codes:
+            residue_keys.append(self.codes['residue_insert_code'])
+
+        self.chain_offsets = _get_offsets(chain_keys, len(self))
+        self.residue_offsets = _get_offsets(residue_keys, len(self))
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    @property
+    def columns(self) -> list[str]:
+        '''Names of the columns, in the order of the dataframe.'''
+        return list(self.dtypes)
+
+    @property
+    def num_residues(self) -> int:
+        return len(self.residue_offsets) - 1
+
+    @property
+    def num_chains(self) -> int:
+        return len(self.chain_offsets) - 1
+
+    @classmethod
+    def from_dataframe(cls, structure_df: pd.DataFrame, coords_dtype=np.float64) -> 'StructureArray':
+        '''Create a structure array from a structure dataframe.
+
+        Args:
+            structure_df: structure dataframe, as returned by `structure_loader.load_structure`
+            coords_dtype: data type of the coordinates, float32 halves the memory used by coordinates
+
+        '''
+        codes = {}
+        categories = {}
+        values = {}
+
+        for column in structure_df.columns:
+            if column in COORD_COLUMNS:
+                continue
+
+            column_values = structure_df[column].to_numpy()
+
+            if column_values.dtype == object:
+                codes[column], categories[column] = _encode(column_values)
+
+            elif column_values.dtype == np.int64 and _fits_int32(column_values):
+                values[column] = column_values.astype(np.int32)
+
+            else:
+                values[column] = column_values
+
+        coords = structure_df[COORD_COLUMNS].to_numpy(dtype=coords_dtype)
+
+        return cls(coords, codes, categories, values, structure_df.dtypes.to_dict())
+
+    def to_dataframe(self) -> pd.DataFrame:
+        '''Convert the structure array back into a structure dataframe.'''
+        return pd.DataFrame({column: self.get_column(column).astype(dtype, copy=False)
+                             for column, dtype in self.dtypes.items()})
+
+    def get_column(self, column: str) -> np.ndarray:
+        '''Get the values of a column, with string columns decoded into an object array (None for missing values).'''
+        if column in COORD_COLUMNS:
+            return self.coords[:, COORD_COLUMNS.index(column)]
+
+        if column in self.codes:
+            return np.append(self.categories[column], None)[self.codes[column]]
+
+        return self.values[column]
+
+    def get_code(self, column: str, value) -> int:
+        '''Get the code of a value in a string column: -1 for missing values and -2 for values not in the column.'''
+        if value is None:
+            return -1
+
+        matches = np.flatnonzero(self.categories[column] == value)
+
+        return int(matches[0]) if len(matches) > 0 else -2
+
+    def select(self, atoms: np.ndarray) -> 'StructureArray':
+        '''Select atoms by a boolean mask or an array of indices, keeping the categories of the string columns.'''
+        return StructureArray(self.coords[atoms],
+                              {column: codes[atoms] for column, codes in self.codes.items()},
+                              self.categories,
+                              {column: values[atoms] for column, values in self.values.items()},
+                              self.dtypes)
+
+    def get_residue(self, index: int) -> 'StructureArray':
+        '''Get the atoms of the i-th residue.'''
+        return self.select(slice(self.residue_offsets[index], self.residue_offsets[index + 1]))
+
+    def assign(self, **columns) -> 'StructureArray':
+        '''Add or replace columns, given as arrays with a value for every atom.'''
+        codes = dict(self.codes)
+        categories = dict(self.categories)
+        values = dict(self.values)
+        dtypes = dict(self.dtypes)
+
+        for column, column_values in columns.items():
+            column_values = np.asarray(column_values)
+
+            codes.pop(column, None)
+            categories.pop(column, None)
+            values.pop(column, None)
+
+            if column_values.dtype == object:
+                codes[column], categories[column] = _encode(column_values)
+
+            else:
+                values[column] = column_values
+
+            dtypes[column] = column_values.dtype
+
+        return StructureArray(self.coords, codes, categories, values, dtypes)
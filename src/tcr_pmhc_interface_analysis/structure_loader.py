@@ -0,0 +1,202 @@
+'''Load PDB files as dataframes, caching the parsed structures.
+
+Parsing the text of PDB files is one of the slowest steps of the pipeline, and the same files are parsed many times:
+once per comparison in ``compute_apo_holo_differences`` and again by every application reading the STCRDab. Structures
+loaded through this module are cached at two levels:
+
+- in memory, where the most recently used ``MEMORY_CACHE_SIZE`` structures are kept for the lifetime of the process.
+  Copies are returned so callers can modify the dataframes freely.
+- on disk (if enabled), as ``.npz`` files keyed by a hash of the file contents and the parser version. A repeat run (or
+  another application loading the same files) reads these instead of parsing the PDB text again.
+
+Structures can be loaded with a selection of chains, residues, atom names, and models, in which case only the selected
+atoms are parsed (see `pdb_reader`) and cached.
+
+The disk cache is disabled unless ``$TCR_PMHC_CACHE_DIR`` is set to the directory to keep it in. Cache files are never
+removed: the directory grows with every structure (and selection of atoms) parsed, to several gigabytes for the whole
+STCRDab, and files of older parser versions are left behind. Delete the directory to free the space.
+
+'''
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from importlib.metadata import version
+
+import numpy as np
+import pandas as pd
+
+from tcr_pmhc_interface_analysis.pdb_reader import READER_VERSION, parse_pdb_to_pandas
+from tcr_pmhc_interface_analysis.structure_array import StructureArray
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+'''Version of the disk cache layout, increased whenever the stored tables change.'''
+
+MEMORY_CACHE_SIZE = 64
+'''Number of parsed structures kept in memory.'''
+
+PARSER_VERSION = f"pdb_reader-{READER_VERSION}-python_pdb-{version('python_pdb')}-cache-{CACHE_FORMAT_VERSION}"
+
+_memory_cache = OrderedDict()
+
+
+def get_cache_dir() -> str | None:
+    '''Get the directory of the disk cache from ``$TCR_PMHC_CACHE_DIR``, or None if it is disabled.'''
+    return os.environ.get('TCR_PMHC_CACHE_DIR') or None
+
+
+def get_structure_key(pdb_contents: str, selection: dict | None = None) -> str:
+    '''Get the cache key of a structure from its contents, the selected atoms, and the version of the parser.'''
+    digest = hashlib.sha256(PARSER_VERSION.encode())
+    digest.update(pdb_contents.encode())
+
+    if selection:
+        digest.update(repr(sorted(selection.items())).encode())
+
+    return digest.hexdigest()
+
+
+def _to_arrays(structure_df: pd.DataFrame) -> dict[str, np.ndarray] | None:
+    arrays = {'columns': np.array(structure_df.columns, dtype=str)}
+
+    for num, column in enumerate(structure_df.columns):
+        values = structure_df[column]
+
+        if values.dtype != object:
+            arrays[f'values_{num}'] = values.to_numpy()
+            continue
+
+        missing = values.isnull().to_numpy()
+        if not all(isinstance(value, str) for value in values[~missing]):
+            return None
+
+        arrays[f'values_{num}'] = np.array(values.where(~missing, '').tolist(), dtype=str)
+        arrays[f'missing_{num}'] = missing
+
+    return arrays
+
+
+def _from_arrays(arrays) -> pd.DataFrame:
+    columns = {}
+
+    for num, column in enumerate(arrays['columns'].tolist()):
+        values = arrays[f'values_{num}']
+
+        if f'missing_{num}' in arrays:
+            values = np.where(arrays[f'missing_{num}'], None, values.astype(object))
+
+        columns[column] = values
+
+    return pd.DataFrame(columns)
+
+
+def _read_disk_cache(path: str) -> pd.DataFrame | None:
+    try:
+        with np.load(path) as arrays:
+            return _from_arrays(arrays)
+
+    except FileNotFoundError:
+        return None
+
+    except (OSError, ValueError, KeyError) as error:
+        logger.warning('Ignoring unreadable cache file %s: %s', path, error)
+        return None
+
+
+def _write_disk_cache(path: str, structure_df: pd.DataFrame) -> None:
+    arrays = _to_arrays(structure_df)
+
+    if arrays is None:
+        logger.debug('Structure can not be stored in the disk cache')
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so concurrent runs never read a partially written file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as fh:
+            np.savez(fh, **arrays)
+
+        os.replace(fh.name, path)
+
+    except OSError as error:
+        logger.warning('Could not write to the structure cache: %s', error)
+
+
+def _get_selection(chains, residue_range, atom_names, models) -> dict:
+    selection = {
+        'chains': sorted(chains, key=str) if chains is not None else None,
+        'residue_range': tuple(residue_range) if residue_range is not None else None,
+        'atom_names': sorted(atom_names) if atom_names is not None else None,
+        'models': sorted(models) if models is not None else None,
+    }
+
+    return {option: value for option, value in selection.items() if value is not None}
+
+
+def parse_structure(pdb_contents: str,
+                    chains: list[str | None] | None = None,
+                    residue_range: tuple[int, int] | None = None,
+                    atom_names: list[str] | None = None,
+                    models: list[int] | None = None) -> pd.DataFrame:
+    '''Parse the contents of a PDB file into a dataframe, using the cache when the structure was parsed before.
+
+    Args:
+        pdb_contents: text of the PDB file
+        chains: only keep atoms of these chains
+        residue_range: only keep atoms with residue numbers between the first and last number (inclusive)
+        atom_names: only keep atoms with these names
+        models: only keep atoms of these models
+
+    Returns:
+        dataframe of the atoms, as returned by `python_pdb.parsers.parse_pdb_to_pandas`
+
+    '''
+    selection = _get_selection(chains, residue_range, atom_names, models)
+    key = get_structure_key(pdb_contents, selection)
+
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        return _memory_cache[key].copy()
+
+    cache_dir = get_cache_dir()
+    cache_path = os.path.join(cache_dir, key[:2], key + '.npz') if cache_dir else None
+
+    structure_df = _read_disk_cache(cache_path) if cache_path else None
+
+    if structure_df is None:
+        structure_df = parse_pdb_to_pandas(pdb_contents, **selection)
+
+        if cache_path:
+            _write_disk_cache(cache_path, structure_df)
+
+    _memory_cache[key] = structure_df
+    if len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+    return structure_df.copy()
+
+
+def load_structure(path: str, **selection) -> pd.DataFrame:
+    '''Load a PDB file as a dataframe, using the cache when the file was parsed before.
+
+    Args:
+        path: path to the PDB file
+        **selection: selection of atoms to load, see `parse_structure`
+
+    '''
+    with open(path, 'r') as fh:
+        return parse_structure(fh.read(), **selection)
+
+
+def load_structure_array(path: str, coords_dtype=np.float64, **selection) -> StructureArray:
+    '''Load a PDB file as a compact structure array, using the cache when the file was parsed before.'''
+    return StructureArray.from_dataframe(load_structure(path, **selection), coords_dtype)
+
+
+def clear_memory_cache() -> None:
+    '''Remove all structures from the in-memory cache.'''
+    _memory_cache.clear()
@@ -4,10 +4,15 @@ import re
 import pandas as pd
 from python_pdb.formats.residue import THREE_TO_ONE_CODE
 
+from tcr_pmhc_interface_analysis.structure_array import StructureArray
+
 logger = logging.getLogger(__name__)
 
 
 def get_coords(df):
+    if isinstance(df, StructureArray):
+        return df.coords
+
     return df[['pos_x', 'pos_y', 'pos_z']].to_numpy()
 
 
@@ -5,3 +5,45 @@ Test app.
   > $TESTDIR/data/*_distance_matrix.txt
 
   $ diff test.csv $TESTDIR/reference/clusters.csv
+
+Condensed binary distance matrices give the same clusters
+  $ python -c "import numpy as np; import os; \
+  > from tcr_pmhc_interface_analysis.distance_matrices import save_distance_matrix; \
+  > test_dir = os.environ['TESTDIR']; \
+  > save_distance_matrix('cdr1_alpha_distance_matrix.npy', \
+  >                      np.loadtxt(f'{test_dir}/data/cdr1_alpha_distance_matrix.txt'))"
+
+  $ python -m tcr_pmhc_interface_analysis.apps.cluster_cdr_loop_structures \
+  > -o test_binary.csv \
+  > $TESTDIR/data/structure_names.txt \
+  > cdr1_alpha_distance_matrix.npy
+
+  $ diff test_binary.csv $TESTDIR/reference/clusters.csv
+
+Sparse nearest neighbour graphs can be clustered directly (every loop is noise for these three loops)
+  $ python -c "import numpy as np; import os; \
+  > from tcr_pmhc_interface_analysis.distance_matrices import save_distance_matrix, sparsify_distance_matrix; \
+  > test_dir = os.environ['TESTDIR']; \
+  > distance_matrix = np.loadtxt(f'{test_dir}/data/cdr1_alpha_distance_matrix.txt'); \
+  > save_distance_matrix('cdr1_alpha_distance_matrix.npz', sparsify_distance_matrix(distance_matrix, 1))"
+
+  $ python -m tcr_pmhc_interface_analysis.apps.cluster_cdr_loop_structures \
+  > -o test_sparse.csv \
+  > $TESTDIR/data/structure_names.txt \
+  > cdr1_alpha_distance_matrix.npz
+
+  $ diff test_sparse.csv $TESTDIR/reference/clusters.csv
+
+Infinite distances from pairs abandoned early are treated as far apart
+  $ python -c "import numpy as np; import os; \
+  > test_dir = os.environ['TESTDIR']; \
+  > distance_matrix = np.loadtxt(f'{test_dir}/data/cdr1_alpha_distance_matrix.txt'); \
+  > distance_matrix[distance_matrix == distance_matrix.max()] = np.inf; \
+  > np.savetxt('cdr1_alpha_distance_matrix.txt', distance_matrix)"
+
+  $ python -m tcr_pmhc_interface_analysis.apps.cluster_cdr_loop_structures \
+  > -o test_abandoned.csv \
+  > $TESTDIR/data/structure_names.txt \
+  > cdr1_alpha_distance_matrix.txt
+
+  $ diff test_abandoned.csv $TESTDIR/reference/clusters.csv
@@ -169,4 +169,148 @@ Looking at per-residue changes of pMHCs
 
   $ cut -d, -f11 test_pmhc_per_res_apo_holo.csv | sed 1d > test_values
   $ cut -d, -f11 $TESTDIR/reference/pmhc_per_res_apo_holo.csv | sed 1d > reference_values
-  $ python -c "import numpy as np; test_vals = np.loadtxt('test_values'); ref_vals = np.loadtxt('reference_values'); np.testing.assert_array_almost_equal(test_vals, ref_vals)"
\ No newline at end of file
+  $ python -c "import numpy as np; test_vals = np.loadtxt('test_values'); ref_vals = np.loadtxt('reference_values'); np.testing.assert_array_almost_equal(test_vals, ref_vals)"
+Splitting the pMHC by TCR contacts leaves the D-scores unchanged, as the angles are measured over whole chains, only the
+residues at the ends of the new entities lose theirs
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --log-level error \
+  > --select-entities pmhc \
+  > --crop-to-abd \
+  > --per-residue \
+  > --per-residue-measurements d_score \
+  > -o test_pmhc_per_res_apo_holo_d_score.csv \
+  > $TESTDIR/data
+
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --log-level error \
+  > --select-entities pmhc \
+  > --crop-to-abd \
+  > --pmhc-tcr-contact-residues 1058 1059 1061 1061A 1062 1063 1065 1066 1068 1069 1070 1072 1072A 1073 1076 1077 1080 18 58 59 61 62 65 66 68 69 70 72 73 75 76 79 80 \
+  > --per-residue \
+  > --per-residue-measurements d_score \
+  > -o test_pmhc_tcr_contact_per_res_apo_holo_d_score.csv \
+  > $TESTDIR/data
+
+  $ python -c "
+  > import numpy as np, pandas as pd
+  > whole_df = pd.read_csv('test_pmhc_per_res_apo_holo_d_score.csv')
+  > contact_df = pd.read_csv('test_pmhc_tcr_contact_per_res_apo_holo_d_score.csv')
+  > keys = ['complex_id', 'structure_x_name', 'structure_y_name', 'chain_type', 'residue_seq_id', 'residue_insert_code']
+  > merged_df = contact_df.merge(whole_df, on=keys, how='left', suffixes=('', '_whole'), validate='one_to_one')
+  > scored = merged_df['d_score'].notna()
+  > np.testing.assert_allclose(merged_df['d_score'][scored], merged_df['d_score_whole'][scored])
+  > print(len(merged_df), whole_df['d_score'].isna().sum(), contact_df['d_score'].isna().sum())
+  > "
+  3413 72 108
+
+The D-scores of the split pMHC match the reference, whose neighbours are taken in chain order, so that inserted residues
+(such as 1061A, which follows 1061 in the chain but is sorted before it) are next to the residues they are bonded to
+  $ cut -d, -f1-8 test_pmhc_tcr_contact_per_res_apo_holo_d_score.csv > test_entries
+  $ cut -d, -f1-8 $TESTDIR/reference/pmhc_tcr_contact_per_res_apo_holo_d_score.csv > reference_entries
+  $ diff test_entries reference_entries
+
+  $ python -c "
+  > import pandas as pd
+  > test_df = pd.read_csv('test_pmhc_tcr_contact_per_res_apo_holo_d_score.csv')
+  > reference_df = pd.read_csv('$TESTDIR/reference/pmhc_tcr_contact_per_res_apo_holo_d_score.csv')
+  > pd.testing.assert_series_equal(test_df['d_score'], reference_df['d_score'])
+  > print(reference_df.query('residue_insert_code.notna()')['d_score'].notna().sum())
+  > "
+  29
+
+Splitting the complexes between shards and merging the results gives the same output as a single run
+  $ for shard in 1/3 2/3 3/3; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --select-entities pmhc \
+  > --shard $shard \
+  > -o test_pmhc_apo_holo_shard_${shard%/*}.csv \
+  > $TESTDIR/data; done
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards apo_holo_differences -o test_pmhc_apo_holo_merged.csv \
+  > test_pmhc_apo_holo_shard_1.csv test_pmhc_apo_holo_shard_2.csv test_pmhc_apo_holo_shard_3.csv
+
+  $ cmp test_pmhc_apo_holo.csv test_pmhc_apo_holo_merged.csv
+
+The same goes for Parquet files and tables partitioned by complex
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --select-entities pmhc \
+  > -o test_pmhc_apo_holo.parquet \
+  > $TESTDIR/data
+
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --select-entities pmhc \
+  > --format parquet \
+  > --partition-by-complex \
+  > -o test_pmhc_apo_holo_partitioned \
+  > $TESTDIR/data
+
+  $ for shard in 1/3 2/3 3/3; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --select-entities pmhc \
+  > --shard $shard \
+  > -o test_pmhc_apo_holo_shard_${shard%/*}.parquet \
+  > $TESTDIR/data; \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --select-entities pmhc \
+  > --shard $shard \
+  > --format parquet \
+  > --partition-by-complex \
+  > -o test_pmhc_apo_holo_shard_${shard%/*}_partitioned \
+  > $TESTDIR/data; done
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards apo_holo_differences -o test_pmhc_apo_holo_merged.parquet \
+  > test_pmhc_apo_holo_shard_1.parquet test_pmhc_apo_holo_shard_2.parquet test_pmhc_apo_holo_shard_3.parquet
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards apo_holo_differences -o test_pmhc_apo_holo_merged_partitioned \
+  > test_pmhc_apo_holo_shard_1_partitioned test_pmhc_apo_holo_shard_2_partitioned test_pmhc_apo_holo_shard_3_partitioned
+
+  $ python -c "
+  > import pandas as pd
+  > for output in 'test_pmhc_apo_holo.parquet', 'test_pmhc_apo_holo_partitioned':
+  >     merged_output = output.replace('test_pmhc_apo_holo', 'test_pmhc_apo_holo_merged')
+  >     pd.testing.assert_frame_equal(pd.read_parquet(merged_output), pd.read_parquet(output))
+  > "
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards apo_holo_differences -o test_pmhc_apo_holo_mixed \
+  > test_pmhc_apo_holo_shard_1.parquet test_pmhc_apo_holo_shard_2.csv test_pmhc_apo_holo_shard_3.parquet
+  usage: python -m tcr_pmhc_interface_analysis.apps.merge_shards
+         [-h] [--output OUTPUT] [--compress-output] [--output-format {txt,npy}]
+         [--dtype {float64,float32}] [--log-level {debug,info,warning,error}]
+         {pw_distances,apo_holo_differences} shards [shards ...]
+  python -m tcr_pmhc_interface_analysis.apps.merge_shards: error: shards mix CSV and Parquet files
+  [2]
+
+Computing complexes in parallel gives the same output as a serial run
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --log-level error \
+  > --select-entities pmhc \
+  > --per-residue \
+  > --per-residue-measurements rmsd ca_distance chi_angle_change com_distance \
+  > --workers 2 \
+  > -o test_pmhc_per_res_apo_holo_parallel.csv \
+  > $TESTDIR/data
+
+  $ cmp test_pmhc_per_res_apo_holo.csv test_pmhc_per_res_apo_holo_parallel.csv
+
+Computing several configurations from a job file gives the same outputs as separate runs
+  $ cat > jobs.yaml << EOF2
+  > - output: test_tcr_per_res_apo_holo_loop_align_anchors_job.csv
+  >   select-entities: tcr
+  >   align-entities: true
+  >   per-residue: true
+  >   per-residue-measurements: [rmsd, ca_distance, chi_angle_change, com_distance]
+  >   num-anchors: 5
+  > - output: test_pmhc_apo_holo_job.csv
+  >   select-entities: pmhc
+  > - output: test_pmhc_per_res_apo_holo_job.csv
+  >   select-entities: pmhc
+  >   per-residue: true
+  >   per-residue-measurements: [rmsd, ca_distance, chi_angle_change, com_distance]
+  > EOF2
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_apo_holo_differences \
+  > --log-level error \
+  > --jobs jobs.yaml \
+  > $TESTDIR/data
+  $ cmp test_tcr_per_res_apo_holo_loop_align_anchors.csv test_tcr_per_res_apo_holo_loop_align_anchors_job.csv
+  $ cmp test_pmhc_apo_holo.csv test_pmhc_apo_holo_job.csv
+  $ cmp test_pmhc_per_res_apo_holo.csv test_pmhc_per_res_apo_holo_job.csv
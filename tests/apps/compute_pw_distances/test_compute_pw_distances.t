@@ -32,4 +32,275 @@ Test defaults
   > test_dir = os.environ['TESTDIR']; \
   > test_vals = np.loadtxt('test/cdr3_beta_distance_matrix.txt'); \
   > ref_vals = np.loadtxt(f'{test_dir}/reference/cdr3_beta_distance_matrix.txt'); \
-  > np.testing.assert_array_almost_equal(test_vals, ref_vals)"
\ No newline at end of file
+  > np.testing.assert_array_almost_equal(test_vals, ref_vals)"
+Computing tiles over multiple workers gives the same matrices as a serial run
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --workers 2 \
+  > --tile-size 2 \
+  > -o test_workers \
+  > $TESTDIR/data
+
+  $ diff test/structure_names.txt test_workers/structure_names.txt
+  $ for name in test/*_distance_matrix.txt; do cmp $name test_workers/$(basename $name); done
+
+Incrementally adding structures to a previous run only computes the new distances
+  $ mkdir partial
+  $ head -n 3 $TESTDIR/data/db_summary.dat > partial/db_summary.dat
+  $ ln -s $TESTDIR/data/imgt partial/imgt
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error -o test_partial partial
+
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --previous test_partial \
+  > -o test_incremental \
+  > $TESTDIR/data
+
+  $ diff $TESTDIR/reference/structure_names.txt test_incremental/structure_names.txt
+  $ python -c "import numpy as np; import os; \
+  > test_dir = os.environ['TESTDIR']; \
+  > [np.testing.assert_array_almost_equal(np.loadtxt(f'test_incremental/{name}'), \
+  >                                       np.loadtxt(f'{test_dir}/reference/{name}')) \
+  >  for name in os.listdir(f'{test_dir}/reference') if name.endswith('_distance_matrix.txt')]"
+
+... and structures missing from the new selection are removed
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --previous test \
+  > -o test_removed \
+  > partial
+
+  $ cat test_removed/structure_names.txt
+  7zt2_DE
+  7zt3_DE
+  $ for name in test_partial/*_distance_matrix.txt; do cmp $name test_removed/$(basename $name); done
+
+... from previous runs written in any of the full matrix formats
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --compress-output \
+  > -o test_partial_gz \
+  > partial
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --output-format npy \
+  > -o test_partial_npy \
+  > partial
+
+  $ for previous in test_partial_gz test_partial_npy; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --previous $previous \
+  > -o test_incremental_${previous#test_partial_} \
+  > $TESTDIR/data; \
+  > for name in test_incremental/*_distance_matrix.txt; do \
+  > cmp $name test_incremental_${previous#test_partial_}/$(basename $name); done; done
+
+... but not from nearest neighbour graphs, which are missing most of the distances
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --nearest-neighbours 1 \
+  > -o test_partial_neighbours \
+  > partial
+
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --previous test_partial_neighbours \
+  > -o test_incremental_neighbours \
+  > $TESTDIR/data 2>&1 | tail -n 1
+  python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances: error: the previous run in test_partial_neighbours kept only nearest neighbour graphs, --previous needs full distance matrices
+
+Writing condensed binary matrices
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --output-format npy \
+  > --dtype float32 \
+  > -o test_binary \
+  > $TESTDIR/data
+
+  $ ls test_binary
+  cdr1_alpha_distance_matrix.npy
+  cdr1_beta_distance_matrix.npy
+  cdr2_alpha_distance_matrix.npy
+  cdr2_beta_distance_matrix.npy
+  cdr3_alpha_distance_matrix.npy
+  cdr3_beta_distance_matrix.npy
+  structure_names.txt
+
+  $ python -c "import numpy as np; import os; \
+  > from tcr_pmhc_interface_analysis.distance_matrices import load_distance_matrix; \
+  > test_dir = os.environ['TESTDIR']; \
+  > condensed = np.load('test_binary/cdr3_beta_distance_matrix.npy'); \
+  > assert condensed.dtype == np.float32 and condensed.shape == (3,); \
+  > test_vals = load_distance_matrix('test_binary/cdr3_beta_distance_matrix.npy'); \
+  > ref_vals = np.loadtxt(f'{test_dir}/reference/cdr3_beta_distance_matrix.txt'); \
+  > np.testing.assert_array_almost_equal(test_vals, ref_vals, decimal=5)"
+
+Keeping only the nearest neighbours of each loop as sparse graphs
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --nearest-neighbours 1 \
+  > --tile-size 2 \
+  > -o test_neighbours \
+  > $TESTDIR/data
+
+  $ python -c "import numpy as np; import os; \
+  > from tcr_pmhc_interface_analysis.distance_matrices import load_distance_matrix, sparsify_distance_matrix; \
+  > test_dir = os.environ['TESTDIR']; \
+  > test_vals = load_distance_matrix('test_neighbours/cdr3_beta_distance_matrix.npz').toarray(); \
+  > ref_vals = sparsify_distance_matrix(np.loadtxt(f'{test_dir}/reference/cdr3_beta_distance_matrix.txt'), 1); \
+  > np.testing.assert_array_almost_equal(test_vals, ref_vals.toarray()); \
+  > assert np.count_nonzero(test_vals) == 4"
+
+Interrupted runs can be resumed from their checkpoint
+  $ python -c "import sys; \
+  > from tcr_pmhc_interface_analysis.apps import compute_pw_distances as app; \
+  > compute_tile = app.compute_tile; \
+  > calls = []; \
+  > app.compute_tile = lambda *args, **kwargs: calls.append(1) or (compute_tile(*args, **kwargs) if len(calls) <= 3 else sys.exit(1)); \
+  > sys.argv = ['compute_pw_distances', '--log-level', 'error', '-o', 'test_resume', sys.argv[1]]; \
+  > app.main()" $TESTDIR/data
+  [1]
+  $ ls test_resume/checkpoint
+  loops.npz
+  progress.npz
+  $ python -c "import numpy as np; \
+  > print(np.load('test_resume/checkpoint/progress.npz')['completed'])"
+  [ True  True  True False False False]
+
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --resume \
+  > -o test_resume \
+  > $TESTDIR/data
+
+  $ ls test_resume
+  cdr1_alpha_distance_matrix.txt
+  cdr1_beta_distance_matrix.txt
+  cdr2_alpha_distance_matrix.txt
+  cdr2_beta_distance_matrix.txt
+  cdr3_alpha_distance_matrix.txt
+  cdr3_beta_distance_matrix.txt
+  structure_names.txt
+  $ for name in test/*_distance_matrix.txt; do cmp $name test_resume/$(basename $name); done
+
+Resuming requires the same settings as the interrupted run
+  $ python -c "import sys; \
+  > from tcr_pmhc_interface_analysis.apps import compute_pw_distances as app; \
+  > app.compute_tile = lambda *args, **kwargs: sys.exit(1); \
+  > sys.argv = ['compute_pw_distances', '--log-level', 'error', '-o', 'test_mismatch', sys.argv[1]]; \
+  > app.main()" $TESTDIR/data
+  [1]
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --resume \
+  > --number-of-anchors 3 \
+  > -o test_mismatch \
+  > $TESTDIR/data 2>&1 | tail -n 1
+  python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances: error: the checkpoint in test_mismatch/checkpoint was created with different settings
+
+Splitting the tiles between shards and merging the results gives the same matrices as a single run
+  $ for shard in 1/3 2/3 3/3; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --tile-size 2 \
+  > --shard $shard \
+  > -o test_shard_${shard%/*} \
+  > $TESTDIR/data; done
+
+  $ ls test_shard_1
+  shard.npz
+  structure_names.txt
+
+Each shard only stores the distances of its own tiles, 42 of the 54 entries of the six 3x3 matrices between them
+  $ python -c "import sys; \
+  > from tcr_pmhc_interface_analysis.apps.merge_shards import load_shard; \
+  > print([sum(block.size for blocks in load_shard(f'{shard}/shard.npz')[2].values() for _, block in blocks) \
+  >        for shard in sys.argv[1:]])" test_shard_1 test_shard_2 test_shard_3
+  [14, 14, 14]
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards pw_distances -o test_merged \
+  > test_shard_1 test_shard_2 test_shard_3
+
+  $ diff test/structure_names.txt test_merged/structure_names.txt
+  $ for name in test/*_distance_matrix.txt; do cmp $name test_merged/$(basename $name); done
+
+... including the distances reused from a previous run
+  $ for shard in 1/2 2/2; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --previous test_partial \
+  > --tile-size 2 \
+  > --shard $shard \
+  > -o test_incremental_shard_${shard%/*} \
+  > $TESTDIR/data; done
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards pw_distances -o test_incremental_merged \
+  > test_incremental_shard_1 test_incremental_shard_2
+
+  $ for name in test_incremental/*_distance_matrix.txt; do cmp $name test_incremental_merged/$(basename $name); done
+
+... including nearest neighbour graphs
+  $ for shard in 1/2 2/2; do \
+  > python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --nearest-neighbours 1 \
+  > --tile-size 2 \
+  > --shard $shard \
+  > -o test_neighbours_shard_${shard%/*} \
+  > $TESTDIR/data; done
+
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards pw_distances -o test_neighbours_merged \
+  > test_neighbours_shard_1 test_neighbours_shard_2
+
+  $ for name in test_neighbours/*.npz; do \
+  > python -c "import sys; import numpy as np; \
+  > from tcr_pmhc_interface_analysis.distance_matrices import load_distance_matrix; \
+  > assert (load_distance_matrix(sys.argv[1]) != load_distance_matrix(sys.argv[2])).nnz == 0" \
+  > $name test_neighbours_merged/$(basename $name); done
+
+Missing shards are reported when merging
+  $ python -m tcr_pmhc_interface_analysis.apps.merge_shards pw_distances -o test_incomplete \
+  > test_shard_1 test_shard_3 2>&1 | tail -n 1
+  python -m tcr_pmhc_interface_analysis.apps.merge_shards: error: 6 of 18 tiles are missing from the shards
+
+Pairs further apart than --max-dist are abandoned early and stored as infinitely far apart
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --max-dist 1.5 \
+  > --window 20 \
+  > -o test_abandoned \
+  > $TESTDIR/data
+
+  $ cat test_abandoned/early_abandoning.csv
+  chain_type,cdr,num_pairs,num_abandoned
+  alpha_chain,1,3,0
+  alpha_chain,2,3,0
+  alpha_chain,3,3,3
+  beta_chain,1,3,0
+  beta_chain,2,3,0
+  beta_chain,3,3,0
+
+  $ python -c "import numpy as np; import os; \
+  > test_dir = os.environ['TESTDIR']; \
+  > test_vals = np.loadtxt('test_abandoned/cdr3_alpha_distance_matrix.txt'); \
+  > ref_vals = np.loadtxt(f'{test_dir}/reference/cdr3_alpha_distance_matrix.txt'); \
+  > np.testing.assert_array_almost_equal(test_vals, np.where(ref_vals > 1.5, np.inf, ref_vals)); \
+  > np.testing.assert_array_almost_equal(np.loadtxt('test_abandoned/cdr3_beta_distance_matrix.txt'), \
+  >                                      np.loadtxt(f'{test_dir}/reference/cdr3_beta_distance_matrix.txt'))"
+
+Comparing loops of the same length with the superposed RMSD
+  $ python -m tcr_pmhc_interface_analysis.apps.compute_pw_distances --log-level error \
+  > --metric rmsd \
+  > --tile-size 2 \
+  > -o test_rmsd \
+  > $TESTDIR/data
+
+  $ python -c "import os; import numpy as np; \
+  > from python_pdb.aligners import align_pandas_structure; \
+  > from python_pdb.comparisons import rmsd; \
+  > from python_pdb.parsers import parse_pdb_to_pandas; \
+  > from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df; \
+  > from tcr_pmhc_interface_analysis.utils import get_coords; \
+  > test_dir = os.environ['TESTDIR']; \
+  > loops = [annotate_tcr_pmhc_df(parse_pdb_to_pandas(open(f'{test_dir}/data/imgt/{pdb_id}.pdb').read()), 'D', 'E') \
+  >          .query(\"chain_type == 'beta_chain' and cdr == 3 and atom_name in ['N', 'CA', 'C', 'O']\") \
+  >          for pdb_id in ['7zt2', '7zt3']]; \
+  > aligned = align_pandas_structure(get_coords(loops[0]), get_coords(loops[1]), loops[0]); \
+  > test_vals = np.loadtxt('test_rmsd/cdr3_beta_distance_matrix.txt'); \
+  > np.testing.assert_almost_equal(test_vals[0, 1], rmsd(get_coords(aligned), get_coords(loops[1])))"
+
+Loops with different lengths are given the cross length distance
+  $ python -c "import numpy as np; \
+  > from tcr_pmhc_interface_analysis.apps.compute_pw_distances import compute_tile; \
+  > from tcr_pmhc_interface_analysis.loop_store import LoopStore; \
+  > rng = np.random.default_rng(0); \
+  > loops = LoopStore(np.zeros((0, 3)), np.zeros(4, dtype=int), rng.normal(size=(16, 3)), np.array([0, 4, 12, 16])); \
+  > print(compute_tile(loops, (0, 3, 0, 3), metric='rmsd', cross_length_distance=100.0).round(3))"
+  [[  0.    100.      1.214]
+   [  0.      0.    100.   ]
+   [  0.      0.      0.   ]]
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+from python_pdb.aligners import align_pandas_structure
+from python_pdb.comparisons import rmsd
+
+from tcr_pmhc_interface_analysis.align import compute_pairwise_rmsds, compute_superpositions, transform_segments
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+
+    if np.linalg.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+
+    return q
+
+
+class TestComputeSuperpositions:
+    def test_recovers_transforms(self):
+        rng = np.random.default_rng(42)
+        target = rng.normal(size=(10, 3)) * 5
+        rotations = np.array([random_rotation(rng) for _ in range(4)])
+        translations = rng.normal(size=(4, 3)) * 10
+
+        mobile = np.einsum('bai,bji->baj', target - translations[:, np.newaxis, :], rotations)
+
+        computed_rotations, computed_translations = compute_superpositions(mobile, target)
+
+        np.testing.assert_array_almost_equal(computed_rotations, rotations)
+        np.testing.assert_array_almost_equal(computed_translations, translations)
+
+    def test_matches_python_pdb(self):
+        rng = np.random.default_rng(0)
+        mobile = rng.normal(size=(3, 8, 3))
+        target = rng.normal(size=(8, 3))
+
+        rotations, translations = compute_superpositions(mobile, target)
+
+        for coords, rotation, translation in zip(mobile, rotations, translations):
+            df = pd.DataFrame(coords, columns=['pos_x', 'pos_y', 'pos_z'])
+            expected = align_pandas_structure(coords, target, df)[['pos_x', 'pos_y', 'pos_z']].to_numpy()
+
+            np.testing.assert_array_almost_equal(coords @ rotation + translation, expected)
+
+
+class TestTransformSegments:
+    def test(self):
+        rng = np.random.default_rng(1)
+        coords = rng.normal(size=(7, 3))
+        offsets = np.array([0, 3, 7])
+        rotations = np.array([random_rotation(rng) for _ in range(2)])
+        translations = rng.normal(size=(2, 3))
+
+        transformed = transform_segments(coords, offsets, rotations, translations)
+
+        np.testing.assert_array_almost_equal(transformed[:3], coords[:3] @ rotations[0] + translations[0])
+        np.testing.assert_array_almost_equal(transformed[3:], coords[3:] @ rotations[1] + translations[1])
+
+
+class TestComputePairwiseRmsds:
+    def test_matches_python_pdb(self):
+        rng = np.random.default_rng(3)
+        coords_a = rng.normal(size=(2, 6, 3))
+        coords_b = rng.normal(size=(3, 6, 3))
+
+        rmsds = compute_pairwise_rmsds(coords_a, coords_b)
+
+        assert rmsds.shape == (2, 3)
+        for i, mobile in enumerate(coords_a):
+            for j, target in enumerate(coords_b):
+                df = pd.DataFrame(mobile, columns=['pos_x', 'pos_y', 'pos_z'])
+                aligned = align_pandas_structure(mobile, target, df)[['pos_x', 'pos_y', 'pos_z']].to_numpy()
+
+                assert rmsds[i, j] == pytest.approx(rmsd(aligned, target))
+
+    def test_superimposed_copies_have_zero_rmsd(self):
+        rng = np.random.default_rng(4)
+        coords = rng.normal(size=(1, 6, 3))
+        moved = coords @ random_rotation(rng) + rng.normal(size=3)
+
+        np.testing.assert_array_almost_equal(compute_pairwise_rmsds(coords, moved), [[0.0]])
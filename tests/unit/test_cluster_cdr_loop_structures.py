@@ -0,0 +1,46 @@
+import hdbscan
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from tcr_pmhc_interface_analysis.apps.cluster_cdr_loop_structures import cluster_distance_graph
+from tcr_pmhc_interface_analysis.distance_matrices import sparsify_distance_matrix
+
+
+@pytest.fixture
+def distance_matrix():
+    # Three well separated clusters and a few points scattered between them
+    rng = np.random.default_rng(0)
+    points = np.vstack([rng.normal(centre, 0.3, size=(num_points, 2))
+                        for centre, num_points in [((0, 0), 12), ((5, 5), 10), ((0, 6), 8)]]
+                       + [rng.uniform(-3, 9, size=(5, 2))])
+
+    return cdist(points, points)
+
+
+def get_partition(labels):
+    return sorted(tuple(np.flatnonzero(labels == label)) for label in np.unique(labels))
+
+
+def test_complete_graph_matches_full_matrix(distance_matrix):
+    dense_labels = hdbscan.HDBSCAN(min_cluster_size=5, metric='precomputed').fit_predict(distance_matrix)
+    sparse_labels = cluster_distance_graph(sparsify_distance_matrix(distance_matrix, len(distance_matrix) - 1))
+
+    assert len(set(dense_labels) - {-1}) == 3
+    np.testing.assert_array_equal(sparse_labels, dense_labels)
+
+
+@pytest.mark.parametrize('num_neighbours', [5, 8, 15])
+def test_nearest_neighbour_graph_finds_the_same_clusters(distance_matrix, num_neighbours):
+    dense_labels = hdbscan.HDBSCAN(min_cluster_size=5, metric='precomputed').fit_predict(distance_matrix)
+    sparse_labels = cluster_distance_graph(sparsify_distance_matrix(distance_matrix, num_neighbours))
+
+    # Clusters can be numbered differently
+    assert get_partition(sparse_labels) == get_partition(dense_labels)
+
+
+def test_disconnected_graph(distance_matrix):
+    # Only keeping two neighbours leaves the graph in several components, which are bridged to be clustered
+    labels = cluster_distance_graph(sparsify_distance_matrix(distance_matrix, 2))
+
+    assert len(labels) == len(distance_matrix)
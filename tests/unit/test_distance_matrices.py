@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from tcr_pmhc_interface_analysis.distance_matrices import (condense_distance_matrix, expand_distance_matrix,
+                                                           init_nearest_neighbours, load_distance_matrix,
+                                                           merge_nearest_neighbours, save_distance_matrix,
+                                                           sparsify_distance_matrix, update_nearest_neighbours)
+
+
+@pytest.fixture
+def distance_matrix():
+    rng = np.random.default_rng(7)
+    matrix = rng.uniform(size=(5, 5))
+    matrix = np.triu(matrix, 1)
+
+    return matrix + matrix.T
+
+
+class TestCondenseDistanceMatrix:
+    def test_row_major_upper_triangle(self, distance_matrix):
+        expected = distance_matrix[np.triu_indices(5, 1)]
+        np.testing.assert_array_equal(condense_distance_matrix(distance_matrix), expected)
+
+    def test_round_trip(self, distance_matrix):
+        np.testing.assert_array_equal(expand_distance_matrix(condense_distance_matrix(distance_matrix)),
+                                      distance_matrix)
+
+    def test_invalid_length(self):
+        with pytest.raises(ValueError):
+            expand_distance_matrix(np.zeros(4))
+
+
+class TestSaveLoadDistanceMatrix:
+    @pytest.mark.parametrize('name', ['matrix.txt', 'matrix.txt.gz', 'matrix.npy'])
+    def test(self, tmp_path, distance_matrix, name):
+        path = str(tmp_path / name)
+        save_distance_matrix(path, distance_matrix)
+
+        np.testing.assert_array_almost_equal(load_distance_matrix(path), distance_matrix)
+
+    def test_float32(self, tmp_path, distance_matrix):
+        path = str(tmp_path / 'matrix.npy')
+        save_distance_matrix(path, distance_matrix, 'float32')
+
+        assert np.load(path).dtype == np.float32
+
+        loaded_matrix = load_distance_matrix(path)
+
+        assert loaded_matrix.dtype == np.float32
+        np.testing.assert_array_almost_equal(loaded_matrix, distance_matrix, decimal=6)
+
+
+class TestNearestNeighbours:
+    def test_tiles_match_full_matrix(self, distance_matrix):
+        neighbour_distances, neighbour_indices = init_nearest_neighbours(5, 2)
+
+        for tile in [(0, 2, 0, 2), (0, 2, 2, 5), (2, 5, 2, 5)]:
+            row_start, row_stop, col_start, col_stop = tile
+            block = np.triu(distance_matrix, 1)[row_start:row_stop, col_start:col_stop]
+            update_nearest_neighbours(neighbour_distances, neighbour_indices, block, tile)
+
+        expected_indices = np.argsort(distance_matrix + np.diag(np.full(5, np.inf)), axis=1)[:, :2]
+
+        np.testing.assert_array_equal(neighbour_indices, expected_indices)
+        np.testing.assert_array_equal(neighbour_distances,
+                                      np.take_along_axis(distance_matrix, expected_indices, axis=1))
+
+    def test_merged_shards_match_single_run(self, distance_matrix):
+        tiles = [(0, 2, 0, 2), (0, 2, 2, 5), (2, 5, 2, 5)]
+        single = init_nearest_neighbours(5, 2)
+        shards = [init_nearest_neighbours(5, 2), init_nearest_neighbours(5, 2)]
+
+        for shard, tile in zip([0, 0, 1], tiles):
+            row_start, row_stop, col_start, col_stop = tile
+            block = np.triu(distance_matrix, 1)[row_start:row_stop, col_start:col_stop]
+            update_nearest_neighbours(*single, block, tile)
+            update_nearest_neighbours(*shards[shard], block, tile)
+
+        merge_nearest_neighbours(*shards[0], *shards[1])
+
+        np.testing.assert_array_equal(shards[0][0], single[0])
+        np.testing.assert_array_equal(shards[0][1], single[1])
+
+    def test_graph_is_symmetric(self, distance_matrix):
+        graph = sparsify_distance_matrix(distance_matrix, 2)
+
+        assert (graph != graph.T).nnz == 0
+        assert np.all(graph.getnnz(axis=1) >= 2)
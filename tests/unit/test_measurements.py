@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pytest
+from python_pdb.chemistry import MOLECULAR_WEIGHTS
+from python_pdb.comparisons import rmsd
+
+from tcr_pmhc_interface_analysis.chi_atoms import CHI_ATOMS
+from tcr_pmhc_interface_analysis.measurements import (calculate_backbone_dihedrals, calculate_dihedral_angle,
+                                                      calculate_phi_psi_angles, compute_residue_differences,
+                                                      get_backbone_coords, get_distance, measure_chi_angle,
+                                                      measure_chi_angles, sum_segments)
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
+from tcr_pmhc_interface_analysis.utils import get_coords
+
+PDB_PATH = os.path.join(os.path.dirname(__file__), '..', 'apps', 'compute_apo_holo_differences', 'data',
+                        '1ao7_D-E-C-A-B_tcr_pmhc', '1ao7_D-E-C-A-B_tcr_pmhc.pdb')
+
+
+@pytest.fixture(scope='module')
+def chain_df():
+    structure_df = load_structure(PDB_PATH)
+    return structure_df.query("chain_id == 'D' and residue_seq_id <= 30").reset_index(drop=True)
+
+
+def get_backbone(chain_df):
+    residue_ids = chain_df.groupby(['residue_seq_id', 'residue_insert_code'], dropna=False, sort=False).ngroup()
+    residue_ids = residue_ids.to_numpy()
+
+    return get_backbone_coords(chain_df, residue_ids, residue_ids.max() + 1), residue_ids
+
+
+class TestCalculateBackboneDihedrals:
+    def test_matches_single_residues(self, chain_df):
+        backbone_coords, residue_ids = get_backbone(chain_df)
+        residues = [chain_df[residue_ids == residue_id] for residue_id in range(residue_ids.max() + 1)]
+
+        phi, psi, omega = calculate_backbone_dihedrals(*backbone_coords)
+
+        assert np.isnan(phi[0]) and np.isnan(omega[0]) and np.isnan(psi[-1])
+
+        for i in range(1, len(residues) - 1):
+            np.testing.assert_allclose((phi[i], psi[i]),
+                                       calculate_phi_psi_angles(residues[i], residues[i - 1], residues[i + 1]))
+
+        n_coords, ca_coords, c_coords = backbone_coords
+        assert omega[1] == pytest.approx(calculate_dihedral_angle(ca_coords[0], c_coords[0], n_coords[1], ca_coords[1]))
+
+    def test_chain_breaks(self, chain_df):
+        backbone_coords, _ = get_backbone(chain_df)
+        n_coords, ca_coords, c_coords = (coords.copy() for coords in backbone_coords)
+
+        # Moving the second half of the chain away breaks it between residues 9 and 10
+        for coords in n_coords, ca_coords, c_coords:
+            coords[10:] += 10.0
+
+        phi, psi, omega = calculate_backbone_dihedrals(n_coords, ca_coords, c_coords)
+
+        assert np.isnan(psi[9]) and np.isnan(phi[10]) and np.isnan(omega[10])
+        assert not np.isnan(phi[9]) and not np.isnan(psi[10])
+
+    def test_missing_atoms(self, chain_df):
+        seq_id = chain_df['residue_seq_id'].unique()[5]
+        missing_ca = (chain_df['atom_name'] == 'CA') & (chain_df['residue_seq_id'] == seq_id)
+
+        backbone_coords, _ = get_backbone(chain_df[~missing_ca])
+
+        phi, psi, _ = calculate_backbone_dihedrals(*backbone_coords)
+
+        assert np.isnan(phi[5]) and np.isnan(psi[5])
+        assert not np.isnan(psi[4]) and not np.isnan(phi[6])
+
+
+class TestMeasureChiAngles:
+    def test_matches_single_residues(self):
+        structure_df = load_structure(PDB_PATH).query("chain_id == 'D'")
+
+        residue_ids = structure_df.groupby(['chain_id', 'residue_seq_id', 'residue_insert_code'], dropna=False,
+                                           sort=False).ngroup().to_numpy()
+        chi_angles = measure_chi_angles(structure_df, residue_ids, residue_ids.max() + 1)
+
+        for residue_id, residue_df in structure_df.groupby(residue_ids):
+            residue_chi_atoms = CHI_ATOMS.get(residue_df['residue_name'].iloc[0], {1: None})
+
+            for number in range(1, 5):
+                if residue_chi_atoms.get(number) is None:
+                    assert np.isnan(chi_angles[residue_id, number - 1])
+                    continue
+
+                try:
+                    expected = measure_chi_angle(residue_df, number)
+
+                except IndexError:
+                    expected = np.nan
+
+                np.testing.assert_array_equal(chi_angles[residue_id, number - 1], expected)
+
+    def test_selected_numbers(self):
+        structure_df = load_structure(PDB_PATH).query("chain_id == 'D'")
+
+        residue_ids = structure_df.groupby(['chain_id', 'residue_seq_id', 'residue_insert_code'], dropna=False,
+                                           sort=False).ngroup().to_numpy()
+        chi_angles = measure_chi_angles(structure_df, residue_ids, residue_ids.max() + 1)
+
+        np.testing.assert_array_equal(measure_chi_angles(structure_df, residue_ids, residue_ids.max() + 1, [1]),
+                                      chi_angles[:, :1])
+        np.testing.assert_array_equal(measure_chi_angles(structure_df, residue_ids, residue_ids.max() + 1, [3, 2]),
+                                      chi_angles[:, [2, 1]])
+
+    def test_chi_atoms_follow_the_side_chain(self):
+        for residue_chi_atoms in CHI_ATOMS.values():
+            numbers = sorted(residue_chi_atoms)
+            assert numbers == list(range(1, len(numbers) + 1))
+
+            for number in numbers[1:]:
+                assert residue_chi_atoms[number][:3] == residue_chi_atoms[number - 1][1:]
+
+
+def test_sum_segments():
+    values = np.arange(10.0)
+
+    np.testing.assert_array_equal(sum_segments(values, np.array([0, 3, 3, 5, 10])), [3.0, 0.0, 7.0, 35.0])
+
+
+@pytest.mark.parametrize('order', ['C', 'F'])
+def test_compute_residue_differences(chain_df, order):
+    # The same residues with moved atoms stand in for a second conformation
+    residue_ids = chain_df.groupby(['residue_seq_id', 'residue_insert_code'], dropna=False, sort=False).ngroup()
+    offsets = np.append(0, np.cumsum(np.bincount(residue_ids)))
+
+    moved_df = chain_df.copy()
+    moved_df[['pos_x', 'pos_y', 'pos_z']] += np.random.default_rng(0).normal(size=(len(chain_df), 3))
+
+    coords_x, coords_y = (np.asarray(get_coords(df), order=order) for df in (chain_df, moved_df))
+    weights = chain_df['element'].map(MOLECULAR_WEIGHTS).to_numpy(dtype=float)
+    ca_atoms = (chain_df['atom_name'] == 'CA').to_numpy()
+
+    rmsds, ca_distances, com_distances = compute_residue_differences(coords_x, coords_y, weights, weights, ca_atoms,
+                                                                     offsets)
+
+    for residue_id in range(len(offsets) - 1):
+        atoms = slice(offsets[residue_id], offsets[residue_id + 1])
+        ca_atom = np.flatnonzero(ca_atoms[atoms])[0]
+
+        assert rmsds[residue_id] == rmsd(coords_x[atoms], coords_y[atoms])
+        assert ca_distances[residue_id] == get_distance(coords_x[atoms][ca_atom], coords_y[atoms][ca_atom])
+        assert com_distances[residue_id] == get_distance(
+            np.average(coords_x[atoms], weights=weights[atoms], axis=0),
+            np.average(coords_y[atoms], weights=weights[atoms], axis=0),
+        )
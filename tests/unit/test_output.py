@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcr_pmhc_interface_analysis.apps._output import TableWriter, get_output_format
+
+COLUMNS = ['name', 'number', 'value']
+DTYPES = {'number': 'int64', 'value': 'float64'}
+PARQUET_DTYPES = {'name': 'category', 'value': 'float32'}
+
+
+def make_rows(start, stop):
+    return pd.DataFrame({
+        'value': [None if number % 3 == 0 else number / 7 for number in range(start, stop)],
+        'name': [f'row_{number}' if number % 2 else None for number in range(start, stop)],
+        'number': list(range(start, stop)),
+    })
+
+
+def test_get_output_format():
+    assert get_output_format('results.parquet') == 'parquet'
+    assert get_output_format('results.csv') == 'csv'
+    assert get_output_format(None) == 'csv'
+    assert get_output_format('results', 'parquet') == 'parquet'
+
+
+def test_csv_batches_match_single_write(tmp_path):
+    batches = [make_rows(0, 4), make_rows(4, 5), make_rows(5, 5), make_rows(5, 13)]
+
+    with TableWriter(tmp_path / 'batched.csv', COLUMNS, DTYPES, batch_size=3) as writer:
+        for rows in batches:
+            writer.write(rows)
+
+    pd.concat(batches).astype(DTYPES).loc[:, COLUMNS].to_csv(tmp_path / 'single.csv', index=False)
+
+    assert (tmp_path / 'batched.csv').read_text() == (tmp_path / 'single.csv').read_text()
+
+
+def test_rows_are_written_before_closing(tmp_path):
+    writer = TableWriter(tmp_path / 'partial.csv', COLUMNS, DTYPES, batch_size=2)
+    writer.write(make_rows(0, 3))
+
+    assert len(pd.read_csv(tmp_path / 'partial.csv')) == 3
+
+    writer.close()
+
+
+def test_empty_table(tmp_path):
+    with TableWriter(tmp_path / 'empty.csv', COLUMNS, DTYPES):
+        pass
+
+    assert (tmp_path / 'empty.csv').read_text() == 'name,number,value\n'
+
+
+@pytest.mark.parametrize('extension', ['.gz', '.bz2', '.xz'])
+def test_compressed_csv(tmp_path, extension):
+    rows = make_rows(0, 13)
+
+    with TableWriter(tmp_path / f'table.csv{extension}', COLUMNS, DTYPES, batch_size=5) as writer:
+        writer.write(rows)
+
+    rows.astype(DTYPES).loc[:, COLUMNS].to_csv(tmp_path / 'table.csv', index=False)
+
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / f'table.csv{extension}', compression='infer'),
+                                  pd.read_csv(tmp_path / 'table.csv'))
+
+
+def test_archives_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match='can not be written in batches'):
+        TableWriter(tmp_path / 'table.csv.zip', COLUMNS, DTYPES)
+
+
+def test_csv_without_path_goes_to_stdout(capsys):
+    rows = make_rows(0, 5)
+
+    with TableWriter(None, COLUMNS, DTYPES, batch_size=2) as writer:
+        writer.write(rows)
+
+    assert capsys.readouterr().out == rows.astype(DTYPES).loc[:, COLUMNS].to_csv(index=False)
+
+
+def test_parquet_row_groups(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    with TableWriter(tmp_path / 'batched.parquet', COLUMNS, DTYPES, file_format='parquet', batch_size=3) as writer:
+        for rows in make_rows(0, 3), make_rows(3, 4), make_rows(4, 9):
+            writer.write(rows)
+
+    assert pq.ParquetFile(tmp_path / 'batched.parquet').num_row_groups == 2
+
+    table_df = pd.read_parquet(tmp_path / 'batched.parquet')
+    expected_df = make_rows(0, 9).astype(DTYPES).loc[:, COLUMNS]
+
+    assert table_df.columns.tolist() == COLUMNS
+    np.testing.assert_array_equal(table_df['value'], expected_df['value'])
+    assert table_df['name'].isna().tolist() == expected_df['name'].isna().tolist()
+
+
+def test_parquet_dtypes_only_apply_to_parquet(tmp_path):
+    with TableWriter(tmp_path / 'typed.csv', COLUMNS, DTYPES, parquet_dtypes=PARQUET_DTYPES) as writer:
+        writer.write(make_rows(0, 5))
+
+    make_rows(0, 5).astype(DTYPES).loc[:, COLUMNS].to_csv(tmp_path / 'untyped.csv', index=False)
+
+    assert (tmp_path / 'typed.csv').read_text() == (tmp_path / 'untyped.csv').read_text()
+
+
+def test_parquet_dtypes(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    # The names of the first batch are all missing, the categories of later batches still have to fit the schema
+    with TableWriter(tmp_path / 'typed.parquet', COLUMNS, DTYPES, file_format='parquet', batch_size=1,
+                     parquet_dtypes=PARQUET_DTYPES) as writer:
+        for rows in make_rows(0, 1), make_rows(1, 6):
+            writer.write(rows)
+
+    table_df = pd.read_parquet(tmp_path / 'typed.parquet')
+    expected_df = make_rows(0, 6)
+
+    assert isinstance(table_df['name'].dtype, pd.CategoricalDtype)
+    assert table_df['value'].dtype == np.float32
+    assert table_df['name'].isna().tolist() == expected_df['name'].isna().tolist()
+    assert table_df['name'].dropna().tolist() == expected_df['name'].dropna().tolist()
+    np.testing.assert_array_equal(table_df['value'], expected_df['value'].astype('float32'))
+
+
+def test_partitioned_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    def make_grouped_rows(start, stop):
+        rows = make_rows(start, stop)
+        rows['group'] = [f'group_{number // 4}' for number in range(start, stop)]
+
+        return rows
+
+    columns = ['group'] + COLUMNS
+
+    # An earlier run with other groups is replaced
+    with TableWriter(tmp_path / 'table', columns, DTYPES, file_format='parquet', partition_cols=['group']) as writer:
+        writer.write(make_grouped_rows(20, 30))
+
+    with TableWriter(tmp_path / 'table', columns, DTYPES, file_format='parquet', batch_size=3,
+                     parquet_dtypes={'group': 'category'}, partition_cols=['group']) as writer:
+        for rows in make_grouped_rows(0, 5), make_grouped_rows(5, 10):
+            writer.write(rows)
+
+    partitions = sorted(path.name for path in (tmp_path / 'table').iterdir())
+    assert partitions == ['group=group_0', 'group=group_1', 'group=group_2']
+
+    table_df = pd.read_parquet(tmp_path / 'table')
+    expected_df = make_grouped_rows(0, 10).astype(DTYPES)
+
+    assert table_df['group'].astype(str).tolist() == expected_df['group'].tolist()
+    assert table_df['number'].tolist() == expected_df['number'].tolist()
+    np.testing.assert_array_equal(table_df['value'], expected_df['value'])
+
+
+def test_partitioning_needs_parquet(tmp_path):
+    with pytest.raises(ValueError):
+        TableWriter(tmp_path / 'table.csv', COLUMNS, partition_cols=['name'])
@@ -0,0 +1,68 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+from python_pdb.parsers import parse_pdb_to_pandas as parse_pdb_to_pandas_by_line
+
+from tcr_pmhc_interface_analysis import pdb_reader
+from tcr_pmhc_interface_analysis.pdb_reader import parse_pdb_to_pandas
+
+PDB_PATHS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', '**', '*.pdb'), recursive=True))
+TCR_PMHC_PDB_PATH = os.path.join(os.path.dirname(__file__), '..', 'apps', 'compute_apo_holo_differences', 'data',
+                                 '1ao7_D-E-C-A-B_tcr_pmhc', '1ao7_D-E-C-A-B_tcr_pmhc.pdb')
+
+ATOM_LINE = 'ATOM      1  N   GLY A   1       1.000   2.000   3.000  1.00 10.00           N'
+HETATM_LINE = 'HETATM    2  O   HOH B 101A      2.000   3.000   4.000  0.50 10.00           O1-'
+
+
+@pytest.mark.parametrize('pdb_path', PDB_PATHS, ids=os.path.basename)
+def test_matches_python_pdb(pdb_path):
+    with open(pdb_path, 'r') as fh:
+        contents = fh.read()
+
+    pd.testing.assert_frame_equal(parse_pdb_to_pandas(contents), parse_pdb_to_pandas_by_line(contents),
+                                  check_exact=True)
+
+
+@pytest.mark.parametrize('contents', [
+    '',
+    'HEADER    IMMUNE SYSTEM\nEND\n',
+    f'{ATOM_LINE}\r\n{HETATM_LINE}\r\nEND\r\n',
+    f'MODEL        1\n{ATOM_LINE}\nENDMDL\nMODEL        2\n{HETATM_LINE}\nENDMDL\nEND\n',
+    f'MODEL        1\n{ATOM_LINE}\nENDMDL\n{HETATM_LINE}\n',
+    f'MODEL        0\n{ATOM_LINE}\nENDMDL\n',
+    'MODEL        1\nENDMDL\n',
+], ids=['empty', 'no_atoms', 'crlf', 'models', 'atoms_outside_models', 'model_zero', 'empty_model'])
+def test_edge_cases_match_python_pdb(contents):
+    pd.testing.assert_frame_equal(parse_pdb_to_pandas(contents), parse_pdb_to_pandas_by_line(contents),
+                                  check_exact=True)
+
+
+@pytest.mark.parametrize('selection, query', [
+    ({'chains': ['D', 'E']}, "chain_id == 'D' or chain_id == 'E'"),
+    ({'atom_names': ['N', 'CA', 'C', 'O']}, "atom_name in ['N', 'CA', 'C', 'O']"),
+    ({'residue_range': (27, 38)}, 'residue_seq_id >= 27 and residue_seq_id <= 38'),
+    ({'chains': ['A'], 'atom_names': ['CA'], 'residue_range': (1, 91)},
+     "chain_id == 'A' and atom_name == 'CA' and residue_seq_id >= 1 and residue_seq_id <= 91"),
+], ids=['chains', 'atom_names', 'residue_range', 'combined'])
+def test_selection(selection, query, monkeypatch):
+    monkeypatch.setattr(pdb_reader, 'LINES_PER_BLOCK', 1000)
+
+    with open(TCR_PMHC_PDB_PATH, 'r') as fh:
+        contents = fh.read()
+
+    expected = parse_pdb_to_pandas_by_line(contents).query(query).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(parse_pdb_to_pandas(contents, **selection), expected, check_exact=True)
+
+
+def test_model_selection_across_blocks(monkeypatch):
+    monkeypatch.setattr(pdb_reader, 'LINES_PER_BLOCK', 2)
+
+    contents = f'MODEL        1\n{ATOM_LINE}\nENDMDL\nMODEL        2\n{ATOM_LINE}\n{HETATM_LINE}\nENDMDL\nEND\n'
+    expected = parse_pdb_to_pandas_by_line(contents)
+
+    pd.testing.assert_frame_equal(parse_pdb_to_pandas(contents), expected, check_exact=True)
+    pd.testing.assert_frame_equal(parse_pdb_to_pandas(contents, models=[2]),
+                                  expected.query('model_index == 2').reset_index(drop=True), check_exact=True)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from tcr_pmhc_interface_analysis.imgt_numbering import IMGT_MHC_ABD, assign_cdr_number, assign_cdr_numbers, in_mhc_abd
+from tcr_pmhc_interface_analysis.processing import (annotate_tcr_pmhc_df, build_residue_index, encode_atom_keys,
+                                                    find_anchors, match_atoms)
+
+
+def make_structure_df(residues):
+    return pd.DataFrame(residues, columns=['chain_id', 'residue_seq_id', 'residue_insert_code'])
+
+
+def test_lookup_tables_match_imgt_numbering():
+    seq_ids = np.arange(-10, 1200)
+
+    expected_cdrs = [assign_cdr_number(seq_id) for seq_id in seq_ids.tolist()]
+    expected_cdrs = np.array([np.nan if cdr is None else cdr for cdr in expected_cdrs])
+
+    np.testing.assert_array_equal(assign_cdr_numbers(seq_ids), expected_cdrs)
+    np.testing.assert_array_equal(in_mhc_abd(seq_ids), [seq_id in IMGT_MHC_ABD for seq_id in seq_ids.tolist()])
+
+
+def test_annotate_tcr_pmhc_df():
+    structure_df = make_structure_df([
+        ('D', 26, None),
+        ('D', 111, 'A'),
+        ('E', 117, None),
+        ('A', 5, None),
+        ('A', 1005, None),
+        ('B', 5, None),
+        (None, 30, None),
+    ])
+
+    annotated_df = annotate_tcr_pmhc_df(structure_df, 'D', 'E', 'C', 'A', 'B')
+
+    assert annotated_df['chain_type'].tolist() == ['alpha_chain', 'alpha_chain', 'beta_chain', 'mhc_chain1',
+                                                   'mhc_chain1', 'mhc_chain2', None]
+    np.testing.assert_array_equal(annotated_df['cdr'], [np.nan, 3, 3, np.nan, np.nan, np.nan, np.nan])
+    assert annotated_df['mhc_abd'].tolist() == [False, False, False, True, True, False, False]
+
+
+def test_annotate_without_tcr_chains():
+    structure_df = make_structure_df([('A', 30, None), ('C', 1, None)])
+
+    annotated_df = annotate_tcr_pmhc_df(structure_df, antigen_chain_id='C', mhc_chain1_id='A')
+
+    assert annotated_df['cdr'].dtype == object
+    assert annotated_df['cdr'].isnull().all()
+
+
+def test_residue_index_matches_groupby_order():
+    structure_df = make_structure_df([
+        ('E', 1, None),
+        ('D', 112, None),
+        ('D', 111, 'A'),
+        ('D', 111, None),
+        ('D', 111, 'A'),
+        ('D', 110, None),
+    ])
+
+    residue_index = build_residue_index(structure_df)
+
+    expected_keys = [(chain_id, seq_id, None if pd.isna(insert_code) else insert_code)
+                     for chain_id, seq_id, insert_code in structure_df.groupby(
+                         ['chain_id', 'residue_seq_id', 'residue_insert_code'], dropna=False).groups]
+
+    assert residue_index.keys == expected_keys
+    assert residue_index.get_atoms(1, 2).tolist() == [2, 4]
+
+
+def test_find_anchors():
+    structure_df = make_structure_df([('D', seq_id, None) for seq_id in range(100, 122)])
+    structure_df['cdr'] = assign_cdr_numbers(structure_df['residue_seq_id'])
+
+    cdr_df = structure_df.query('cdr == 3')
+    start_anchor, end_anchor = find_anchors(cdr_df, structure_df, 2, build_residue_index(structure_df))
+
+    assert start_anchor['residue_seq_id'].tolist() == [103, 104]
+    assert end_anchor['residue_seq_id'].tolist() == [118, 119]
+
+
+def test_match_atoms_matches_merge():
+    structure_x = make_structure_df([('D', 1, None), ('D', 2, 'A'), ('D', 1, None), (None, 3, None), ('E', 4, None)])
+    structure_y = make_structure_df([('D', 2, 'A'), ('D', 1, None), (None, 3, None), ('D', 1, None), ('D', 5, None)])
+    columns = ['chain_id', 'residue_seq_id', 'residue_insert_code']
+
+    atoms_x, atoms_y = match_atoms(*encode_atom_keys(structure_x, structure_y, columns))
+
+    merged_df = pd.merge(structure_x.reset_index(), structure_y.reset_index(), how='inner', on=columns)
+
+    assert atoms_x.tolist() == merged_df['index_x'].tolist()
+    assert atoms_y.tolist() == merged_df['index_y'].tolist()
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcr_pmhc_interface_analysis.measurements import calculate_phi_psi_angles, compute_residue_com, measure_chi_angle
+from tcr_pmhc_interface_analysis.processing import annotate_tcr_pmhc_df, find_anchors
+from tcr_pmhc_interface_analysis.structure_array import StructureArray
+from tcr_pmhc_interface_analysis.structure_loader import load_structure
+from tcr_pmhc_interface_analysis.utils import get_coords
+
+PDB_PATH = os.path.join(os.path.dirname(__file__), '..', 'apps', 'compute_apo_holo_differences', 'data',
+                        '1ao7_D-E-C-A-B_tcr_pmhc', '1ao7_D-E-C-A-B_tcr_pmhc.pdb')
+CHAINS = ('D', 'E', 'C', 'A', 'B')
+
+
+@pytest.fixture(scope='module')
+def structure_df():
+    return load_structure(PDB_PATH)
+
+
+@pytest.fixture(scope='module')
+def structure(structure_df):
+    return StructureArray.from_dataframe(structure_df)
+
+
+def get_residues(structure_df, chain_id):
+    chain_df = structure_df.query('chain_id == @chain_id')
+
+    return [residue for _, residue in chain_df.groupby(['residue_seq_id', 'residue_insert_code'], dropna=False,
+                                                       sort=False)]
+
+
+class TestStructureArray:
+    def test_round_trip(self, structure_df, structure):
+        pd.testing.assert_frame_equal(structure.to_dataframe(), structure_df)
+
+    def test_offsets(self, structure_df, structure):
+        residue_keys = ['chain_id', 'residue_seq_id', 'residue_insert_code']
+
+        assert structure.num_residues == structure_df.groupby(residue_keys, dropna=False).ngroups
+        assert structure.num_chains == structure_df['chain_id'].nunique()
+
+    def test_select(self, structure_df, structure):
+        mask = (structure_df['atom_name'] == 'CA').to_numpy()
+
+        pd.testing.assert_frame_equal(structure.select(mask).to_dataframe(),
+                                      structure_df[mask].reset_index(drop=True))
+
+    def test_float32_coords(self, structure_df):
+        structure = StructureArray.from_dataframe(structure_df, np.float32)
+
+        assert structure.coords.dtype == np.float32
+        np.testing.assert_allclose(get_coords(structure), get_coords(structure_df), atol=1e-3)
+
+
+class TestProcessing:
+    def test_annotate(self, structure_df, structure):
+        pd.testing.assert_frame_equal(annotate_tcr_pmhc_df(structure, *CHAINS).to_dataframe(),
+                                      annotate_tcr_pmhc_df(structure_df, *CHAINS))
+
+    @pytest.mark.parametrize('chain_type', ['alpha_chain', 'beta_chain'])
+    @pytest.mark.parametrize('cdr', [1, 2, 3])
+    def test_find_anchors(self, structure_df, structure, chain_type, cdr):
+        annotated_df = annotate_tcr_pmhc_df(structure_df, *CHAINS)
+        annotated = annotate_tcr_pmhc_df(structure, *CHAINS)
+
+        mask = ((annotated_df['chain_type'] == chain_type) & (annotated_df['cdr'] == cdr)).to_numpy()
+
+        for anchor_df, anchor in zip(find_anchors(annotated_df[mask], annotated_df, 2),
+                                     find_anchors(annotated.select(mask), annotated, 2)):
+            pd.testing.assert_frame_equal(anchor.to_dataframe(), anchor_df.reset_index(drop=True))
+
+    @pytest.mark.parametrize('cdr_residues', [[(3, 'A')], [(2, None), (3, 'B')], [(1, None), (2, None)]])
+    def test_find_anchors_in_residue_order(self, structure_df, cdr_residues):
+        # Insertion codes out of file order, which are sorted as 3A, 3B, 3 when finding anchors
+        residue_keys = [(1, None), (2, None), (3, 'B'), (3, 'A'), (3, None), (4, None), (5, None)]
+
+        chain_df = structure_df.query("chain_id == 'D'")
+        residues = chain_df.groupby(['residue_seq_id', 'residue_insert_code'], dropna=False, sort=False).ngroup()
+        chain_df = chain_df[residues < len(residue_keys)].copy()
+        residues = residues[residues < len(residue_keys)]
+
+        chain_df['residue_seq_id'] = [residue_keys[residue][0] for residue in residues]
+        chain_df['residue_insert_code'] = [residue_keys[residue][1] for residue in residues]
+        chain_df = chain_df.reset_index(drop=True)
+
+        structure = StructureArray.from_dataframe(chain_df)
+        keys = list(zip(chain_df['residue_seq_id'], chain_df['residue_insert_code']))
+        mask = np.array([key in cdr_residues for key in keys])
+
+        for anchor_df, anchor in zip(find_anchors(chain_df[mask], chain_df, 2),
+                                     find_anchors(structure.select(mask), structure, 2)):
+            pd.testing.assert_frame_equal(anchor.to_dataframe(), anchor_df.reset_index(drop=True))
+
+
+class TestMeasurements:
+    @pytest.mark.parametrize('index', [10, 40, 80])
+    def test_measurements(self, structure_df, structure, index):
+        residues_df = get_residues(structure_df, 'D')
+        chain = structure.select(structure.get_column('chain_id') == 'D')
+
+        np.testing.assert_allclose(compute_residue_com(chain.get_residue(index)),
+                                   compute_residue_com(residues_df[index]))
+
+        np.testing.assert_allclose(
+            calculate_phi_psi_angles(*(chain.get_residue(i) for i in (index, index - 1, index + 1))),
+            calculate_phi_psi_angles(*(residues_df[i] for i in (index, index - 1, index + 1))),
+        )
+
+        if residues_df[index]['residue_name'].iloc[0] not in ('GLY', 'ALA'):
+            assert measure_chi_angle(chain.get_residue(index)) == pytest.approx(measure_chi_angle(residues_df[index]))
@@ -0,0 +1,92 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+from python_pdb.parsers import parse_pdb_to_pandas
+
+from tcr_pmhc_interface_analysis import structure_loader
+from tcr_pmhc_interface_analysis.structure_loader import clear_memory_cache, load_structure, parse_structure
+
+PDB_PATH = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'apps', 'compute_apo_holo_differences',
+                                         'data', '*', '*.pdb')))[0]
+
+MULTI_MODEL_PDB = '''MODEL        1
+ATOM      1  N   GLY A   1       1.000   2.000   3.000  1.00 10.00           N
+ATOM      2  CA  GLY A   1       2.000   3.000   4.000  1.00 10.00           C
+ENDMDL
+MODEL        2
+ATOM      1  N   GLY A   1       1.500   2.500   3.500  1.00 10.00           N
+ATOM      2  CA  GLY A   1       2.500   3.500   4.500  1.00 10.00           C
+ENDMDL
+END
+'''
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCR_PMHC_CACHE_DIR', str(tmp_path / 'cache'))
+    clear_memory_cache()
+
+    yield tmp_path / 'cache'
+
+    clear_memory_cache()
+
+
+def fail_to_parse(pdb_contents):
+    raise AssertionError('structure was parsed again')
+
+
+class TestLoadStructure:
+    def test_matches_parser(self):
+        with open(PDB_PATH, 'r') as fh:
+            expected = parse_pdb_to_pandas(fh.read())
+
+        pd.testing.assert_frame_equal(load_structure(PDB_PATH), expected)
+
+    def test_disk_cache_is_used(self, cache_dir, monkeypatch):
+        expected = load_structure(PDB_PATH)
+        assert len(list(cache_dir.glob('*/*.npz'))) == 1
+
+        clear_memory_cache()
+        monkeypatch.setattr(structure_loader, 'parse_pdb_to_pandas', fail_to_parse)
+
+        pd.testing.assert_frame_equal(load_structure(PDB_PATH), expected)
+
+    def test_copies_are_returned(self, monkeypatch):
+        structure_df = load_structure(PDB_PATH)
+        structure_df['pos_x'] = 0.0
+
+        monkeypatch.setattr(structure_loader, 'parse_pdb_to_pandas', fail_to_parse)
+
+        assert (load_structure(PDB_PATH)['pos_x'] != 0.0).any()
+
+    @pytest.mark.parametrize('cache_dir_setting', [None, ''])
+    def test_disabled_disk_cache(self, cache_dir, tmp_path, monkeypatch, cache_dir_setting):
+        # Nothing is written to the usual cache locations either
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+
+        if cache_dir_setting is None:
+            monkeypatch.delenv('TCR_PMHC_CACHE_DIR')
+
+        else:
+            monkeypatch.setenv('TCR_PMHC_CACHE_DIR', cache_dir_setting)
+
+        load_structure(PDB_PATH)
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == []
+
+    def test_selection(self, cache_dir):
+        expected = load_structure(PDB_PATH).query("chain_id == 'A'").reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(load_structure(PDB_PATH, chains=['A']), expected)
+        assert len(list(cache_dir.glob('*/*.npz'))) == 2
+
+
+class TestParseStructure:
+    def test_multiple_models(self):
+        parse_structure(MULTI_MODEL_PDB)
+        clear_memory_cache()
+
+        pd.testing.assert_frame_equal(parse_structure(MULTI_MODEL_PDB), parse_pdb_to_pandas(MULTI_MODEL_PDB))